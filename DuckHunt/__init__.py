@@ -56,9 +56,14 @@ __contributors__ = {}
 __url__ = "https://github.com/oddluck/limnoria-plugins/"
 
 from . import config
+from . import leaderboard
+from . import store
 from . import plugin
 
-importlib.reload(plugin)  # In case we're being reloaded.
+# In case we're being reloaded.
+importlib.reload(leaderboard)
+importlib.reload(store)
+importlib.reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
 
@@ -0,0 +1,118 @@
+###
+# Copyright (c) 2012, Matthias Meusburger
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+leaderboard: players kept ordered by score or time as their values change.
+"""
+
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """
+    Values by nick, kept sorted (highest first, or lowest first if
+    highest_first is False) in a list searched by bisection: updates, rank
+    and top-N queries don't look at the other players. Players with the same
+    value are listed in the order they joined the board.
+    """
+
+    def __init__(self, items=(), highest_first=True):
+        self.highest_first = highest_first
+        self.total = 0  # Sum of the values
+        self._keys = {}  # nick -> (sort key, order)
+        self._entries = []  # Sorted (sort key, order, nick)
+        for order, (nick, value) in enumerate(items):
+            self._keys[nick] = (self._key(value), order)
+            self.total += value
+        self._order = len(self._keys)
+        self._entries = sorted(key + (nick,) for nick, key in self._keys.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, nick):
+        return nick in self._keys
+
+    def get(self, nick, default=None):
+        if nick not in self._keys:
+            return default
+        return self._key(self._keys[nick][0])
+
+    def set(self, nick, value):
+        if nick in self._keys:
+            key, order = self._keys[nick]
+            del self._entries[bisect_left(self._entries, (key, order))]
+            self.total -= self._key(key)
+        else:
+            order = self._order
+            self._order += 1
+        self._keys[nick] = (self._key(value), order)
+        self.total += value
+        insort(self._entries, (self._key(value), order, nick))
+
+    def add(self, nick, delta):
+        "Adds delta to the value of nick (0 for a new player)"
+        self.set(nick, self.get(nick, 0) + delta)
+
+    def update(self, nick, value):
+        "Sets the value of nick to value if nick has none or a worse one"
+        if nick not in self._keys or self._key(value) < self._keys[nick][0]:
+            self.set(nick, value)
+
+    def remove(self, nick):
+        key, order = self._keys.pop(nick)
+        del self._entries[bisect_left(self._entries, (key, order))]
+        self.total -= self._key(key)
+
+    def top(self, size):
+        "(nick, value) of the size best players, best first"
+        return [(nick, self._key(key)) for key, order, nick in self._entries[:size]]
+
+    def leader(self):
+        """
+        (nick, value) of the best player, None if there is none. Ties go to
+        the greatest nick on highest_first boards and to the smallest one on
+        the others, as max() or min() of (value, nick) would pick.
+        """
+        if not self._entries:
+            return None
+        key = self._entries[0][0]
+        tied = self._entries[: bisect_left(self._entries, (key, self._order))]
+        nicks = [entry[2] for entry in tied]
+        nick = max(nicks) if self.highest_first else min(nicks)
+        return (nick, self._key(key))
+
+    def rank(self, nick):
+        "Rank of nick (1 for the best), players with the same value share it"
+        return bisect_left(self._entries, (self._keys[nick][0],)) + 1
+
+    def _key(self, value):
+        # Its own inverse: turns values into sort keys and back
+        return -value if self.highest_first else value
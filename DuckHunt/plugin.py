@@ -38,7 +38,10 @@ import supybot.log as log
 import supybot.conf as conf
 from operator import itemgetter
 
-import threading, random, pickle, os, time, datetime
+import threading, random, pickle, os, time, datetime, glob
+
+from .leaderboard import Leaderboard
+from .store import ScoreStore
 
 
 class DuckHunt(callbacks.Plugin):
@@ -55,17 +58,13 @@ class DuckHunt(callbacks.Plugin):
     shoots = {}  # Number of successfull shoots in a hunt
     scores = {}  # Scores for the current hunt
     times = {}  # Elapsed time since the last duck was launched
-    channelscores = {}  # Saved scores for the channel
     toptimes = {}  # Times for the current hunt
-    channeltimes = {}  # Saved times for the channel
     worsttimes = {}  # Worst times for the current hunt
-    channelworsttimes = {}  # Saved worst times for the channel
     averagetime = {}  # Average shooting time for the current hunt
     fridayMode = {}  # Are we on friday mode? (automatic)
     manualFriday = {}  # Are we on friday mode? (manual)
     missprobability = {}  # Probability to miss a duck when shooting
     week = {}  # Scores for the week
-    channelweek = {}  # Saved scores for the week
     leader = {}  # Who is the leader for the week?
     reloading = {}  # Who is currently reloading?
     reloadtime = {}  # Time to reload after shooting (in seconds)
@@ -77,7 +76,7 @@ class DuckHunt(callbacks.Plugin):
     maxthrottle = {}
     throttle = {}
 
-    # Where to save scores?
+    # Where to save scores? (fileprefix: pickle files of former versions)
     fileprefix = "DuckHunt_"
     path = conf.supybot.directories.data
 
@@ -91,7 +90,7 @@ class DuckHunt(callbacks.Plugin):
     toplist = 5  # How many high{scores|times} are displayed by default?
     dow = int(time.strftime("%u"))  # Day of week
     woy = int(time.strftime("%V"))  # Week of year
-    year = time.strftime("%Y")
+    year = int(time.strftime("%Y"))
     dayname = [
         "Monday",
         "Tuesday",
@@ -102,136 +101,113 @@ class DuckHunt(callbacks.Plugin):
         "Sunday",
     ]
 
-    def _calc_scores(self, channel):
-        """
-        Adds new scores and times to the already saved ones
-        """
+    def __init__(self, irc):
+        self.__parent = super(DuckHunt, self)
+        self.__parent.__init__(irc)
+        self.store = ScoreStore(self.path.dirize("DuckHunt.db"))
+        self.boards = {}  # Leaderboards by channel
+        self.weekboards = {}  # Week leaderboards by (channel, year, week)
+        self.imported = set()  # Channels whose pickle files have been imported
 
-        # scores
-        # Adding current scores to the channel scores
-        for player, value in self.scores[channel].items():
-            if not player in self.channelscores[channel]:
-                # It's a new player
-                self.channelscores[channel][player] = value
-            else:
-                # It's a player that already has a saved score
-                self.channelscores[channel][player] += value
-
-        # times
-        # Adding times scores to the channel scores
-        for player, value in self.toptimes[channel].items():
-            if not player in self.channeltimes[channel]:
-                # It's a new player
-                self.channeltimes[channel][player] = value
-            else:
-                # It's a player that already has a saved score
-                # And we save the time of the current hunt if it's better than it's previous time
-                if self.toptimes[channel][player] < self.channeltimes[channel][player]:
-                    self.channeltimes[channel][player] = self.toptimes[channel][player]
-
-        # worst times
-        # Adding worst times scores to the channel scores
-        for player, value in self.worsttimes[channel].items():
-            if not player in self.channelworsttimes[channel]:
-                # It's a new player
-                self.channelworsttimes[channel][player] = value
-            else:
-                # It's a player that already has a saved score
-                # And we save the time of the current hunt if it's worst than it's previous time
-                if self.worsttimes[channel][player] > value:
-                    self.channelworsttimes[channel][player] = value
-
-        # week scores
-        for player, value in self.scores[channel].items():
-            # FIXME: If the hunt starts a day and ends the day after, this will produce an error:
-            if not player in self.channelweek[channel][self.woy][self.dow]:
-                # It's a new player
-                self.channelweek[channel][self.woy][self.dow][player] = value
-            else:
-                # It's a player that already has a saved score
-                self.channelweek[channel][self.woy][self.dow][player] += value
+    def die(self):
+        self.store.close()
+        self.__parent.die()
 
     def _write_scores(self, channel):
         """
-        Write scores and times to the disk
+        Adds the scores and times of the current hunt to the saved ones, in a
+        single transaction
         """
-
-        # scores
-        outputfile = open(self.path.dirize(self.fileprefix + channel + ".scores"), "wb")
-        pickle.dump(self.channelscores[channel], outputfile)
-        outputfile.close()
-
-        # times
-        outputfile = open(self.path.dirize(self.fileprefix + channel + ".times"), "wb")
-        pickle.dump(self.channeltimes[channel], outputfile)
-        outputfile.close()
-
-        # worst times
-        outputfile = open(
-            self.path.dirize(self.fileprefix + channel + ".worsttimes"), "wb"
+        self.store.record_hunt(
+            channel,
+            (self.year, self.woy, self.dow),
+            self.scores[channel],
+            self.toptimes[channel],
+            self.worsttimes[channel],
         )
-        pickle.dump(self.channelworsttimes[channel], outputfile)
-        outputfile.close()
+        if channel in self.boards:
+            scores, times, worsttimes = self.boards[channel]
+            for player, value in self.scores[channel].items():
+                scores.add(player, value)
+            for player, value in self.toptimes[channel].items():
+                times.update(player, value)
+            for player, value in self.worsttimes[channel].items():
+                worsttimes.update(player, value)
+        week = self.weekboards.get((channel, self.year, self.woy))
+        if week is not None:
+            for player, value in self.scores[channel].items():
+                week.add(player, value)
+
+    def _boards(self, channel):
+        """
+        Leaderboards of scores, best times and worst times of the channel,
+        read from the score store the first time, then kept up to date
+        """
+        self._read_scores(channel)
+        if channel not in self.boards:
+            self.boards[channel] = (
+                Leaderboard(self.store.scores(channel)),
+                Leaderboard(self.store.best_times(channel), highest_first=False),
+                Leaderboard(self.store.worst_times(channel)),
+            )
+        return self.boards[channel]
 
-        # week scores
-        outputfile = open(
-            self.path.dirize(self.fileprefix + channel + self.year + ".weekscores"),
-            "wb",
-        )
-        pickle.dump(self.channelweek[channel], outputfile)
-        outputfile.close()
+    def _week_board(self, channel, year, week):
+        """
+        Leaderboard of the total scores of a week in the channel
+        """
+        self._read_scores(channel)
+        key = (channel, year, week)
+        if key not in self.weekboards:
+            self.weekboards[key] = Leaderboard(
+                self.store.week_totals(channel, year, week)
+            )
+        return self.weekboards[key]
+
+    def _forget_boards(self, channel):
+        """
+        Drops the leaderboards of the channel, to read them again after
+        scores or times have been merged or removed
+        """
+        self.boards.pop(channel, None)
+        for key in [key for key in self.weekboards if key[0] == channel]:
+            del self.weekboards[key]
 
     def _read_scores(self, channel):
         """
-        Reads scores and times from disk
+        Imports the scores and times saved to pickle files by former versions
+        into the score store, once per channel
         """
-        filename = self.path.dirize(self.fileprefix + channel)
-        # scores
-        if not self.channelscores.get(channel):
-            if os.path.isfile(filename + ".scores"):
-                inputfile = open(filename + ".scores", "rb")
-                self.channelscores[channel] = pickle.load(inputfile)
-                inputfile.close()
-
-        # times
-        if not self.channeltimes.get(channel):
-            if os.path.isfile(filename + ".times"):
-                inputfile = open(filename + ".times", "rb")
-                self.channeltimes[channel] = pickle.load(inputfile)
-                inputfile.close()
-
-        # worst times
-        if not self.channelworsttimes.get(channel):
-            if os.path.isfile(filename + ".worsttimes"):
-                inputfile = open(filename + ".worsttimes", "rb")
-                self.channelworsttimes[channel] = pickle.load(inputfile)
-                inputfile.close()
-
-        # week scores
-        if not self.channelweek.get(channel):
-            if os.path.isfile(filename + self.year + ".weekscores"):
-                inputfile = open(filename + self.year + ".weekscores", "rb")
-                self.channelweek[channel] = pickle.load(inputfile)
-                inputfile.close()
+        if channel in self.imported:
+            return
+        if not self.store.is_imported(channel):
+            filename = self.path.dirize(self.fileprefix + channel)
+            saved = {}
+            for extension in (".scores", ".times", ".worsttimes"):
+                saved[extension] = {}
+                if os.path.isfile(filename + extension):
+                    with open(filename + extension, "rb") as inputfile:
+                        saved[extension] = pickle.load(inputfile)
+            # week scores, one file per year
+            weeks = {}
+            pattern = glob.escape(filename) + "[0-9]" * 4 + ".weekscores"
+            for weekfile in glob.glob(pattern):
+                year = int(weekfile[len(filename) : len(filename) + 4])
+                with open(weekfile, "rb") as inputfile:
+                    weeks[year] = pickle.load(inputfile)
+            self.store.import_channel(
+                channel,
+                saved[".scores"],
+                saved[".times"],
+                saved[".worsttimes"],
+                weeks,
+            )
+        self.imported.add(channel)
 
     def _initdayweekyear(self, channel):
         self.dow = int(time.strftime("%u"))  # Day of week
         self.woy = int(time.strftime("%V"))  # Week of year
-        year = time.strftime("%Y")
-
-        # Init week scores
-        try:
-            self.channelweek[channel]
-        except:
-            self.channelweek[channel] = {}
-        try:
-            self.channelweek[channel][self.woy]
-        except:
-            self.channelweek[channel][self.woy] = {}
-        try:
-            self.channelweek[channel][self.woy][self.dow]
-        except:
-            self.channelweek[channel][self.woy][self.dow] = {}
+        self.year = int(time.strftime("%Y"))
 
     def _initthrottle(self, irc, msg, args, channel):
 
@@ -308,24 +284,6 @@ class DuckHunt(callbacks.Plugin):
 
                 self._initthrottle(irc, msg, args, currentChannel)
 
-                # Init saved scores
-                try:
-                    self.channelscores[currentChannel]
-                except:
-                    self.channelscores[currentChannel] = {}
-
-                # Init saved times
-                try:
-                    self.channeltimes[currentChannel]
-                except:
-                    self.channeltimes[currentChannel] = {}
-
-                # Init saved times
-                try:
-                    self.channelworsttimes[currentChannel]
-                except:
-                    self.channelworsttimes[currentChannel] = {}
-
                 # Init times
                 self.toptimes[currentChannel] = {}
                 self.worsttimes[currentChannel] = {}
@@ -491,21 +449,52 @@ class DuckHunt(callbacks.Plugin):
         """
         currentChannel = msg.args[0]
         if irc.isChannel(currentChannel):
-            self._read_scores(currentChannel)
-            try:
-                self.channelscores[currentChannel]
-            except:
-                self.channelscores[currentChannel] = {}
-
-            try:
-                irc.reply(self.channelscores[currentChannel][nick])
-            except:
+            scores, times, worsttimes = self._boards(currentChannel)
+            if nick in scores:
+                irc.reply(scores.get(nick))
+            else:
                 irc.reply("There is no score for %s on %s" % (nick, currentChannel))
         else:
             irc.error("You have to be on a channel")
 
     score = wrap(score, ["nick"])
 
+    def rank(self, irc, msg, args, channel, nick):
+        """
+        [<channel>] <nick>
+        Shows the rank of <nick> in the score list, the week scores and the time list
+        """
+        if irc.isChannel(channel):
+            scores, times, worsttimes = self._boards(channel)
+            if nick in scores:
+                self._initdayweekyear(channel)
+                week = self._week_board(channel, self.year, self.woy)
+                reply = "%s is #%i of %i with %i points" % (
+                    nick,
+                    scores.rank(nick),
+                    len(scores),
+                    scores.get(nick),
+                )
+                if nick in week:
+                    reply += ", #%i of %i this week with %i points" % (
+                        week.rank(nick),
+                        len(week),
+                        week.get(nick),
+                    )
+                if nick in times:
+                    reply += ", #%i of %i for the fastest time (%s seconds)" % (
+                        times.rank(nick),
+                        len(times),
+                        str(round(times.get(nick), 2)),
+                    )
+                irc.reply(reply)
+            else:
+                irc.reply("There is no score for %s on %s" % (nick, channel))
+        else:
+            irc.error("You have to be on a channel")
+
+    rank = wrap(rank, ["channel", "nick"])
+
     def mergescores(self, irc, msg, args, channel, nickto, nickfrom):
         """
         [<channel>] <nickto> <nickfrom>
@@ -515,37 +504,19 @@ class DuckHunt(callbacks.Plugin):
             self._read_scores(channel)
 
             # Total scores
-            try:
-                self.channelscores[channel][nickto] += self.channelscores[channel][
-                    nickfrom
-                ]
-                del self.channelscores[channel][nickfrom]
-                self._write_scores(channel)
+            self._forget_boards(channel)
+            if self.store.merge_scores(channel, nickto, nickfrom):
                 irc.reply("Total scores merged")
-
-            except:
+            else:
                 irc.error("Can't merge total scores")
 
             # Day scores
-            try:
-                self._initdayweekyear(channel)
-                day = self.dow
-                week = self.woy
-
-                try:
-                    self.channelweek[channel][week][day][nickto] += self.channelweek[
-                        channel
-                    ][week][day][nickfrom]
-                except:
-                    self.channelweek[channel][week][day][nickto] = self.channelweek[
-                        channel
-                    ][week][day][nickfrom]
-
-                del self.channelweek[channel][week][day][nickfrom]
-                self._write_scores(channel)
+            self._initdayweekyear(channel)
+            day = (self.year, self.woy, self.dow)
+            self._forget_boards(channel)
+            if self.store.merge_day_scores(channel, day, nickto, nickfrom):
                 irc.reply("Day scores merged")
-
-            except:
+            else:
                 irc.error("Can't merge day scores")
 
         else:
@@ -559,34 +530,12 @@ class DuckHunt(callbacks.Plugin):
         nickto gets the best time of nickfrom if nickfrom time is better than nickto time, and nickfrom is removed from the timelist. Also works with worst times.
         """
         if irc.isChannel(channel):
-            try:
-                self._read_scores(channel)
-
-                # Merge best times
-                if (
-                    self.channeltimes[channel][nickfrom]
-                    < self.channeltimes[channel][nickto]
-                ):
-                    self.channeltimes[channel][nickto] = self.channeltimes[channel][
-                        nickfrom
-                    ]
-                del self.channeltimes[channel][nickfrom]
-
-                # Merge worst times
-                if (
-                    self.channelworsttimes[channel][nickfrom]
-                    > self.channelworsttimes[channel][nickto]
-                ):
-                    self.channelworsttimes[channel][nickto] = self.channelworsttimes[
-                        channel
-                    ][nickfrom]
-                del self.channelworsttimes[channel][nickfrom]
-
-                self._write_scores(channel)
-
+            self._read_scores(channel)
+            # Merge best and worst times
+            self._forget_boards(channel)
+            if self.store.merge_times(channel, nickto, nickfrom):
                 irc.replySuccess()
-
-            except:
+            else:
                 irc.replyError()
 
         else:
@@ -601,9 +550,11 @@ class DuckHunt(callbacks.Plugin):
         """
         if irc.isChannel(channel):
             self._read_scores(channel)
-            del self.channeltimes[channel][nick]
-            self._write_scores(channel)
-            irc.replySuccess()
+            self._forget_boards(channel)
+            if self.store.remove_time(channel, nick):
+                irc.replySuccess()
+            else:
+                irc.replyError()
 
         else:
             irc.error("Are you sure " + str(channel) + " is a channel?")
@@ -616,13 +567,11 @@ class DuckHunt(callbacks.Plugin):
         Remove <nick>'s score
         """
         if irc.isChannel(channel):
-            try:
-                self._read_scores(channel)
-                del self.channelscores[channel][nick]
-                self._write_scores(channel)
+            self._read_scores(channel)
+            self._forget_boards(channel)
+            if self.store.remove_score(channel, nick):
                 irc.replySuccess()
-
-            except:
+            else:
                 irc.replyError()
 
         else:
@@ -640,29 +589,17 @@ class DuckHunt(callbacks.Plugin):
 
             self._read_scores(channel)
             self._initdayweekyear(channel)
-            day = self.dow
-            week = self.woy
+            day = (self.year, self.woy, self.dow)
 
-            if self.channelweek.get(channel):
-                if self.channelweek[channel].get(week):
-                    if self.channelweek[channel][week].get(day):
-                        # Getting all scores, to get the winner of the week
-                        msgstring = ""
-                        scores = sorted(
-                            iter(self.channelweek[channel][week][day].items()),
-                            key=itemgetter(1),
-                            reverse=True,
-                        )
-                        for item in scores:
-                            msgstring += "(x{0}x: {1}) ".format(item[0], str(item[1]))
+            if self.store.has_day_scores(channel):
+                # Getting all scores of the day, best first
+                msgstring = ""
+                for item in self.store.day_scores(channel, day):
+                    msgstring += "(x{0}x: {1}) ".format(item[0], str(item[1]))
 
-                        if msgstring != "":
-                            irc.reply("Scores for today:")
-                            irc.reply(msgstring)
-                        else:
-                            irc.reply("There aren't any day scores for today yet.")
-                    else:
-                        irc.reply("There aren't any day scores for today yet.")
+                if msgstring != "":
+                    irc.reply("Scores for today:")
+                    irc.reply(msgstring)
                 else:
                     irc.reply("There aren't any day scores for today yet.")
             else:
@@ -681,42 +618,38 @@ class DuckHunt(callbacks.Plugin):
         if irc.isChannel(channel):
 
             self._read_scores(channel)
-            weekscores = {}
 
             if not week:
                 week = self.woy
 
-            if self.channelweek.get(channel):
-                if self.channelweek[channel].get(week):
+            # Scores of the week by day of week
+            days = {}
+            for day, player, value in self.store.week_scores(channel, self.year, week):
+                days.setdefault(day, {})[player] = value
+
+            if self.store.has_day_scores(channel):
+                if days:
                     # Showing the winner for each day
                     if not nick:
                         msgstring = ""
                         # for each day of week
                         for i in (1, 2, 3, 4, 5, 6, 7):
-                            if self.channelweek[channel][week].get(i):
+                            if days.get(i):
                                 # Getting winner of the day
                                 winnernick, winnerscore = max(
-                                    iter(self.channelweek[channel][week][i].items()),
+                                    iter(days[i].items()),
                                     key=lambda k_v: (k_v[1], k_v[0]),
                                 )
                                 msgstring += "{0}: (x{1}x: {2}) ".format(
                                     self.dayname[i - 1], winnernick, str(winnerscore)
                                 )
 
-                        # Getting all scores, to get the winner of the week
-                        for i, players in self.channelweek[channel][week].items():
-                            for player, value in players.items():
-                                weekscores.setdefault(player, 0)
-                                weekscores[player] += value
-
                         if msgstring != "":
                             irc.reply("Scores for week " + str(week) + ":")
                             irc.reply(msgstring)
                             # Who's the winner at this point?
-                            winnernick, winnerscore = max(
-                                iter(weekscores.items()),
-                                key=lambda k_v1: (k_v1[1], k_v1[0]),
-                            )
+                            weekboard = self._week_board(channel, self.year, week)
+                            winnernick, winnerscore = weekboard.leader()
                             irc.reply(
                                 "Leader: x%sx with %i points."
                                 % (winnernick, winnerscore)
@@ -729,17 +662,13 @@ class DuckHunt(callbacks.Plugin):
                         msgstring = ""
                         total = 0
                         for i in (1, 2, 3, 4, 5, 6, 7):
-                            if self.channelweek[channel][week].get(i):
-                                if self.channelweek[channel][week][i].get(nick):
+                            if days.get(i):
+                                if days[i].get(nick):
                                     msgstring += "({0}: {1}) ".format(
                                         self.dayname[i - 1],
-                                        str(
-                                            self.channelweek[channel][week][i].get(nick)
-                                        ),
-                                    )
-                                    total += self.channelweek[channel][week][i].get(
-                                        nick
+                                        str(days[i].get(nick)),
                                     )
+                                    total += days[i].get(nick)
 
                         if msgstring != "":
                             irc.reply(nick + " scores for week " + str(self.woy) + ":")
@@ -764,12 +693,7 @@ class DuckHunt(callbacks.Plugin):
         """
 
         if irc.isChannel(channel):
-            try:
-                self.channelscores[channel]
-            except:
-                self.channelscores[channel] = {}
-
-            self._read_scores(channel)
+            scores, times, worsttimes = self._boards(channel)
 
             # How many results do we display?
             if not size:
@@ -777,13 +701,8 @@ class DuckHunt(callbacks.Plugin):
             else:
                 listsize = size
 
-            # Sort the scores (reversed: the higher the better)
-            scores = sorted(
-                iter(self.channelscores[channel].items()),
-                key=itemgetter(1),
-                reverse=True,
-            )
-            del scores[listsize:]
+            # Best scores first (the higher the better)
+            scores = scores.top(listsize)
 
             msgstring = ""
             for item in scores:
@@ -813,11 +732,9 @@ class DuckHunt(callbacks.Plugin):
 
         if irc.isChannel(channel):
             self._read_scores(channel)
-            if self.channelscores.get(channel):
-                scores = self.channelscores[channel]
-                total = 0
-                for player, value in scores.items():
-                    total += value
+            scores, times, worsttimes = self._boards(channel)
+            if len(scores):
+                total = scores.total
                 irc.reply(str(total) + " ducks have been shot in " + channel + "!")
             else:
                 irc.reply("There are no scores for this channel yet")
@@ -834,17 +751,7 @@ class DuckHunt(callbacks.Plugin):
         """
 
         if irc.isChannel(channel):
-            self._read_scores(channel)
-
-            try:
-                self.channeltimes[channel]
-            except:
-                self.channeltimes[channel] = {}
-
-            try:
-                self.channelworsttimes[channel]
-            except:
-                self.channelworsttimes[channel] = {}
+            scores, besttimes, worsttimes = self._boards(channel)
 
             # How many results do we display?
             if not size:
@@ -852,13 +759,8 @@ class DuckHunt(callbacks.Plugin):
             else:
                 listsize = size
 
-            # Sort the times (not reversed: the lower the better)
-            times = sorted(
-                iter(self.channeltimes[channel].items()),
-                key=itemgetter(1),
-                reverse=False,
-            )
-            del times[listsize:]
+            # Fastest times first (the lower the better)
+            times = besttimes.top(listsize)
 
             msgstring = ""
             for item in times:
@@ -877,12 +779,7 @@ class DuckHunt(callbacks.Plugin):
             else:
                 irc.reply("There aren't any best times for this channel yet.")
 
-            times = sorted(
-                iter(self.channelworsttimes[channel].items()),
-                key=itemgetter(1),
-                reverse=True,
-            )
-            del times[listsize:]
+            times = worsttimes.top(listsize)
 
             msgstring = ""
             for item in times:
@@ -1146,11 +1043,7 @@ class DuckHunt(callbacks.Plugin):
 
         # End the hunt
         self.started[currentChannel] = False
-
-        try:
-            self.channelscores[currentChannel]
-        except:
-            self.channelscores[currentChannel] = {}
+        scores, times, worsttimes = self._boards(currentChannel)
 
         if not self.registryValue("autoRestart", currentChannel):
             irc.reply("The hunt stops now!", prefixNick=False)
@@ -1200,11 +1093,8 @@ class DuckHunt(callbacks.Plugin):
             # Getting channel best time (to see if the best time of this hunt is better)
             channelbestnick = None
             channelbesttime = None
-            if self.channeltimes.get(currentChannel):
-                channelbestnick, channelbesttime = min(
-                    iter(self.channeltimes.get(currentChannel).items()),
-                    key=lambda k_v5: (k_v5[1], k_v5[0]),
-                )
+            if len(times):
+                channelbestnick, channelbesttime = times.leader()
 
             # Showing best time
             recordmsg = ""
@@ -1224,16 +1114,12 @@ class DuckHunt(callbacks.Plugin):
                         + " seconds)"
                     )
                 else:
-                    try:
-                        if value < self.channeltimes[currentChannel][key]:
-                            recordmsg = (
-                                " (this is your new record in this channel! Your"
-                                " previous record was "
-                                + str(round(self.channeltimes[currentChannel][key], 2))
-                                + ")"
-                            )
-                    except:
-                        recordmsg = ""
+                    previous = times.get(key)
+                    if previous and value < previous:
+                        recordmsg = (
+                            " (this is your new record in this channel! Your"
+                            " previous record was " + str(round(previous, 2)) + ")"
+                        )
                 irc.reply(
                     "Best time: %s with %.2f seconds%s" % (key, value, recordmsg),
                     prefixNick=False,
@@ -1244,11 +1130,8 @@ class DuckHunt(callbacks.Plugin):
             # Getting channel worst time (to see if the worst time of this hunt is worst)
             channelworstnick = None
             channelworsttime = None
-            if self.channelworsttimes.get(currentChannel):
-                channelworstnick, channelworsttime = max(
-                    iter(self.channelworsttimes.get(currentChannel).items()),
-                    key=lambda k_v7: (k_v7[1], k_v7[0]),
-                )
+            if len(worsttimes):
+                channelworstnick, channelworsttime = worsttimes.leader()
 
             # Showing worst time
             recordmsg = ""
@@ -1268,20 +1151,14 @@ class DuckHunt(callbacks.Plugin):
                         + " seconds)"
                     )
                 else:
-                    try:
-                        if value > self.channelworsttimes[currentChannel][key]:
-                            recordmsg = (
-                                " (this is your new longest time in this channel! Your"
-                                " previous longest time was "
-                                + str(
-                                    round(
-                                        self.channelworsttimes[currentChannel][key], 2
-                                    )
-                                )
-                                + ")"
-                            )
-                    except:
-                        recordmsg = ""
+                    previous = worsttimes.get(key)
+                    if previous and value > previous:
+                        recordmsg = (
+                            " (this is your new longest time in this channel! Your"
+                            " previous longest time was "
+                            + str(round(previous, 2))
+                            + ")"
+                        )
             except:
                 recordmsg = ""
 
@@ -1297,46 +1174,26 @@ class DuckHunt(callbacks.Plugin):
             # irc.reply("Average shooting time: %.2f seconds" % ((self.averagetime[currentChannel] / self.shoots[currentChannel])))
 
             # Write the scores and times to disk
-            self._calc_scores(currentChannel)
             self._write_scores(currentChannel)
 
             # Did someone took the lead?
-            weekscores = {}
-            if self.channelweek.get(currentChannel):
-                if self.channelweek[currentChannel].get(self.woy):
-                    # for each day of week
-                    for i in (1, 2, 3, 4, 5, 6, 7):
-                        if self.channelweek[currentChannel][self.woy].get(i):
-                            # Getting all scores, to get the winner of the week
-                            for i, players in self.channelweek[currentChannel][
-                                self.woy
-                            ].items():
-                                for player, value in players.items():
-                                    weekscores.setdefault(player, 0)
-                                    weekscores[player] += value
-                            winnernick, winnerscore = max(
-                                iter(weekscores.items()),
-                                key=lambda k_v3: (k_v3[1], k_v3[0]),
-                            )
-                            if winnernick != self.leader[currentChannel]:
-                                if self.leader[currentChannel] != None:
-                                    irc.reply(
-                                        "%s took the lead for the week over %s with %i"
-                                        " points."
-                                        % (
-                                            winnernick,
-                                            self.leader[currentChannel],
-                                            winnerscore,
-                                        ),
-                                        prefixNick=False,
-                                    )
-                                else:
-                                    irc.reply(
-                                        "%s has the lead for the week with %i points."
-                                        % (winnernick, winnerscore),
-                                        prefixNick=False,
-                                    )
-                                self.leader[currentChannel] = winnernick
+            weekboard = self._week_board(currentChannel, self.year, self.woy)
+            if len(weekboard):
+                winnernick, winnerscore = weekboard.leader()
+                if winnernick != self.leader[currentChannel]:
+                    if self.leader[currentChannel] != None:
+                        irc.reply(
+                            "%s took the lead for the week over %s with %i points."
+                            % (winnernick, self.leader[currentChannel], winnerscore),
+                            prefixNick=False,
+                        )
+                    else:
+                        irc.reply(
+                            "%s has the lead for the week with %i points."
+                            % (winnernick, winnerscore),
+                            prefixNick=False,
+                        )
+                    self.leader[currentChannel] = winnernick
         else:
             irc.reply("Not a single duck was shot during this hunt!", prefixNick=False)
 
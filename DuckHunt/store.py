@@ -0,0 +1,320 @@
+###
+# Copyright (c) 2012, Matthias Meusburger
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+store: scores and times of every channel in an SQLite database, updated one
+hunt at a time and read through indexes.
+"""
+
+import sqlite3
+import threading
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS scores (
+        channel TEXT NOT NULL,
+        nick TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        PRIMARY KEY (channel, nick)
+    )""",
+    """CREATE TABLE IF NOT EXISTS besttimes (
+        channel TEXT NOT NULL,
+        nick TEXT NOT NULL,
+        time REAL NOT NULL,
+        PRIMARY KEY (channel, nick)
+    )""",
+    """CREATE TABLE IF NOT EXISTS worsttimes (
+        channel TEXT NOT NULL,
+        nick TEXT NOT NULL,
+        time REAL NOT NULL,
+        PRIMARY KEY (channel, nick)
+    )""",
+    """CREATE TABLE IF NOT EXISTS dayscores (
+        channel TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        week INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        nick TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        PRIMARY KEY (channel, year, week, day, nick)
+    )""",
+    """CREATE INDEX IF NOT EXISTS dayscores_rank
+        ON dayscores (channel, year, week, day, score)""",
+    "CREATE TABLE IF NOT EXISTS imported (channel TEXT PRIMARY KEY)",
+)
+
+ADD_SCORE = (
+    "INSERT INTO scores (channel, nick, score) VALUES (?, ?, ?) "
+    "ON CONFLICT (channel, nick) DO UPDATE SET score = score + excluded.score"
+)
+ADD_DAY_SCORE = (
+    "INSERT INTO dayscores (channel, year, week, day, nick, score) "
+    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (channel, year, week, day, nick) "
+    "DO UPDATE SET score = score + excluded.score"
+)
+ADD_BEST_TIME = (
+    "INSERT INTO besttimes (channel, nick, time) VALUES (?, ?, ?) "
+    "ON CONFLICT (channel, nick) DO UPDATE SET time = MIN(time, excluded.time)"
+)
+ADD_WORST_TIME = (
+    "INSERT INTO worsttimes (channel, nick, time) VALUES (?, ?, ?) "
+    "ON CONFLICT (channel, nick) DO UPDATE SET time = MAX(time, excluded.time)"
+)
+
+
+class ScoreStore:
+    """
+    Scores, best and worst times and day scores by channel and nick. A day is
+    a (year, week, day of week) tuple. Every change is committed in a single
+    transaction. Players are listed in the order they first got a score or
+    time, which breaks ties in the lists.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def record_hunt(self, channel, day, scores, besttimes, worsttimes):
+        """
+        Adds the scores of a hunt to the channel and day scores and keeps the
+        better of the hunt's and the saved best and worst times.
+        """
+        with self._lock, self._db:
+            self._add(channel, scores, besttimes, worsttimes)
+            self._db.executemany(
+                ADD_DAY_SCORE,
+                [(channel,) + tuple(day) + item for item in scores.items()],
+            )
+
+    def score(self, channel, nick):
+        "Saved score of nick, None if nick has none"
+        return self._value(
+            "SELECT score FROM scores WHERE channel = ? AND nick = ?", (channel, nick)
+        )
+
+    def scores(self, channel):
+        "(nick, score) of every player, in the order they first scored"
+        return self._rows(
+            "SELECT nick, score FROM scores WHERE channel = ? ORDER BY rowid",
+            (channel,),
+        )
+
+    def best_times(self, channel):
+        "(nick, time) of every saved best time, in the order they were added"
+        return self._rows(
+            "SELECT nick, time FROM besttimes WHERE channel = ? ORDER BY rowid",
+            (channel,),
+        )
+
+    def worst_times(self, channel):
+        "(nick, time) of every saved worst time, in the order they were added"
+        return self._rows(
+            "SELECT nick, time FROM worsttimes WHERE channel = ? ORDER BY rowid",
+            (channel,),
+        )
+
+    def best_time(self, channel, nick):
+        "Saved best time of nick, None if nick has none"
+        return self._value(
+            "SELECT time FROM besttimes WHERE channel = ? AND nick = ?",
+            (channel, nick),
+        )
+
+    def worst_time(self, channel, nick):
+        "Saved worst time of nick, None if nick has none"
+        return self._value(
+            "SELECT time FROM worsttimes WHERE channel = ? AND nick = ?",
+            (channel, nick),
+        )
+
+    def day_scores(self, channel, day):
+        "(nick, score) of everyone who played on day, best first"
+        return self._rows(
+            "SELECT nick, score FROM dayscores "
+            "WHERE channel = ? AND year = ? AND week = ? AND day = ? "
+            "ORDER BY score DESC, rowid",
+            (channel,) + tuple(day),
+        )
+
+    def week_scores(self, channel, year, week):
+        "(day of week, nick, score) of everyone who played during week"
+        return self._rows(
+            "SELECT day, nick, score FROM dayscores "
+            "WHERE channel = ? AND year = ? AND week = ? ORDER BY day, rowid",
+            (channel, year, week),
+        )
+
+    def week_totals(self, channel, year, week):
+        "(nick, total) of everyone who played during week"
+        return self._rows(
+            "SELECT nick, SUM(score) FROM dayscores "
+            "WHERE channel = ? AND year = ? AND week = ? "
+            "GROUP BY nick ORDER BY MIN(rowid)",
+            (channel, year, week),
+        )
+
+    def has_day_scores(self, channel):
+        return (
+            self._value("SELECT 1 FROM dayscores WHERE channel = ? LIMIT 1", (channel,))
+            is not None
+        )
+
+    def merge_scores(self, channel, nickto, nickfrom):
+        """
+        Adds the score of nickfrom to the one of nickto and removes it. Returns
+        False if either of them has no score.
+        """
+        with self._lock, self._db:
+            score = self.score(channel, nickfrom)
+            if score is None or self.score(channel, nickto) is None:
+                return False
+            self._db.execute(ADD_SCORE, (channel, nickto, score))
+            self._db.execute(
+                "DELETE FROM scores WHERE channel = ? AND nick = ?", (channel, nickfrom)
+            )
+            return True
+
+    def merge_day_scores(self, channel, day, nickto, nickfrom):
+        """
+        Adds the day score of nickfrom to the one of nickto and removes it.
+        Returns False if nickfrom has no score on day.
+        """
+        key = (channel,) + tuple(day)
+        with self._lock, self._db:
+            score = self._value(
+                "SELECT score FROM dayscores WHERE channel = ? AND year = ? "
+                "AND week = ? AND day = ? AND nick = ?",
+                key + (nickfrom,),
+            )
+            if score is None:
+                return False
+            self._db.execute(ADD_DAY_SCORE, key + (nickto, score))
+            self._db.execute(
+                "DELETE FROM dayscores WHERE channel = ? AND year = ? AND week = ? "
+                "AND day = ? AND nick = ?",
+                key + (nickfrom,),
+            )
+            return True
+
+    def merge_times(self, channel, nickto, nickfrom):
+        """
+        Gives nickto the better best time and the worse worst time of both and
+        removes the times of nickfrom. Returns False if either of them lacks a
+        best or worst time.
+        """
+        with self._lock, self._db:
+            times = [
+                self.best_time(channel, nickfrom),
+                self.best_time(channel, nickto),
+                self.worst_time(channel, nickfrom),
+                self.worst_time(channel, nickto),
+            ]
+            if None in times:
+                return False
+            for table, statement, time in (
+                ("besttimes", ADD_BEST_TIME, times[0]),
+                ("worsttimes", ADD_WORST_TIME, times[2]),
+            ):
+                self._db.execute(statement, (channel, nickto, time))
+                self._db.execute(
+                    "DELETE FROM %s WHERE channel = ? AND nick = ?" % table,
+                    (channel, nickfrom),
+                )
+            return True
+
+    def remove_score(self, channel, nick):
+        "Removes the score of nick, returns False if there was none"
+        return self._delete("scores", channel, nick)
+
+    def remove_time(self, channel, nick):
+        "Removes the best time of nick, returns False if there was none"
+        return self._delete("besttimes", channel, nick)
+
+    def is_imported(self, channel):
+        return (
+            self._value("SELECT 1 FROM imported WHERE channel = ?", (channel,))
+            is not None
+        )
+
+    def import_channel(self, channel, scores, besttimes, worsttimes, weeks):
+        """
+        Adds the scores and times of a channel saved in the former format,
+        weeks being {year: {week: {day of week: {nick: score}}}}, and marks
+        the channel as imported.
+        """
+        with self._lock, self._db:
+            self._add(channel, scores, besttimes, worsttimes)
+            self._db.executemany(
+                ADD_DAY_SCORE,
+                [
+                    (channel, year, week, day, nick, score)
+                    for year, yearscores in weeks.items()
+                    for week, weekscores in yearscores.items()
+                    for day, dayscores in weekscores.items()
+                    for nick, score in dayscores.items()
+                ],
+            )
+            self._db.execute("INSERT OR IGNORE INTO imported VALUES (?)", (channel,))
+
+    def _add(self, channel, scores, besttimes, worsttimes):
+        self._db.executemany(ADD_SCORE, [(channel,) + item for item in scores.items()])
+        self._db.executemany(
+            ADD_BEST_TIME, [(channel,) + item for item in besttimes.items()]
+        )
+        self._db.executemany(
+            ADD_WORST_TIME, [(channel,) + item for item in worsttimes.items()]
+        )
+
+    def _delete(self, table, channel, nick):
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM %s WHERE channel = ? AND nick = ?" % table,
+                (channel, nick),
+            )
+            return cursor.rowcount > 0
+
+    def _rows(self, query, parameters):
+        with self._lock:
+            return self._db.execute(query, parameters).fetchall()
+
+    def _row(self, query, parameters):
+        with self._lock:
+            return self._db.execute(query, parameters).fetchone()
+
+    def _value(self, query, parameters):
+        row = self._row(query, parameters)
+        return row[0] if row else None
@@ -26,23 +26,249 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
-###
 
 from supybot.test import *
 
-class DuckHuntTestCase(ChannelPluginTestCase):
-    plugins = ('DuckHunt',)
+import pickle
+import time
+
+# Through the module: loading the plugin reloads it
+from . import leaderboard
 
 
+class DuckHuntTestCase(ChannelPluginTestCase):
+    plugins = ("DuckHunt",)
+
     def tests(self):
-	self.assertResponse("bang", "There is no hunt right now! You can start a hunt with the 'start' command")
-	self.assertResponse("stop", "Nothing to stop: there's no hunt right now.")
-	self.assertResponse("start", "The hunt starts now!")
-	self.assertResponse("start", "There is already a hunt right now!")
-	self.assertRegexp("bang", "^There was no duck!")
-	self.assertResponse("stop", "The hunt stops now!")
-	self.assertNotError("listscores")
-	self.assertNotError("weekscores")
+        self.assertResponse(
+            "bang",
+            "There is no hunt right now! You can start a hunt with the 'starthunt'"
+            " command",
+        )
+        self.assertResponse("stophunt", "Nothing to stop: there's no hunt right now.")
+        self.assertResponse("starthunt", "The hunt starts now!")
+        self.assertResponse("starthunt", "There is already a hunt right now!")
+        self.assertRegexp("bang", "^There was no duck!")
+        self.assertResponse("stophunt", "The hunt stops now!")
+        self.assertNotError("listscores")
+        self.assertNotError("weekscores")
+
+
+class HuntTestCase(ChannelPluginTestCase):
+    plugins = ("DuckHunt",)
+    config = {
+        "reply.withNickPrefix": False,
+        "plugins.DuckHunt.kickMode": False,
+        "plugins.DuckHunt.ducks": 1,
+    }
+
+    def hunt(self, nick):
+        """
+        Runs a hunt of one duck shot by nick and returns the replies to the
+        shot
+        """
+        cb = self.irc.getCallback("DuckHunt")
+        cb.debug = 1
+        self.assertResponse("starthunt", "The hunt starts now!")
+        cb.missprobability[self.channel] = 0
+        self.assertNotError("dbg")
+        self.irc.feedMsg(
+            ircmsgs.privmsg(self.channel, "@bang", prefix=nick + "!user@host")
+        )
+        replies = []
+        msg = self.irc.takeMsg()
+        while msg is not None:
+            replies.append(msg.args[1])
+            msg = self.irc.takeMsg()
+        return replies
+
+    def testEmptyWeekBoard(self):
+        cb = self.irc.getCallback("DuckHunt")
+        cb._initdayweekyear(self.channel)
+        # Read before anyone scored this week, then kept up to date
+        week = cb._week_board(self.channel, cb.year, cb.woy)
+        self.assertEqual(len(week), 0)
+        replies = self.hunt("alice")
+        self.assertIn("alice has the lead for the week with 6 points.", replies)
+        self.assertEqual(week.get("alice"), 6)
+        self.assertRegexp("rank alice", "#1 of 1 this week with 6 points")
+
+
+class LeaderboardTestCase(SupyTestCase):
+    def testTies(self):
+        items = [("carol", 5), ("alice", 7), ("dave", 7), ("bob", 7), ("erin", 1)]
+        board = leaderboard.Leaderboard(items)
+        # Lists keep the order players joined in, the leader is picked by nick
+        self.assertEqual(board.top(3), [("alice", 7), ("dave", 7), ("bob", 7)])
+        self.assertEqual(
+            board.leader(), max(items, key=lambda item: (item[1], item[0]))
+        )
+        self.assertEqual(
+            [board.rank(nick) for nick in "alice bob carol".split()], [1, 1, 4]
+        )
+        board = leaderboard.Leaderboard(items, highest_first=False)
+        self.assertEqual(board.top(2), [("erin", 1), ("carol", 5)])
+        board.set("aaron", 1)
+        self.assertEqual(
+            board.leader(),
+            min(items + [("aaron", 1)], key=lambda item: (item[1], item[0])),
+        )
+        self.assertEqual(leaderboard.Leaderboard().leader(), None)
+
+
+class ImportTestCase(ChannelPluginTestCase):
+    plugins = ("DuckHunt",)
+    config = {"reply.withNickPrefix": False}
+    # Saved by former versions: total scores, best and worst times, and day
+    # scores by week and day of week, in a file per year
+    scores = {"alice": 12, "bob": 30, "carol": 12, "dave": 5}
+    times = {"alice": 2.5, "bob": 1.25, "carol": 3.0}
+    worsttimes = {"alice": 95.0, "bob": 20.0, "carol": 3725.0}
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.year = int(time.strftime("%Y"))
+        self.week = int(time.strftime("%V"))
+        self.today = int(time.strftime("%u"))
+        # Another day of the same week
+        self.other = 1 if self.today != 1 else 2
+        weeks = {
+            self.year: {
+                self.week: {
+                    self.other: {"carol": 4, "bob": 4},
+                    self.today: {"alice": 3, "bob": 2},
+                }
+            },
+            self.year - 1: {1: {1: {"dave": 7}}},
+        }
+        prefix = conf.supybot.directories.data.dirize("DuckHunt_" + self.channel)
+        self.save(prefix + ".scores", self.scores)
+        self.save(prefix + ".times", self.times)
+        self.save(prefix + ".worsttimes", self.worsttimes)
+        for (year, yearscores) in weeks.items():
+            self.save("%s%d.weekscores" % (prefix, year), yearscores)
+        self.cb = self.irc.getCallback("DuckHunt")
+
+    def save(self, filename, data):
+        with open(filename, "wb") as f:
+            pickle.dump(data, f)
+
+    def replies(self, query):
+        """
+        Sends a command and returns all the replies
+        """
+        self.irc.feedMsg(
+            ircmsgs.privmsg(self.channel, "@" + query, prefix="foo!bar@baz")
+        )
+        replies = []
+        msg = self.irc.takeMsg()
+        while msg is not None:
+            replies.append(msg.args[1])
+            msg = self.irc.takeMsg()
+        return replies
+
+    def testImportOnce(self):
+        self.assertResponse("total", "59 ducks have been shot in #test!")
+        self.assertTrue(self.cb.store.is_imported(self.channel))
+        self.assertEqual(
+            self.cb.store.week_totals(self.channel, self.year - 1, 1), [("dave", 7)]
+        )
+        # A new instance of the plugin finds the channel imported
+        self.cb.imported.clear()
+        self.cb.boards.clear()
+        self.assertResponse("total", "59 ducks have been shot in #test!")
+        self.assertEqual(self.cb.store.scores(self.channel), list(self.scores.items()))
+
+    def testListScores(self):
+        self.assertEqual(
+            self.replies("listscores"),
+            [
+                "\\_o< ~ DuckHunt top-5 scores for #test ~ >o_/",
+                "(xbobx: 30) (xalicex: 12) (xcarolx: 12) (xdavex: 5) ",
+            ],
+        )
+        self.assertEqual(
+            self.replies("listscores 2"),
+            [
+                "\\_o< ~ DuckHunt top-2 scores for #test ~ >o_/",
+                "(xbobx: 30) (xalicex: 12) ",
+            ],
+        )
+
+    def testListTimes(self):
+        self.assertEqual(
+            self.replies("listtimes"),
+            [
+                "\\_o< ~ DuckHunt top-5 fastest times for #test ~ >o_/",
+                "(xbobx: 1.25) (xalicex: 2.5) (xcarolx: 3.0) ",
+                "\\_o< ~ DuckHunt top-5 longest times for #test ~ >o_/",
+                "(xcarolx: 1:02:05) (xalicex: 0:01:35) (xbobx: 0:00:20) ",
+            ],
+        )
+
+    def testDayScores(self):
+        self.assertEqual(
+            self.replies("dayscores"), ["Scores for today:", "(xalicex: 3) (xbobx: 2) "]
+        )
+
+    def testWeekScores(self):
+        days = sorted([(self.other, "carol", 4), (self.today, "alice", 3)])
+        self.assertEqual(
+            self.replies("weekscores"),
+            [
+                "Scores for week %d:" % self.week,
+                "".join(
+                    "%s: (x%sx: %d) " % (self.cb.dayname[day - 1], nick, score)
+                    for (day, nick, score) in days
+                ),
+                "Leader: xbobx with 6 points.",
+            ],
+        )
+        days = sorted([(self.other, 4), (self.today, 2)])
+        self.assertEqual(
+            self.replies("weekscores %d bob" % self.week),
+            [
+                "bob scores for week %d:" % self.week,
+                "".join(
+                    "(%s: %d) " % (self.cb.dayname[day - 1], score)
+                    for (day, score) in days
+                ),
+                "Total: 6 points.",
+            ],
+        )
+
+    def testMerge(self):
+        self.assertEqual(
+            self.replies("mergescores bob alice"),
+            ["Total scores merged", "Day scores merged"],
+        )
+        self.assertResponse("score bob", "42")
+        self.assertResponse("score alice", "There is no score for alice on #test")
+        self.assertEqual(
+            self.replies("dayscores"), ["Scores for today:", "(xbobx: 5) "]
+        )
+        self.assertResponse("mergetimes carol bob", "The operation succeeded.")
+        self.assertEqual(
+            self.replies("listtimes"),
+            [
+                "\\_o< ~ DuckHunt top-5 fastest times for #test ~ >o_/",
+                "(xcarolx: 1.25) (xalicex: 2.5) ",
+                "\\_o< ~ DuckHunt top-5 longest times for #test ~ >o_/",
+                "(xcarolx: 1:02:05) (xalicex: 0:01:35) ",
+            ],
+        )
+        self.assertResponse("total", "59 ducks have been shot in #test!")
+
+    def testRemove(self):
+        self.assertResponse("rmscore dave", "The operation succeeded.")
+        self.assertRegexp("rmscore dave", "error has occurred")
+        self.assertResponse("rmtime alice", "The operation succeeded.")
+        self.assertRegexp("rmtime alice", "error has occurred")
+        self.assertEqual(
+            self.replies("listscores")[1], "(xbobx: 30) (xalicex: 12) (xcarolx: 12) "
+        )
+        self.assertEqual(self.replies("listtimes")[1], "(xbobx: 1.25) (xcarolx: 3.0) ")
+        self.assertResponse("total", "54 ducks have been shot in #test!")
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -55,10 +55,22 @@ __contributors__ = {}
 __url__ = "https://github.com/oddluck/limnoria-plugins/"
 
 from . import config
+from . import breaker
+from . import cache
+from . import resolver
+from . import router
+from . import sessions
+from . import titlereader
 from . import plugin
 from importlib import reload
 
 # In case we're being reloaded.
+reload(breaker)
+reload(cache)
+reload(resolver)
+reload(router)
+reload(sessions)
+reload(titlereader)
 reload(plugin)
 reload(config)
 # Add more reloads here if you add third-party modules and want them to be
@@ -0,0 +1,374 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Offline benchmarks for the link handlers. Recorded upstream responses from
+fixtures/ are replayed by a local stand-in server, so latency, allocations
+and throughput can be measured without touching the real services.
+
+Timings depend on the machine, so this is not part of the test suite. Run it
+by hand with:
+
+    python plugins/SpiffyTitles/benchmark.py
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    # Not a package import: drop the plugin directory from the path so its
+    # modules don't shadow others, then use the same throwaway configuration
+    # as supybot-test. This has to happen before supybot.conf is imported.
+    sys.path.remove(os.path.dirname(os.path.abspath(__file__)))
+    from supybot.scripts import limnoria_test
+
+from supybot.test import *
+
+import collections
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import praw
+from requests.adapters import HTTPAdapter
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+SERVICES = ("youtube", "twitch", "omdb", "wikipedia", "reddit", "imgur", "generic")
+
+# Regression budgets. The stand-in server answers from memory, so these only
+# trip when the plugin itself gets slower or hungrier.
+ROUNDS = 20
+MAX_MEDIAN_LATENCY = 0.05  # seconds per link
+MAX_PEAK_ALLOCATION = 1024 * 1024  # bytes per link
+MIN_THROUGHPUT = 30  # links per second of channel traffic
+
+
+def load_fixtures():
+    fixtures = {}
+    for service in SERVICES:
+        with open(os.path.join(FIXTURES, service + ".json"), encoding="utf-8") as f:
+            fixtures[service] = json.load(f)
+    return fixtures
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let them wait for an ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.replay()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.replay()
+
+    def replay(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        response = self.server.find(
+            self.command, self.headers.get("Host", ""), parts.path, params
+        )
+        if response is None:
+            status, headers, body = (404, {}, b"")
+        else:
+            status, headers, body = self.server.render(response, params)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Answers with the recorded responses, matched on method, Host header,
+    path and the query parameters given in the recording.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures):
+        super().__init__(("127.0.0.1", 0), ReplayHandler)
+        self.url = "http://127.0.0.1:%s" % self.server_port
+        self.responses = {}
+        for fixture in fixtures.values():
+            for response in fixture["responses"]:
+                parts = urlsplit(response["url"])
+                key = (response.get("method", "GET"), parts.netloc, parts.path)
+                self.responses.setdefault(key, []).append(response)
+        self.bodies = {}
+        self.requests = 0
+        self.hits = collections.Counter()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def find(self, method, host, path, params):
+        self.requests += 1
+        self.hits[host + path] += 1
+        for response in self.responses.get((method, host, path), ()):
+            expected = response.get("params", {})
+            if all(params.get(name) == value for name, value in expected.items()):
+                return response
+
+    def render(self, response, params):
+        headers = dict(response.get("headers", {}))
+        if "json" in response:
+            headers.setdefault("Content-Type", "application/json; charset=UTF-8")
+        if "filter" in response:
+            # Only the items asked for, as list endpoints do
+            wanted = params.get(response["filter"], "").split(",")
+            data = response["json"]
+            data = dict(data, items=[i for i in data["items"] if i["id"] in wanted])
+            body = json.dumps(data).encode("utf-8")
+        else:
+            # Rendered once, so the server's allocations stay out of the way
+            body = self.bodies.get(id(response))
+            if body is None:
+                body = self.bodies[id(response)] = self.encode(response)
+        return (response.get("status", 200), headers, body)
+
+    def encode(self, response):
+        if "json" in response:
+            return json.dumps(response["json"]).encode("utf-8")
+        elif "size" in response:
+            return bytes(response["size"])
+        body = response.get("body", "").encode(response.get("encoding", "utf-8"))
+        return body + b"<p>" + b"lorem ipsum " * (response.get("padding", 0) // 12)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up once they have read the title
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Sends every request to the stand-in server instead of the real host,
+    which is passed along in the Host header.
+    """
+
+    def __init__(self, server_url, **kwargs):
+        self.server_url = server_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = request.url
+        request.headers["Host"] = urlsplit(url).netloc
+        request.url = self.server_url + request.path_url
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            request.url = url
+        response.url = url
+        return response
+
+
+def report(title, rows):
+    print("\n%s" % title, file=sys.stderr)
+    for row in rows:
+        print("  " + row, file=sys.stderr)
+
+
+class SpiffyTitlesBenchmark(ChannelPluginTestCase):
+    plugins = ("SpiffyTitles",)
+    config = {
+        "supybot.plugins.SpiffyTitles.cacheLifetime": 0,
+        "supybot.plugins.SpiffyTitles.snarfMultipleUrls": True,
+        "supybot.plugins.SpiffyTitles.youtube.developerKey": "benchmark",
+        "supybot.plugins.SpiffyTitles.twitch.clientID": "benchmark",
+        "supybot.plugins.SpiffyTitles.twitch.accessToken": "benchmark",
+        "supybot.plugins.SpiffyTitles.imdb.omdbAPI": "benchmark",
+        "supybot.plugins.SpiffyTitles.imgur.clientID": "benchmark",
+    }
+    fixtures = load_fixtures()
+    server = None
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        if SpiffyTitlesBenchmark.server is None:
+            SpiffyTitlesBenchmark.server = StandInServer(self.fixtures)
+        self.cb = self.irc.getCallback("SpiffyTitles")
+        self.replay(self.cb)
+
+    def replay(self, cb):
+        """
+        Points the plugin's HTTP sessions and Reddit client at the server
+        """
+        pool = cb.sessions
+        get_session = pool.session
+
+        def session(url):
+            session = get_session(url)
+            if not isinstance(session.get_adapter("https://"), ReplayAdapter):
+                adapter = ReplayAdapter(self.server.url, pool_maxsize=pool.pool_maxsize)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+            return session
+
+        pool.session = session
+        cb.reddit = praw.Reddit(
+            client_id="benchmark",
+            client_secret="benchmark",
+            user_agent="SpiffyTitles benchmark",
+            check_for_updates=False,
+            requestor_kwargs={"session": session("https://www.reddit.com/")},
+        )
+
+    def links(self, service=None):
+        services = [service] if service else SERVICES
+        return [link for name in services for link in self.fixtures[name]["links"]]
+
+    def testFixtures(self):
+        for link in self.links():
+            title = self.cb.get_title_by_url(link["url"], self.channel)
+            self.assertIn(link["title"], title or "", link["url"])
+
+    def testHandlerLatency(self):
+        rows = []
+        for service in SERVICES:
+            links = self.links(service)
+            timings = []
+            for _ in range(ROUNDS):
+                for link in links:
+                    start = time.perf_counter()
+                    self.cb.get_title_by_url(link["url"], self.channel)
+                    timings.append(time.perf_counter() - start)
+            median = statistics.median(timings)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            rows.append(
+                "%-10s median %6.2fms  p95 %6.2fms  (%s lookups)"
+                % (service, median * 1000, p95 * 1000, len(timings))
+            )
+            self.assertLess(median, MAX_MEDIAN_LATENCY, service)
+        report("Handler latency", rows)
+
+    def testHandlerAllocations(self):
+        rows = []
+        tracemalloc.start()
+        try:
+            for service in SERVICES:
+                peaks = []
+                blocks = []
+                for link in self.links(service):
+                    # Once to warm up lazy imports and connections
+                    self.cb.get_title_by_url(link["url"], self.channel)
+                    before = tracemalloc.take_snapshot()
+                    tracemalloc.reset_peak()
+                    current, _ = tracemalloc.get_traced_memory()
+                    self.cb.get_title_by_url(link["url"], self.channel)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - current)
+                    after = tracemalloc.take_snapshot()
+                    blocks.append(
+                        sum(
+                            stat.count_diff
+                            for stat in after.compare_to(before, "filename")
+                            if stat.count_diff > 0
+                        )
+                    )
+                rows.append(
+                    "%-10s peak %7.1fKiB  retained blocks %5d"
+                    % (service, max(peaks) / 1024, max(blocks))
+                )
+                self.assertLess(max(peaks), MAX_PEAK_ALLOCATION, service)
+        finally:
+            tracemalloc.stop()
+        report("Handler allocations (per link, worst case)", rows)
+
+    def testYoutubeBatching(self):
+        links = [link["url"] for link in self.links("youtube")]
+        with conf.supybot.plugins.SpiffyTitles.youtube.batchWindow.context(0.2):
+            with conf.supybot.plugins.SpiffyTitles.concurrentPerDomain.context(8):
+                hits = self.server.hits.copy()
+                titles = self.cb.get_titles_by_urls(links, self.channel)
+        for link, title in zip(self.links("youtube"), titles):
+            self.assertIn(link["title"], title or "")
+        self.assertEqual(
+            self.server.hits["www.googleapis.com/youtube/v3/videos"]
+            - hits["www.googleapis.com/youtube/v3/videos"],
+            1,
+        )
+
+    def testChannelTraffic(self):
+        """
+        Synthetic traffic: messages with one to three links each, spread
+        over several channels.
+        """
+        rng = random.Random(1)
+        links = self.links()
+        channels = ["#bench%s" % i for i in range(6)]
+        messages = []
+        for i in range(120):
+            urls = [link["url"] for link in rng.sample(links, rng.randint(1, 3))]
+            text = "look at " + " and ".join(urls)
+            messages.append(
+                ircmsgs.privmsg(rng.choice(channels), text, prefix="bench!b@bench.test")
+            )
+        url_count = sum(len(m.args[1].split(" and ")) for m in messages)
+        requests = self.server.requests
+        start = time.perf_counter()
+        for msg in messages:
+            self.irc.feedMsg(msg)
+        elapsed = time.perf_counter() - start
+        replies = 0
+        while self.irc.takeMsg() is not None:
+            replies += 1
+        throughput = url_count / elapsed
+        stats = self.cb.sessions.stats()
+        report(
+            "Channel traffic",
+            [
+                "%s messages, %s links in %.2fs: %.0f links/s"
+                % (len(messages), url_count, elapsed, throughput),
+                "%s upstream requests, %.1f%% over reused connections"
+                % (self.server.requests - requests, stats["reuse_ratio"] * 100),
+            ],
+        )
+        self.assertEqual(replies, url_count)
+        self.assertGreater(throughput, MIN_THROUGHPUT)
+
+
+if __name__ == "__main__":
+    log.testing = True
+    world.testing = True
+    world.myVerbose = False
+    conf.supybot.directories.plugins.setValue(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    )
+    unittest.main(verbosity=2)
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,151 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+breaker: remembers failing links and hosts so they fail fast.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of contacting a host that is known to be down
+    """
+
+
+class _Circuit:
+    __slots__ = ("state", "failures", "delay", "retry_at")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.delay = 0
+        self.retry_at = 0
+
+
+class CircuitBreaker:
+    """
+    Tracks connection failures per host. After threshold consecutive
+    failures the circuit opens and requests are refused for delay seconds.
+    Then a single probe is let through (half-open): success closes the
+    circuit, failure opens it again for twice as long, up to max_delay.
+    A probe that is neither reported as a success nor as a failure within
+    probe_timeout seconds is given up on, and another one is let through.
+    """
+
+    def __init__(self, threshold=3, delay=30, max_delay=900, probe_timeout=60):
+        self.threshold = threshold
+        self.delay = delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            now = time.time()
+            if now < circuit.retry_at:
+                return False
+            circuit.state = HALF_OPEN
+            circuit.retry_at = now + self.probe_timeout
+            return True
+
+    def success(self, host):
+        with self._lock:
+            self._circuits.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            circuit = self._circuits.setdefault(host, _Circuit())
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN:
+                circuit.delay = min(circuit.delay * 2, self.max_delay)
+            elif circuit.failures >= self.threshold:
+                circuit.delay = self.delay
+            else:
+                return
+            circuit.state = OPEN
+            circuit.retry_at = time.time() + circuit.delay
+
+    def state(self, host):
+        with self._lock:
+            circuit = self._circuits.get(host)
+            return circuit.state if circuit else CLOSED
+
+    def open_hosts(self):
+        with self._lock:
+            return [
+                host
+                for (host, circuit) in self._circuits.items()
+                if circuit.state != CLOSED
+            ]
+
+
+class NegativeCache:
+    """
+    Remembers links that could not be retrieved for a while. At most
+    max_entries links are kept, the oldest are dropped first.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, lifetime):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = time.time() + lifetime
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if time.time() >= expires:
+                del self._entries[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,355 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+cache: indexed link title cache with TTL expiry and LRU eviction, optionally
+backed by a persistent SQLite store.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, urlunparse
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Rough per-entry bookkeeping cost (dict, key tuple, OrderedDict node)
+ENTRY_OVERHEAD = 256
+
+
+def normalize_url(url):
+    """
+    Returns a canonical form of the URL used as a cache key: lowercase scheme
+    and host, default ports dropped and an empty path replaced with "/".
+    """
+    url = url.strip()
+    try:
+        info = urlparse(url)
+        port = info.port
+    except ValueError:
+        return url
+    if not info.scheme or not info.hostname:
+        return url
+    scheme = info.scheme.lower()
+    netloc = info.hostname.lower()
+    if ":" in netloc:
+        netloc = "[%s]" % netloc
+    if port and DEFAULT_PORTS.get(scheme) != port:
+        netloc = "%s:%s" % (netloc, port)
+    if info.username or info.password:
+        userinfo = info.username or ""
+        if info.password:
+            userinfo = "%s:%s" % (userinfo, info.password)
+        netloc = "%s@%s" % (userinfo, netloc)
+    path = info.path or "/"
+    return urlunparse((scheme, netloc, path, info.params, info.query, info.fragment))
+
+
+def entry_size(key, entry):
+    """
+    Approximate memory footprint of a cache entry in bytes
+    """
+    size = ENTRY_OVERHEAD + len(key[0]) + len(key[1])
+    for field in ("title", "from"):
+        value = entry.get(field)
+        if value:
+            size += len(value.encode("utf-8", "replace"))
+    return size
+
+
+class LinkCache:
+    """
+    Maps (scope, normalized URL) to link info. Lookups are O(1), entries
+    expire after the lifetime given at lookup time and the least recently
+    used entries are evicted once max_entries or max_bytes is exceeded.
+    A limit of 0 disables that bound.
+
+    If a TitleStore is given, every entry is also written to it and lookups
+    that miss in memory fall back to it.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=0, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.store_hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, lifetime):
+        """
+        Returns the entry stored under key if it is younger than lifetime
+        seconds, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.time() - entry["timestamp"] < lifetime:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                self._remove(key)
+                self.expirations += 1
+        if self.store:
+            entry = self.store.get(key, lifetime)
+            if entry is not None:
+                with self._lock:
+                    self._insert(key, entry)
+                    self.hits += 1
+                    self.store_hits += 1
+                return entry
+        with self._lock:
+            self.misses += 1
+
+    def set(self, key, entry):
+        """
+        Stores entry under key, evicting least recently used entries as needed
+        """
+        with self._lock:
+            self._insert(key, entry)
+        if self.store:
+            self.store.put(key, entry)
+
+    def warm(self, lifetime):
+        """
+        Fills the cache with the most recent unexpired entries of the store
+        """
+        if not self.store:
+            return
+        for key, entry in self.store.load(lifetime, self.max_entries):
+            with self._lock:
+                self._insert(key, entry)
+
+    def flush(self):
+        if self.store:
+            self.store.flush()
+
+    def close(self):
+        if self.store:
+            self.store.close()
+
+    def resize(self, max_entries, max_bytes):
+        """
+        Updates the bounds, evicting entries if the cache shrank
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "store_hits": self.store_hits,
+            }
+        if self.store:
+            stats["stored"] = self.store.count()
+        return stats
+
+    def _insert(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        size = entry_size(key, entry)
+        self._entries[key] = entry
+        self._sizes[key] = size
+        self._bytes += size
+        self._evict()
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+class TitleStore:
+    """
+    Persistent link cache in an SQLite database. Writes are buffered and
+    committed in batches once flush_size entries are pending or
+    flush_interval seconds have passed; expired rows and rows beyond
+    max_entries (oldest first) are pruned on every flush.
+    """
+
+    def __init__(
+        self, filename, lifetime, max_entries=10000, flush_size=50, flush_interval=60
+    ):
+        self.filename = filename
+        self.lifetime = lifetime
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._last_flush = time.time()
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS links (
+                    scope TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    nick TEXT,
+                    channel TEXT,
+                    timestamp REAL NOT NULL,
+                    PRIMARY KEY (scope, url)
+                )"""
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS links_timestamp ON links (timestamp)"
+            )
+
+    def get(self, key, lifetime):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                row = self._db.execute(
+                    "SELECT title, nick, channel, timestamp FROM links "
+                    "WHERE scope = ? AND url = ?",
+                    key,
+                ).fetchone()
+                if row is None:
+                    return
+                entry = self._row_to_entry(key, row)
+        if time.time() - entry["timestamp"] >= lifetime:
+            return
+        return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._pending[key] = entry
+            if (
+                len(self._pending) >= self.flush_size
+                or time.time() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+
+    def load(self, lifetime, limit=0):
+        """
+        Returns (key, entry) pairs of unexpired links, oldest first, limited
+        to the most recent limit links if limit is set.
+        """
+        self.flush()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT scope, url, title, nick, channel, timestamp FROM links "
+                "WHERE timestamp > ? ORDER BY timestamp DESC LIMIT ?",
+                (time.time() - lifetime, limit or -1),
+            ).fetchall()
+        rows.reverse()
+        return [
+            ((row[0], row[1]), self._row_to_entry((row[0], row[1]), row[2:]))
+            for row in rows
+        ]
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.time()
+            pending = self._pending
+            self._pending = {}
+            with self._db:
+                if pending:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO links "
+                        "(scope, url, title, nick, channel, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                scope,
+                                url,
+                                entry["title"],
+                                entry.get("from"),
+                                entry.get("channel"),
+                                entry["timestamp"],
+                            )
+                            for (scope, url), entry in pending.items()
+                        ],
+                    )
+                self._db.execute(
+                    "DELETE FROM links WHERE timestamp <= ?",
+                    (time.time() - self.lifetime,),
+                )
+                if self.max_entries:
+                    self._db.execute(
+                        "DELETE FROM links WHERE timestamp < (SELECT timestamp FROM "
+                        "links ORDER BY timestamp DESC LIMIT 1 OFFSET ?)",
+                        (self.max_entries - 1,),
+                    )
+
+    def count(self):
+        """
+        Number of committed links, not counting pending writes
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    def _row_to_entry(self, key, row):
+        title, nick, channel, timestamp = row
+        return {
+            "url": key[1],
+            "timestamp": timestamp,
+            "title": title,
+            "from": nick,
+            "channel": channel,
+        }
@@ -65,6 +65,94 @@ conf.registerGlobalValue(
     registry.Integer(10, _("""Maximum time in seconds to try and retrieve a link""")),
 )
 
+# HTTP connection pooling
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "httpPoolSize",
+    registry.PositiveInteger(
+        10,
+        _(
+            """
+            Number of keep-alive connections kept open per host. Requires reloading
+            the plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "httpMaxSessions",
+    registry.PositiveInteger(
+        32,
+        _(
+            """
+            Number of hosts for which keep-alive connections are kept. The least
+            recently used host is dropped first. Requires reloading the plugin.
+            """
+        ),
+    ),
+)
+
+# Failing links and hosts
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "negativeCacheLifetime",
+    registry.NonNegativeInteger(
+        300,
+        _(
+            """
+            Time in seconds a link that could not be retrieved after maxRetries
+            attempts is not requested again.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "breakerThreshold",
+    registry.PositiveInteger(
+        3,
+        _(
+            """
+            Number of consecutive timeouts or connection errors after which a host
+            is considered down and no longer contacted for a while. Requires
+            reloading the plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "breakerDelay",
+    registry.PositiveInteger(
+        30,
+        _(
+            """
+            Time in seconds a host that is down is skipped before it is tried again.
+            The delay doubles each time that retry fails. Requires reloading the
+            plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "breakerMaxDelay",
+    registry.PositiveInteger(
+        900,
+        _(
+            """
+            Maximum time in seconds a host that is down is skipped. Requires
+            reloading the plugin.
+            """
+        ),
+    ),
+)
+
 # URL regex
 conf.registerChannelValue(
     SpiffyTitles,
@@ -142,6 +230,78 @@ conf.registerGlobalValue(
     ),
 )
 
+# Link cache size
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "cacheMaxEntries",
+    registry.NonNegativeInteger(
+        1000,
+        _(
+            """
+            Maximum number of links kept in the link cache. The least recently
+            used links are evicted first. 0 means unlimited.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "cacheMaxBytes",
+    registry.NonNegativeInteger(
+        0,
+        _(
+            """
+            Approximate maximum size of the link cache in bytes. The least recently
+            used links are evicted first. 0 means unlimited.
+            """
+        ),
+    ),
+)
+
+# Persistent link cache
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "cachePersistent",
+    registry.Boolean(
+        False,
+        _(
+            """
+            Keep the link cache in an SQLite database in the data directory so
+            titles survive restarts. Requires reloading the plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "cachePersistentMaxEntries",
+    registry.NonNegativeInteger(
+        10000,
+        _(
+            """
+            Maximum number of links kept in the persistent link cache. The oldest
+            links are removed first. 0 means unlimited.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "cacheFlushInterval",
+    registry.PositiveInteger(
+        60,
+        _(
+            """
+            Maximum time in seconds new links are buffered before being written to
+            the persistent link cache. Requires reloading the plugin.
+            """
+        ),
+    ),
+)
+
 conf.registerChannelValue(
     SpiffyTitles,
     "ignoredMessagePattern",
@@ -181,6 +341,48 @@ conf.registerChannelValue(
     ),
 )
 
+# Concurrent resolution of multiple links
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "concurrentWorkers",
+    registry.PositiveInteger(
+        4,
+        _(
+            """
+            Number of threads used to look up the links of a message in parallel.
+            Requires reloading the plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "concurrentPerDomain",
+    registry.PositiveInteger(
+        2,
+        _(
+            """
+            Maximum number of links from the same domain looked up at the same time.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    SpiffyTitles,
+    "concurrentDeadline",
+    registry.PositiveInteger(
+        30,
+        _(
+            """
+            Maximum time in seconds to wait for all links of a message. Titles of
+            links that take longer are not shown.
+            """
+        ),
+    ),
+)
+
 conf.registerChannelValue(
     SpiffyTitles,
     "requireCapability",
@@ -235,6 +437,20 @@ conf.registerChannelValue(
     ),
 )
 
+conf.registerGlobalValue(
+    SpiffyTitles.default,
+    "maxBytes",
+    registry.NonNegativeInteger(
+        1048576,
+        _(
+            """
+            Maximum number of bytes of a page read while looking for its title.
+            Reading stops as soon as the title is found. 0 means unlimited.
+            """
+        ),
+    ),
+)
+
 conf.registerChannelValue(
     SpiffyTitles.default,
     "language",
@@ -483,6 +699,21 @@ conf.registerChannelValue(
         _("""Template used for YouTube title responses"""),
     ),
 )
+# YouTube API batching
+conf.registerGlobalValue(
+    SpiffyTitles.youtube,
+    "batchWindow",
+    registry.Float(
+        0.0,
+        _(
+            """
+            Seconds to wait for more YouTube links before looking them up
+            together in one API request. Links that come in while a request is
+            in flight are always sent together by the next one.
+            """
+        ),
+    ),
+)
 
 
 # imgur configs
@@ -35,13 +35,21 @@ import supybot.utils as utils
 import supybot.ircdb as ircdb
 import supybot.log as log
 import supybot.conf as conf
-import re, sys, random, time, json, unicodedata, datetime
+import supybot.registry as registry
+import supybot.world as world
+import re, sys, random, time, json, unicodedata, datetime, sqlite3
 from urllib.parse import urlparse, parse_qsl
 from bs4 import BeautifulSoup
 from jinja2 import Template
 import requests
 import praw
 import urllib
+from .breaker import CircuitBreaker, CircuitOpenError, NegativeCache
+from .cache import LinkCache, TitleStore, normalize_url
+from .resolver import ConcurrentResolver, MicroBatcher, SingleFlight
+from .router import DomainRouter, SettingsCache
+from .sessions import SessionPool
+from .titlereader import read_title
 
 
 try:
@@ -63,10 +71,38 @@ class SpiffyTitles(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(SpiffyTitles, self)
         self.__parent.__init__(irc)
-        self.link_cache = {}
+        self.link_cache = LinkCache(
+            self.registryValue("cacheMaxEntries"),
+            self.registryValue("cacheMaxBytes"),
+            self.get_link_store(),
+        )
+        try:
+            self.link_cache.warm(int(self.registryValue("cacheLifetime")))
+        except sqlite3.Error as e:
+            log.error("SpiffyTitles: unable to read link cache, starting empty: %s" % e)
+            self.link_cache.clear()
+            self.link_cache.store = None
+        world.flushers.append(self.link_cache.flush)
+        self.resolver = ConcurrentResolver(
+            self.registryValue("concurrentWorkers"),
+            self.registryValue("concurrentPerDomain"),
+        )
+        # Registry callbacks are removed by identity, so keep the bound methods
+        self.watched = [
+            ("concurrentPerDomain", self.set_per_domain),
+            ("cacheMaxEntries", self.resize_link_cache),
+            ("cacheMaxBytes", self.resize_link_cache),
+            ("cacheLifetime", self.set_cache_lifetime),
+        ]
+        for (name, callback) in self.watched:
+            self.registryValue(name, value=False).addCallback(callback)
         self.handlers = {}
         self.timeout = self.registryValue("timeout")
         self.add_handlers()
+        self.router = DomainRouter(self.handlers)
+        self.settings = SettingsCache()
+        self.channel_settings = self.get_channel_setting_names()
+        self.inflight = SingleFlight()
         self.proxies = {}
         self.proxies["http"] = None
         self.proxies["https"] = None
@@ -84,9 +120,69 @@ class SpiffyTitles(callbacks.Plugin):
                 proxy = "http://{0}".format(proxy)
             self.proxies["http"] = proxy
             self.proxies["https"] = proxy
+        self.failed_links = NegativeCache()
+        self.breaker = CircuitBreaker(
+            self.registryValue("breakerThreshold"),
+            self.registryValue("breakerDelay"),
+            self.registryValue("breakerMaxDelay"),
+            self.timeout,
+        )
+        self.sessions = SessionPool(
+            self.proxies,
+            self.registryValue("httpPoolSize"),
+            self.registryValue("httpMaxSessions"),
+            self.breaker,
+        )
+        self.youtube_batchers = {
+            kind: MicroBatcher(lambda ids, kind=kind: self.get_youtube_items(kind, ids))
+            for kind in ("videos", "channels")
+        }
 
         
 
+    def die(self):
+        for (name, callback) in self.watched:
+            self.registryValue(name, value=False).removeCallback(callback)
+        world.flushers.remove(self.link_cache.flush)
+        self.link_cache.close()
+        self.resolver.shutdown()
+        self.sessions.close()
+        self.settings.close()
+        self.__parent.die()
+
+    def resize_link_cache(self):
+        """
+        Applies a new cacheMaxEntries or cacheMaxBytes to the link cache
+        """
+        self.link_cache.resize(
+            self.registryValue("cacheMaxEntries"), self.registryValue("cacheMaxBytes")
+        )
+
+    def set_cache_lifetime(self):
+        """
+        Applies a new cacheLifetime to the persistent link cache, which prunes
+        expired rows on flush
+        """
+        if self.link_cache.store:
+            self.link_cache.store.lifetime = int(self.registryValue("cacheLifetime"))
+
+    def get_link_store(self):
+        """
+        Opens the persistent link cache if enabled
+        """
+        if not self.registryValue("cachePersistent"):
+            return
+        filename = conf.supybot.directories.data.dirize("SpiffyTitles.db")
+        try:
+            return TitleStore(
+                filename,
+                int(self.registryValue("cacheLifetime")),
+                self.registryValue("cachePersistentMaxEntries"),
+                flush_interval=self.registryValue("cacheFlushInterval"),
+            )
+        except sqlite3.Error as e:
+            log.error("SpiffyTitles: unable to open link cache %s: %s" % (filename, e))
+
     def add_handlers(self):
         """
         Adds all handlers
@@ -206,6 +302,7 @@ class SpiffyTitles(callbacks.Plugin):
             urls = self.get_urls_from_message(message, channel)[0:1]
         if not urls:
             return
+        links = []
         for url in urls:
             if url.strip():
                 url = self.remove_control_characters(url)
@@ -218,34 +315,57 @@ class SpiffyTitles(callbacks.Plugin):
                         "SpiffyTitles: URL ignored due to domain blacklist match: %s"
                         % url
                     )
-                    return
+                    break
                 is_whitelisted_domain = self.is_whitelisted_domain(domain, channel)
-                whitelist_pattern = self.registryValue(
-                    "whitelistDomainPattern", channel=channel
-                )
+                whitelist_pattern = self.get_setting("whitelistDomainPattern", channel)
                 if whitelist_pattern and not is_whitelisted_domain:
                     log.debug(
                         "SpiffyTitles: URL ignored due to domain whitelist mismatch: %s"
                         % url
                     )
+                    break
+                links.append(url)
+        titles = self.get_titles_by_urls(links, channel, msg.nick)
+        for url, title in zip(links, titles):
+            if title:
+                prefixed = self.registryValue("prefixNick", channel=channel)
+                ignore_match = self.title_matches_ignore_pattern(title, channel)
+                if ignore_match:
                     return
-                title = self.get_title_by_url(url, channel, msg.nick)
-                if title:
-                    prefixed = self.registryValue("prefixNick", channel=channel)
-                    ignore_match = self.title_matches_ignore_pattern(title, channel)
-                    if ignore_match:
-                        return
-                    elif not is_ignored:
-                        irc.reply(title, prefixNick=prefixed)
+                irc.reply(title, prefixNick=prefixed)
+            else:
+                if self.registryValue("default.enabled", channel):
+                    log.debug("SpiffyTitles: could not get a title for %s" % (url))
                 else:
-                    if self.registryValue("default.enabled", channel):
-                        log.debug("SpiffyTitles: could not get a title for %s" % (url))
-                    else:
-                        log.debug(
-                            "SpiffyTitles: could not get a title for %s but default    "
-                            "                                handler is disabled"
-                            % (url)
-                        )
+                    log.debug(
+                        "SpiffyTitles: could not get a title for %s but default    "
+                        "                                handler is disabled"
+                        % (url)
+                    )
+
+    def get_titles_by_urls(self, urls, channel, origin_nick=None):
+        """
+        Retrieves the titles of several links concurrently. Titles are returned
+        in the order of the links, with None for links that failed or did not
+        resolve within concurrentDeadline.
+        """
+        if len(urls) == 1:
+            return [self.get_title_by_url(urls[0], channel, origin_nick)]
+        jobs = [
+            (
+                self.get_base_domain(url),
+                self.get_title_by_url,
+                (url, channel, origin_nick),
+            )
+            for url in urls
+        ]
+        return self.resolver.resolve(jobs, self.registryValue("concurrentDeadline"))
+
+    def set_per_domain(self):
+        """
+        Applies a new concurrentPerDomain to the resolver
+        """
+        self.resolver.per_domain = self.registryValue("concurrentPerDomain")
 
     def handler_default(self, url, channel):
         """
@@ -297,38 +417,97 @@ class SpiffyTitles(callbacks.Plugin):
         if cached_link:
             title = cached_link["title"]
         else:
-            if domain in self.handlers:
-                handler = self.handlers[domain]
-                title = handler(url, info, channel)
-            else:
-                base_domain = self.get_base_domain("http://" + domain)
-                if base_domain in self.handlers:
-                    handler = self.handlers[base_domain]
-                    title = handler(url, info, channel)
-                else:
-                    if self.registryValue("default.enabled", channel):
-                        title = self.handler_default(url, channel)
+            """
+            Channels configured alike share a single lookup when the same link
+            is posted in several of them at once.
+            """
+            title = self.inflight.do(
+                (normalize_url(url), self.get_channel_overrides(channel)),
+                self.get_title_from_handlers,
+                url,
+                info,
+                channel,
+            )
         if title and not cached_link:
             title = self.get_formatted_title(title, channel)
-            # Update link cache
-            log.debug("SpiffyTitles: caching %s" % (url))
-            now = datetime.datetime.now()
-            if channel not in self.link_cache:
-                self.link_cache[channel] = []
-            self.link_cache[channel].append(
-                {
-                    "url": url,
-                    "timestamp": now,
-                    "title": title,
-                    "from": origin_nick,
-                    "channel": channel,
-                }
-            )
+            self.add_link_to_cache(url, channel, title, origin_nick)
         elif title and cached_link:
-            self.link_cache[channel].append(cached_link)
             log.debug("SpiffyTitles: serving link from cache: %s" % (url))
         return title
 
+    def get_title_from_handlers(self, url, info, channel):
+        """
+        Calls the handler for the domain of the URL, or the default handler
+        """
+        handler = self.router.match(info.hostname or info.netloc)
+        if handler:
+            return handler(url, info, channel)
+        elif self.registryValue("default.enabled", channel):
+            return self.handler_default(url, channel)
+
+    def get_channel_overrides(self, channel):
+        """
+        Returns the values of the channel settings as they apply to this
+        channel, whether set for it or not. Channels configured alike render
+        links identically.
+        """
+        if channel == "global":
+            return ()
+        return self.settings.memo(
+            ("overrides", channel), self.read_channel_settings, channel
+        )
+
+    def read_channel_settings(self, channel):
+        return tuple(
+            (name, str(self.get_setting(name, channel)))
+            for name in self.channel_settings
+        )
+
+    def get_channel_setting_names(self):
+        """
+        Returns the names of the plugin's channel settings. The registry has
+        no public flag for channel-specific values, so this checks the one the
+        Config plugin checks.
+        """
+        names = []
+        group = conf.supybot.plugins.get(self.name())
+        for (name, value) in group.getValues(getChildren=True):
+            # Relative to supybot.plugins.SpiffyTitles
+            parts = registry.split(name)[3:]
+            # Values set for a network or channel
+            specific = [p for p in parts if p[:1] == ":" or ircutils.isChannel(p)]
+            if specific:
+                continue
+            if getattr(value, "_channelValue", False):
+                names.append(registry.join(parts))
+        return names
+
+    def get_cache_key(self, url, channel):
+        """
+        Link cache entries are keyed by channel (or "global") and normalized URL
+        """
+        return (channel, normalize_url(url))
+
+    def add_link_to_cache(self, url, channel, title, origin_nick=None):
+        """
+        Stores a title in the link cache, evicting the least recently used
+        links if the cache is over its configured size.
+        """
+        cache_lifetime_in_seconds = int(self.registryValue("cacheLifetime"))
+        if cache_lifetime_in_seconds == 0:
+            return
+        log.debug("SpiffyTitles: caching %s" % (url))
+        self.link_cache.set(
+            self.get_cache_key(url, channel),
+            {
+                "url": url,
+                "timestamp": time.time(),
+                "title": title,
+                "from": origin_nick,
+                "channel": channel,
+            },
+        )
+
     def get_link_from_cache(self, url, channel):
         """
         Looks for a URL in the link cache and returns info about if it's not stale
@@ -338,27 +517,12 @@ class SpiffyTitles(callbacks.Plugin):
         cache_lifetime_in_seconds = int(self.registryValue("cacheLifetime"))
         if cache_lifetime_in_seconds == 0:
             return
-        # No cache yet
-        if len(self.link_cache) == 0:
-            return
-        cached_link = None
-        now = datetime.datetime.now()
-        stale = False
-        seconds = 0
-        if channel in self.link_cache:
-            for i in range(len(self.link_cache[channel])):
-                if self.link_cache[channel][i]["url"] == url:
-                    cached_link = self.link_cache[channel].pop(i)
-                    break
-        # Found link, check timestamp
-        if cached_link:
-            seconds = (now - cached_link["timestamp"]).total_seconds()
-            if seconds >= cache_lifetime_in_seconds:
-                stale = True
-        if stale:
-            log.debug("SpiffyTitles: %s was sent %s seconds ago" % (url, seconds))
-        else:
-            return cached_link
+        cached_link = self.link_cache.get(
+            self.get_cache_key(url, channel), cache_lifetime_in_seconds
+        )
+        if not cached_link:
+            log.debug("SpiffyTitles: %s is not cached or stale" % (url))
+        return cached_link
 
     def is_channel_allowed(self, channel):
         """
@@ -392,31 +556,42 @@ class SpiffyTitles(callbacks.Plugin):
         """
         Checks domain against a regular expression
         """
-        pattern = self.registryValue("ignoredDomainPattern", channel=channel)
+        pattern = self.get_setting("ignoredDomainPattern", channel)
         if pattern:
-            log.debug("SpiffyTitles: matching %s against %s" % (domain, str(pattern)))
-            try:
-                pattern_search_result = re.search(pattern, domain)
-                if pattern_search_result:
-                    match = pattern_search_result.group()
-                    return match
-            except re.error:
-                log.error("SpiffyTitles: invalid regular expression: %s" % (pattern))
+            return self.settings.memo(
+                ("ignoredDomainPattern", channel, domain),
+                self.match_domain,
+                pattern,
+                domain,
+            )
 
     def is_whitelisted_domain(self, domain, channel):
         """
         Checks domain against a regular expression
         """
-        pattern = self.registryValue("whitelistDomainPattern", channel=channel)
+        pattern = self.get_setting("whitelistDomainPattern", channel)
         if pattern:
-            log.debug("SpiffyTitles: matching %s against %s" % (domain, str(pattern)))
-            try:
-                pattern_search_result = re.search(pattern, domain)
-                if pattern_search_result:
-                    match = pattern_search_result.group()
-                    return match
-            except re.error:
-                log.error("SpiffyTitles: invalid regular expression: %s" % (pattern))
+            return self.settings.memo(
+                ("whitelistDomainPattern", channel, domain),
+                self.match_domain,
+                pattern,
+                domain,
+            )
+
+    def match_domain(self, pattern, domain):
+        log.debug("SpiffyTitles: matching %s against %s" % (domain, str(pattern)))
+        pattern_search_result = pattern.search(domain)
+        if pattern_search_result:
+            return pattern_search_result.group()
+
+    def get_setting(self, name, channel=None):
+        """
+        Returns a registry value, cached until the registry entry changes
+        """
+        return self.settings.get(
+            (name, channel),
+            lambda: self.registryValue(name, channel=channel, value=False),
+        )
 
     def get_formatted_title(self, title, channel):
         """
@@ -446,16 +621,22 @@ class SpiffyTitles(callbacks.Plugin):
         """
         Get the HTML of a website based on a URL
         """
+        if normalize_url(url) in self.failed_links:
+            log.debug("SpiffyTitles: %s failed recently, not retrying yet" % url)
+            return (None, False)
         max_retries = self.registryValue("maxRetries")
         if retries >= max_retries:
             log.debug("SpiffyTitles: hit maximum retries for %s" % url)
+            self.failed_links.add(
+                normalize_url(url), self.registryValue("negativeCacheLifetime")
+            )
             return (None, False)
         log.debug("SpiffyTitles: attempt #%s for %s" % (retries, url))
         is_redirect = False
         try:
             headers = self.get_headers(channel)
             log.debug("SpiffyTitles: requesting %s" % (url))
-            with requests.get(
+            with self.sessions.get(
                 url,
                 headers=headers,
                 timeout=self.timeout,
@@ -486,8 +667,8 @@ class SpiffyTitles(callbacks.Plugin):
                                 % url
                             )
                             return
-                        whitelist_pattern = self.registryValue(
-                            "whitelistDomainPattern", channel=channel
+                        whitelist_pattern = self.get_setting(
+                            "whitelistDomainPattern", channel
                         )
                         is_whitelisted_domain = self.is_whitelisted_domain(
                             domain, channel
@@ -507,8 +688,13 @@ class SpiffyTitles(callbacks.Plugin):
                 acceptable_types = self.registryValue("default.mimeTypes")
                 log.debug("SpiffyTitles: content type %s" % (content_type))
                 if content_type in acceptable_types:
-                    text = request.content
-                    if text:
+                    (title, text) = read_title(
+                        request, self.registryValue("default.maxBytes")
+                    )
+                    if title:
+                        return (title, is_redirect)
+                    elif text:
+                        # No <title> while streaming, let BeautifulSoup have a go
                         return (self.get_title_from_html(text, channel), is_redirect)
                     else:
                         log.debug("SpiffyTitles: empty content from %s" % (url))
@@ -535,12 +721,14 @@ class SpiffyTitles(callbacks.Plugin):
                 return
             else:
                 return self.get_source_by_url(url_wschema, channel)
+        except CircuitOpenError as e:
+            log.debug("SpiffyTitles: %s" % (str(e)))
         except requests.exceptions.Timeout as e:
             log.error("SpiffyTitles Timeout: %s" % (str(e)))
-            self.get_source_by_url(url, channel, retries + 1)
+            return self.get_source_by_url(url, channel, retries + 1)
         except requests.exceptions.ConnectionError as e:
             log.error("SpiffyTitles ConnectionError: %s" % (str(e)))
-            self.get_source_by_url(url, channel, retries + 1)
+            return self.get_source_by_url(url, channel, retries + 1)
         except requests.exceptions.HTTPError as e:
             log.error("SpiffyTitles HTTPError: %s" % (str(e)))
             text = self.registryValue("badLinkText", channel=channel)
@@ -579,9 +767,9 @@ class SpiffyTitles(callbacks.Plugin):
         whether the message should be ignored.
         """
         match = False
-        pattern = self.registryValue("ignoredMessagePattern")
+        pattern = self.get_setting("ignoredMessagePattern", channel)
         if pattern:
-            match = re.search(pattern, input)
+            match = pattern.search(input)
         return match
 
     def title_matches_ignore_pattern(self, input, channel):
@@ -590,9 +778,9 @@ class SpiffyTitles(callbacks.Plugin):
         whether the title should be ignored.
         """
         match = False
-        pattern = self.registryValue("ignoredTitlePattern", channel=channel)
+        pattern = self.get_setting("ignoredTitlePattern", channel)
         if pattern:
-            match = re.search(pattern, input)
+            match = pattern.search(input)
             if match:
                 log.debug(
                     "SpiffyTitles: title %s matches ignoredTitlePattern for %s"
@@ -674,7 +862,9 @@ class SpiffyTitles(callbacks.Plugin):
         api_url = "https://api.dailymotion.com/video/%s?fields=%s" % (video_id, fields,)
         log.debug("SpiffyTitles: looking up dailymotion info: %s", api_url)
         try:
-            request = requests.get(api_url, timeout=self.timeout, proxies=self.proxies)
+            request = self.sessions.get(
+                api_url, timeout=self.timeout, proxies=self.proxies
+            )
             request.raise_for_status()
         except (
             requests.exceptions.RequestException,
@@ -722,7 +912,9 @@ class SpiffyTitles(callbacks.Plugin):
         api_url = "https://vimeo.com/api/v2/video/%s.json" % video_id
         log.debug("SpiffyTitles: looking up vimeo info: %s", api_url)
         try:
-            request = requests.get(api_url, timeout=self.timeout, proxies=self.proxies)
+            request = self.sessions.get(
+                api_url, timeout=self.timeout, proxies=self.proxies
+            )
             request.raise_for_status()
         except (
             requests.exceptions.RequestException,
@@ -782,7 +974,9 @@ class SpiffyTitles(callbacks.Plugin):
             return self.handler_default(url, channel)
         api_url = "http://coub.com/api/v2/coubs/%s" % video_id
         try:
-            request = requests.get(api_url, timeout=self.timeout, proxies=self.proxies)
+            request = self.sessions.get(
+                api_url, timeout=self.timeout, proxies=self.proxies
+            )
             request.raise_for_status()
         except (
             requests.exceptions.RequestException,
@@ -842,7 +1036,7 @@ class SpiffyTitles(callbacks.Plugin):
                     api_url = 'https://www.googleapis.com/youtube/v3/channels'
                     log.debug("SpiffyTitles: requesting %s for channel type 1" % (api_url))
                     try:
-                        request = requests.get(
+                        request = self.sessions.get(
                             api_url, timeout=self.timeout, proxies=self.proxies,
                             params={
                                 'part': 'id',
@@ -868,7 +1062,7 @@ class SpiffyTitles(callbacks.Plugin):
                     api_url = 'https://www.googleapis.com/youtube/v3/channels'
                     log.debug("SpiffyTitles: requesting %s for channel name %s" % (api_url, username))
                     try:
-                        request = requests.get(
+                        request = self.sessions.get(
                             api_url, timeout=self.timeout, proxies=self.proxies,
                             params={
                                 'part': 'id',
@@ -926,32 +1120,18 @@ class SpiffyTitles(callbacks.Plugin):
         yt_template = Template(self.registryValue("youtube.template", channel))
         title = ""
         if type == "video":
-            options = {
-                "part": "snippet,statistics,contentDetails",
-                "maxResults": 1,
-                "key": developer_key,
-                "id": video_id,
-            }
-            api_url = "https://www.googleapis.com/youtube/v3/videos"
-            log.debug("SpiffyTitles: requesting %s" % (api_url))
             try:
-                request = requests.get(
-                    api_url, params=options, timeout=self.timeout, proxies=self.proxies
-                )
-                request.raise_for_status()
+                video = self.get_youtube_item("videos", video_id)
             except (
                 requests.exceptions.RequestException,
                 requests.exceptions.HTTPError,
             ) as e:
                 log.error("SpiffyTitles: YouTube Error: {0}".format(e))
                 return self.handler_default(url, channel)
-            response = json.loads(request.content.decode())
-            if not response or not response.get("items"):
+            if not video:
                 log.error("SpiffyTitles: Failed to parse YouTube JSON response")
                 return self.handler_default(url, channel)
             try:
-                items = response["items"]
-                video = items[0]
                 snippet = video["snippet"]
                 title = snippet["title"]
                 statistics = video["statistics"]
@@ -1008,32 +1188,18 @@ class SpiffyTitles(callbacks.Plugin):
                     "SpiffyTitles: IndexError. Youtube API JSON response: %s" % (str(e))
                 )
         elif type == "channel":
-            options = {
-                "part": "snippet,statistics,contentDetails",
-                "maxResults": 1,
-                "key": developer_key,
-                "id": channel_id,
-            }
-            api_url = "https://www.googleapis.com/youtube/v3/channels"
-            log.debug("SpiffyTitles: requesting %s" % (api_url))
             try:
-                request = requests.get(
-                    api_url, params=options, timeout=self.timeout, proxies=self.proxies
-                )
-                request.raise_for_status()
+                yt_channel = self.get_youtube_item("channels", channel_id)
             except (
                 requests.exceptions.RequestException,
                 requests.exceptions.HTTPError,
             ) as e:
                 log.error("SpiffyTitles: YouTube Error: {0}".format(e))
                 return self.handler_default(url, channel)
-            response = json.loads(request.content.decode())
-            if not response or not response.get("items"):
+            if not yt_channel:
                 log.error("SpiffyTitles: Failed to parse YouTube JSON response")
                 return self.handler_default(url, channel)
             try:
-                items = response["items"]
-                yt_channel = items[0]
                 snippet = yt_channel["snippet"]
                 title = snippet["title"]
                 statistics = yt_channel["statistics"]
@@ -1059,6 +1225,34 @@ class SpiffyTitles(callbacks.Plugin):
             log.debug("SpiffyTitles: falling back to default handler")
             return self.handler_default(url, channel)
 
+    def get_youtube_item(self, kind, item_id):
+        """
+        Looks up a video or channel. Lookups made at the same time are sent
+        together in one API request.
+        """
+        batcher = self.youtube_batchers[kind]
+        batcher.window = self.registryValue("youtube.batchWindow")
+        return batcher.get(item_id)
+
+    def get_youtube_items(self, kind, ids):
+        """
+        Fetches up to 50 videos or channels in one API request and returns
+        them by ID
+        """
+        options = {
+            "part": "snippet,statistics,contentDetails",
+            "key": self.registryValue("youtube.developerKey"),
+            "id": ",".join(ids),
+        }
+        api_url = "https://www.googleapis.com/youtube/v3/%s" % (kind)
+        log.debug("SpiffyTitles: requesting %s for %s" % (api_url, options["id"]))
+        request = self.sessions.get(
+            api_url, params=options, timeout=self.timeout, proxies=self.proxies
+        )
+        request.raise_for_status()
+        response = json.loads(request.content.decode())
+        return {item["id"]: item for item in response.get("items", [])}
+
     def get_duration_from_seconds(self, duration_seconds):
         m, s = divmod(duration_seconds, 60)
         h, m = divmod(m, 60)
@@ -1170,7 +1364,7 @@ class SpiffyTitles(callbacks.Plugin):
         headers = {"Client-ID": twitch_client_id, "Authorization": bearer}
         self.log.debug("SpiffyTitles: twitch - requesting %s" % (data_url))
         try:
-            request = requests.get(
+            request = self.sessions.get(
                 data_url, timeout=self.timeout, headers=headers, proxies=self.proxies
             )
             request.raise_for_status()
@@ -1204,7 +1398,7 @@ class SpiffyTitles(callbacks.Plugin):
                 **link_info
             )
             try:
-                request = requests.get(
+                request = self.sessions.get(
                     data_url,
                     timeout=self.timeout,
                     headers=headers,
@@ -1253,7 +1447,7 @@ class SpiffyTitles(callbacks.Plugin):
             view_count = data["viewer_count"]
             created_at = self._time_created_at(data["started_at"])
             if game_id:
-                get_game = requests.get(
+                get_game = self.sessions.get(
                     "https://api.twitch.tv/helix/games?id={}".format(game_id),
                     timeout=self.timeout,
                     headers=headers,
@@ -1276,7 +1470,7 @@ class SpiffyTitles(callbacks.Plugin):
             display_name = data["broadcaster_name"]
             data_url = "https://api.twitch.tv/helix/users?login={}".format(display_name)
             try:
-                request = requests.get(
+                request = self.sessions.get(
                     data_url,
                     timeout=self.timeout,
                     headers=headers,
@@ -1300,7 +1494,7 @@ class SpiffyTitles(callbacks.Plugin):
                 view_count = data["view_count"]
                 created_at = self._time_created_at(data["created_at"])
                 if game_id:
-                    get_game = requests.get(
+                    get_game = self.sessions.get(
                         "https://api.twitch.tv/helix/games?id={}".format(game_id),
                         timeout=self.timeout,
                         headers=headers,
@@ -1327,7 +1521,7 @@ class SpiffyTitles(callbacks.Plugin):
             display_name = data["user_name"]
             data_url = "https://api.twitch.tv/helix/users?login={}".format(display_name)
             try:
-                request = requests.get(
+                request = self.sessions.get(
                     data_url,
                     timeout=self.timeout,
                     headers=headers,
@@ -1439,7 +1633,7 @@ class SpiffyTitles(callbacks.Plugin):
         omdb_url = "http://www.omdbapi.com/"
         options = {"apikey": apikey, "i": imdb_id, "r": "json", "plot": "short"}
         try:
-            request = requests.get(
+            request = self.sessions.get(
                 omdb_url, params=options, timeout=self.timeout, proxies=self.proxies
             )
             request.raise_for_status()
@@ -1553,7 +1747,7 @@ class SpiffyTitles(callbacks.Plugin):
         extract = ""
         self.log.debug("SpiffyTitles: requesting %s" % (api_url))
         try:
-            request = requests.get(
+            request = self.sessions.get(
                 api_url, params=api_params, timeout=self.timeout, proxies=self.proxies
             )
             request.raise_for_status()
@@ -1781,7 +1975,7 @@ class SpiffyTitles(callbacks.Plugin):
         headers = {"Authorization": "Client-ID {0}".format(client_id)}
         api_url = "https://api.imgur.com/3/album/{0}".format(album_id)
         try:
-            request = requests.get(
+            request = self.sessions.get(
                 api_url, headers=headers, timeout=self.timeout, proxies=self.proxies
             )
             request.raise_for_status()
@@ -1841,7 +2035,7 @@ class SpiffyTitles(callbacks.Plugin):
         headers = {"Authorization": "Client-ID {0}".format(client_id)}
         api_url = "https://api.imgur.com/3/image/{0}".format(image_id)
         try:
-            request = requests.get(
+            request = self.sessions.get(
                 api_url, headers=headers, timeout=self.timeout, proxies=self.proxies
             )
             request.raise_for_status()
@@ -1891,7 +2085,9 @@ class SpiffyTitles(callbacks.Plugin):
             url
         )
         try:
-            request = requests.get(api_url, timeout=self.timeout, proxies=self.proxies)
+            request = self.sessions.get(
+                api_url, timeout=self.timeout, proxies=self.proxies
+            )
             request.raise_for_status()
         except (
             requests.exceptions.RequestException,
@@ -1938,5 +2134,60 @@ class SpiffyTitles(callbacks.Plugin):
 
     t = wrap(t, ["text"])
 
+    def cachestats(self, irc, msg, args):
+        """takes no arguments
+
+        Shows link cache size and hit/miss/eviction counters, and how many
+        lookups were shared with an identical one already in progress.
+        """
+        stats = self.link_cache.stats()
+        irc.reply(
+            "Link cache: {0} entries ({1}) :: {2} hits, {3} misses ({4:.1%} hit "
+            "ratio) :: {5} evictions, {6} expired :: {7} lookups shared{8}".format(
+                stats["entries"],
+                self.get_readable_file_size(stats["bytes"]),
+                stats["hits"],
+                stats["misses"],
+                stats["hit_ratio"],
+                stats["evictions"],
+                stats["expirations"],
+                self.inflight.shared,
+                " :: {0} stored, {1} served from disk".format(
+                    stats["stored"], stats["store_hits"]
+                )
+                if "stored" in stats
+                else "",
+            )
+        )
+
+    cachestats = wrap(cachestats, ["admin"])
+
+    def httpstats(self, irc, msg, args):
+        """takes no arguments
+
+        Shows how often pooled HTTP connections were reused, how many YouTube
+        lookups were batched and which hosts are currently skipped because
+        they keep failing.
+        """
+        stats = self.sessions.stats()
+        open_hosts = self.breaker.open_hosts()
+        batchers = self.youtube_batchers.values()
+        irc.reply(
+            "HTTP: {0} sessions :: {1} requests over {2} connections ({3:.1%} "
+            "reused) :: {4} YouTube lookups in {5} API requests :: {6} failed "
+            "links cached :: unreachable hosts: {7}".format(
+                stats["sessions"],
+                stats["requests"],
+                stats["connections"],
+                stats["reuse_ratio"],
+                sum(batcher.keys for batcher in batchers),
+                sum(batcher.calls for batcher in batchers),
+                len(self.failed_links),
+                ", ".join(open_hosts) if open_hosts else "none",
+            )
+        )
+
+    httpstats = wrap(httpstats, ["admin"])
+
 
 Class = SpiffyTitles
@@ -0,0 +1,259 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+resolver: resolves the links of a message concurrently on a bounded pool,
+collapses concurrent lookups of the same link into one and batches API
+lookups made at the same time.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from supybot import log
+
+
+class ConcurrentResolver:
+    """
+    Runs lookups on a shared pool of max_workers threads, with at most
+    per_domain lookups against the same domain at a time. Lookups over that
+    limit wait in a queue for their domain rather than in a worker thread.
+    """
+
+    def __init__(self, max_workers=4, per_domain=2):
+        self.per_domain = per_domain
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="SpiffyTitles"
+        )
+        self._active = {}
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, jobs, deadline):
+        """
+        jobs is a list of (domain, function, args) tuples. Returns the results
+        in the same order; jobs that failed or did not finish within deadline
+        seconds yield None.
+        """
+        futures = []
+        for (domain, function, args) in jobs:
+            future = Future()
+            self._submit(domain, future, function, args)
+            futures.append(future)
+        done, not_done = wait(futures, timeout=deadline)
+        if not_done:
+            log.debug(
+                "SpiffyTitles: %s of %s links not resolved within %ss"
+                % (len(not_done), len(futures), deadline)
+            )
+            # Nobody is waiting for these anymore, drop those not started yet
+            for future in not_done:
+                future.cancel()
+        results = []
+        for future in futures:
+            result = None
+            if future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log.error("SpiffyTitles: error resolving link: %s" % (str(e)))
+            results.append(result)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            for queue in self._queues.values():
+                for (future, function, args) in queue:
+                    future.cancel()
+            self._queues.clear()
+        self._executor.shutdown(wait=False)
+
+    def _submit(self, domain, future, function, args):
+        with self._lock:
+            if self._active.get(domain, 0) >= self.per_domain:
+                self._queues.setdefault(domain, deque()).append(
+                    (future, function, args)
+                )
+                return
+            self._active[domain] = self._active.get(domain, 0) + 1
+        self._executor.submit(self._run, domain, future, function, args)
+
+    def _run(self, domain, future, function, args):
+        while future is not None:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = function(*args)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            (future, function, args) = self._next(domain)
+
+    def _next(self, domain):
+        """
+        Hands the domain's slot to its next queued job, or frees it
+        """
+        with self._lock:
+            queue = self._queues.get(domain)
+            while queue:
+                job = queue.popleft()
+                if not job[0].cancelled():
+                    return job
+            self._queues.pop(domain, None)
+            self._active[domain] -= 1
+            if not self._active[domain]:
+                del self._active[domain]
+            return (None, None, None)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent calls of do() with the same key share one execution of the
+    function: the first caller runs it, later callers wait for its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, function, *args):
+        # A thread that is already running a call never waits on another one,
+        # so nested calls (redirects) can't end up waiting on each other.
+        nested = getattr(self._local, "depth", 0) > 0
+        with self._lock:
+            call = self._calls.get(key)
+            follower = call is not None and not nested
+            if follower:
+                self.shared += 1
+            else:
+                call = _Call()
+                self.calls += 1
+                self._calls.setdefault(key, call)
+        if follower:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        try:
+            call.result = function(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self._local.depth -= 1
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+
+
+class _Batch:
+    __slots__ = ("keys", "full", "done", "results", "error")
+
+    def __init__(self):
+        self.keys = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = {}
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Looks up keys with as few calls of fetch(keys) as possible. fetch returns
+    a dict of results by key and is called with at most max_size keys.
+
+    One call runs at a time: keys asked for while a call is in flight are
+    sent together by the next one. With a window, the first key of a batch
+    also waits up to window seconds for others to join.
+    """
+
+    def __init__(self, fetch, window=0, max_size=50):
+        self.fetch = fetch
+        self.window = window
+        self.max_size = max_size
+        self._pending = None
+        self._lock = threading.Lock()
+        self._sending = threading.Lock()
+        self.calls = 0
+        self.keys = 0
+
+    def get(self, key):
+        """
+        Returns the result for key, or None if fetch didn't return one
+        """
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            if key not in batch.keys:
+                batch.keys.append(key)
+            if len(batch.keys) >= self.max_size:
+                # Later keys start a new batch
+                self._pending = None
+                batch.full.set()
+        if leader:
+            if self.window > 0:
+                batch.full.wait(self.window)
+            with self._sending:
+                with self._lock:
+                    if self._pending is batch:
+                        self._pending = None
+                self._run(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(key)
+
+    def _run(self, batch):
+        try:
+            self.calls += 1
+            self.keys += len(batch.keys)
+            batch.results = self.fetch(list(batch.keys)) or {}
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
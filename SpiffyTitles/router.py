@@ -0,0 +1,138 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+router: domain suffix trie for handler dispatch and a cache of registry
+values that is dropped whenever one of them changes.
+"""
+
+import threading
+
+
+class _Node:
+    __slots__ = ("children", "handler")
+
+    def __init__(self):
+        self.children = {}
+        self.handler = None
+
+
+class DomainRouter:
+    """
+    Maps domains to handlers. A host matches the handler of its longest
+    registered suffix, so en.wikipedia.org is served by wikipedia.org and
+    www.twitch.tv by its own entry if there is one.
+    """
+
+    def __init__(self, handlers=None):
+        self._root = _Node()
+        for domain, handler in (handlers or {}).items():
+            self.add(domain, handler)
+
+    def add(self, domain, handler):
+        node = self._root
+        for label in reversed(domain.lower().split(".")):
+            node = node.children.setdefault(label, _Node())
+        node.handler = handler
+
+    def match(self, host):
+        """
+        Returns the handler for host, or None
+        """
+        host = host.lower().rstrip(".")
+        if ":" in host and not host.endswith("]"):
+            host = host.rsplit(":", 1)[0]
+        node = self._root
+        handler = None
+        for label in reversed(host.split(".")):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.handler is not None:
+                handler = node.handler
+        return handler
+
+
+class SettingsCache:
+    """
+    Holds registry values (and anything derived from them) until any watched
+    registry entry changes. Derived results are kept in a bounded memo.
+    """
+
+    def __init__(self, max_memo=4096):
+        self.max_memo = max_memo
+        self._values = {}
+        self._memo = {}
+        self._watched = {}
+        self._lock = threading.Lock()
+        # Registry callbacks are removed by identity, so keep one bound method
+        self._callback = self.clear
+
+    def get(self, key, get_group):
+        """
+        Returns the cached value for key. On a miss get_group() is called for
+        the registry entry, which is read and watched for changes.
+        """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        group = get_group()
+        with self._lock:
+            if id(group) not in self._watched:
+                group.addCallback(self._callback)
+                self._watched[id(group)] = group
+        value = group()
+        self._values[key] = value
+        return value
+
+    def memo(self, key, function, *args):
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        result = function(*args)
+        if len(self._memo) >= self.max_memo:
+            self._memo.clear()
+        self._memo[key] = result
+        return result
+
+    def clear(self):
+        self._values = {}
+        self._memo = {}
+
+    def close(self):
+        """
+        Stops watching the registry
+        """
+        with self._lock:
+            for group in self._watched.values():
+                group.removeCallback(self._callback)
+            self._watched.clear()
+        self.clear()
@@ -0,0 +1,193 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+sessions: keep-alive HTTP sessions, one per upstream host.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+
+from .breaker import CircuitOpenError
+
+
+class _NoCookies(DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts the requests it sends and the connections they
+    went out on, a connection being counted the first time it is used
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = 0
+        self.connections = 0
+        self._used = weakref.WeakSet()
+        self._counts_lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self._counts_lock:
+            self.requests += 1
+        response = super().send(request, **kwargs)
+        connection = response.raw.connection
+        if connection is not None:
+            with self._counts_lock:
+                if connection not in self._used:
+                    self._used.add(connection)
+                    self.connections += 1
+        return response
+
+
+class SessionPool:
+    """
+    Hands out a requests.Session per host so repeated requests to the same
+    API reuse open TCP/TLS connections. At most max_sessions hosts are kept,
+    the least recently used session is closed first.
+
+    If a CircuitBreaker is given, hosts that keep timing out or refusing
+    connections get CircuitOpenError instead of a request.
+    """
+
+    def __init__(self, proxies=None, pool_maxsize=10, max_sessions=32, breaker=None):
+        self.proxies = proxies or {}
+        self.breaker = breaker
+        self.pool_maxsize = pool_maxsize
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        # Counters of sessions that have been closed
+        self._closed_requests = 0
+        self._closed_connections = 0
+
+    def get(self, url, **kwargs):
+        """
+        Same as requests.get, over the pooled session for the URL's host
+        """
+        kwargs.setdefault("proxies", self.proxies)
+        host = urlparse(url).netloc.lower()
+        if self.breaker and not self.breaker.allow(host):
+            raise CircuitOpenError("%s is unreachable, not retrying yet" % host)
+        session = self.session(url)
+        try:
+            response = session.get(url, **kwargs)
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ):
+            if self.breaker:
+                self.breaker.failure(host)
+            raise
+        except Exception:
+            # The host did answer (or was never asked), which settles a
+            # half-open circuit as well
+            if self.breaker:
+                self.breaker.success(host)
+            raise
+        else:
+            if self.breaker:
+                self.breaker.success(host)
+            return response
+
+    def session(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is not None:
+                self._sessions.move_to_end(host)
+                return session
+            session = requests.Session()
+            # Sessions are shared by unrelated lookups, so they must not keep
+            # cookies. Cookies set during one request (redirects) still work.
+            session.cookies = RequestsCookieJar(policy=_NoCookies())
+            adapter = CountingAdapter(
+                pool_connections=4, pool_maxsize=self.pool_maxsize
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[host] = session
+            while len(self._sessions) > self.max_sessions:
+                (old_host, old_session) = self._sessions.popitem(last=False)
+                self._close(old_session)
+            return session
+
+    def stats(self):
+        """
+        Returns request and connection counts; reuse is the share of requests
+        that did not need a new connection.
+        """
+        with self._lock:
+            requests_count = self._closed_requests
+            connections = self._closed_connections
+            for session in self._sessions.values():
+                (session_requests, session_connections) = self._count(session)
+                requests_count += session_requests
+                connections += session_connections
+            sessions = len(self._sessions)
+        reused = max(requests_count - connections, 0)
+        return {
+            "sessions": sessions,
+            "requests": requests_count,
+            "connections": connections,
+            "reuse_ratio": reused / requests_count if requests_count else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                self._close(session)
+            self._sessions.clear()
+
+    def _close(self, session):
+        (session_requests, session_connections) = self._count(session)
+        self._closed_requests += session_requests
+        self._closed_connections += session_connections
+        session.close()
+
+    def _count(self, session):
+        """
+        Sums the counters of the adapters mounted on a session
+        """
+        requests_count = 0
+        connections = 0
+        for adapter in set(session.adapters.values()):
+            if isinstance(adapter, CountingAdapter):
+                requests_count += adapter.requests
+                connections += adapter.connections
+        return (requests_count, connections)
@@ -0,0 +1,738 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Through the modules: loading the plugin reloads them
+from . import breaker, cache, resolver, router, sessions, titlereader
+
+# Long enough that a held lookup never finishes by accident
+WAIT = 10
+
+
+class Fetcher:
+    """
+    Stands in for the link handlers. Returns the title set up for a link,
+    raises for links in failing and holds links in waits until their event
+    is set. Looking up a link in releases sets that event.
+    """
+
+    def __init__(self, titles):
+        self.titles = titles
+        self.failing = set()
+        self.waits = {}
+        self.releases = {}
+        self.fetched = []
+        self.finished = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url, info, channel):
+        with self.lock:
+            self.fetched.append(url)
+        if url in self.releases:
+            self.releases[url].set()
+        if url in self.waits:
+            self.waits[url].wait(WAIT)
+        with self.lock:
+            self.finished.append(url)
+        if url in self.failing:
+            raise ValueError("no title for %s" % url)
+        return self.titles[url]
+
+
+class SpiffyTitlesTestCase(ChannelPluginTestCase):
+    plugins = ("SpiffyTitles",)
+    config = {
+        "supybot.plugins.SpiffyTitles.cacheLifetime": 0,
+        "supybot.plugins.SpiffyTitles.snarfMultipleUrls": True,
+        "supybot.plugins.SpiffyTitles.concurrentDeadline": 1,
+    }
+    links = ("https://one.example/", "https://two.example/", "https://three.example/")
+    titles = dict(zip(links, ("First link", "Second link", "Third link")))
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.cb = self.irc.getCallback("SpiffyTitles")
+        self.fetcher = Fetcher(self.titles)
+        self.cb.get_title_from_handlers = self.fetcher
+
+    def post(self, *urls):
+        """
+        Posts the links in one message and returns the replies
+        """
+        self.irc.feedMsg(
+            ircmsgs.privmsg(self.channel, " and ".join(urls), prefix="foo!bar@baz")
+        )
+        replies = []
+        msg = self.irc.takeMsg()
+        while msg is not None:
+            replies.append(msg.args[1])
+            msg = self.irc.takeMsg()
+        return replies
+
+    def testTitle(self):
+        self.assertEqual(self.post(self.links[0]), ["First link"])
+        self.assertEqual(self.fetcher.fetched, [self.links[0]])
+
+    def testTitlesInLinkOrder(self):
+        (one, two, three) = self.links
+        # The first link only finishes once the last one is being looked up
+        self.fetcher.waits[one] = self.fetcher.releases[three] = threading.Event()
+        self.assertEqual(
+            self.post(one, two, three), ["First link", "Second link", "Third link"]
+        )
+        self.assertEqual(self.fetcher.finished[-1], one)
+
+    def testFailedLink(self):
+        (one, two, three) = self.links
+        self.fetcher.failing.add(two)
+        self.assertEqual(self.post(one, two, three), ["First link", "Third link"])
+        self.assertCountEqual(self.fetcher.fetched, self.links)
+
+    def testDeadline(self):
+        (one, two, three) = self.links
+        self.fetcher.waits[two] = event = threading.Event()
+        try:
+            self.assertEqual(self.post(one, two, three), ["First link", "Third link"])
+            self.assertNotIn(two, self.fetcher.finished)
+        finally:
+            event.set()
+
+    def testIgnoredDomain(self):
+        (one, two, three) = self.links
+        pattern = conf.supybot.plugins.SpiffyTitles.ignoredDomainPattern
+        pattern.set(r"m/^three\./")
+        try:
+            self.assertEqual(self.post(one, two, three), ["First link", "Second link"])
+        finally:
+            pattern.set("")
+        self.assertCountEqual(self.fetcher.fetched, [one, two])
+
+    def testSharedLookup(self):
+        # Channels configured alike share one lookup of a link
+        one = self.links[0]
+        bold = conf.supybot.plugins.SpiffyTitles.useBold
+        for channel in ("#one", "#two"):
+            bold.get(channel).setValue(True)
+        self.addCleanup(bold.get("#two").setValue, False)
+        self.addCleanup(bold.get("#one").setValue, False)
+        self.assertEqual(
+            self.cb.get_channel_overrides("#one"), self.cb.get_channel_overrides("#two")
+        )
+        self.assertNotEqual(
+            self.cb.get_channel_overrides("#one"),
+            self.cb.get_channel_overrides("#three"),
+        )
+        self.fetcher.waits[one] = release = threading.Event()
+        self.fetcher.releases[one] = started = threading.Event()
+        titles = {}
+
+        def lookup(channel):
+            titles[channel] = self.cb.get_title_by_url(one, channel)
+
+        threads = [threading.Thread(target=lookup, args=("#one",))]
+        threads[0].start()
+        started.wait(WAIT)
+        threads.append(threading.Thread(target=lookup, args=("#two",)))
+        threads[1].start()
+        deadline = time.time() + WAIT
+        while not self.cb.inflight.shared and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(WAIT)
+        self.assertEqual(self.fetcher.fetched, [one])
+        self.assertEqual(
+            titles, {"#one": "\x02First link\x02", "#two": "\x02First link\x02"}
+        )
+        # Until their settings differ
+        bold.get("#two").setValue(False)
+        self.assertNotEqual(
+            self.cb.get_channel_overrides("#one"), self.cb.get_channel_overrides("#two")
+        )
+
+    def testCachedLink(self):
+        (one, two, three) = self.links
+        with conf.supybot.plugins.SpiffyTitles.cacheLifetime.context(600):
+            self.assertEqual(self.post(one), ["First link"])
+            self.assertEqual(self.post(one, two), ["First link", "Second link"])
+        self.assertEqual(self.fetcher.fetched, [one, two])
+
+    def testChannelSettingNames(self):
+        # Set for a channel or not, channel settings are listed once
+        bold = conf.supybot.plugins.SpiffyTitles.useBold
+        bold.get("#one").setValue(True)
+        self.addCleanup(bold.get("#one").setValue, False)
+        names = self.cb.get_channel_setting_names()
+        self.assertEqual(names.count("useBold"), 1)
+        self.assertIn("youtube.template", names)
+        self.assertNotIn("youtube.developerKey", names)
+        self.assertNotIn("cacheLifetime", names)
+        self.assertEqual(names, self.cb.channel_settings)
+
+    def testPerDomainSetting(self):
+        with conf.supybot.plugins.SpiffyTitles.concurrentPerDomain.context(5):
+            self.assertEqual(self.cb.resolver.per_domain, 5)
+        self.assertEqual(self.cb.resolver.per_domain, 2)
+
+    def testCacheSettings(self):
+        settings = conf.supybot.plugins.SpiffyTitles
+        self.cb.link_cache.store = cache.TitleStore(":memory:", 600)
+        with settings.cacheMaxEntries.context(1), settings.cacheLifetime.context(60):
+            self.assertEqual(self.cb.link_cache.max_entries, 1)
+            self.assertEqual(self.cb.link_cache.store.lifetime, 60)
+        self.assertEqual(self.cb.link_cache.max_entries, 1000)
+        self.assertEqual(self.cb.link_cache.store.lifetime, 0)
+
+
+class BrokenLinkStoreTestCase(ChannelPluginTestCase):
+    plugins = ("SpiffyTitles",)
+    config = {"supybot.plugins.SpiffyTitles.cachePersistent": True}
+
+    def setUp(self):
+        # A links table from some other schema: opens fine, can't be read
+        filename = conf.supybot.directories.data.dirize("SpiffyTitles.db")
+        db = sqlite3.connect(filename)
+        with db:
+            db.execute("DROP TABLE IF EXISTS links")
+            db.execute("CREATE TABLE links (scope, url, timestamp)")
+        db.close()
+        ChannelPluginTestCase.setUp(self)
+
+    def testWarm(self):
+        cb = self.irc.getCallback("SpiffyTitles")
+        self.assertIsNone(cb.link_cache.store)
+        self.assertEqual(len(cb.link_cache), 0)
+
+
+def entry(title, age=0):
+    return {"title": title, "timestamp": time.time() - age, "from": "foo"}
+
+
+class LinkCacheTestCase(SupyTestCase):
+    def testLRU(self):
+        links = cache.LinkCache(max_entries=2)
+        links.set(("#a", "one"), entry("One"))
+        links.set(("#a", "two"), entry("Two"))
+        links.get(("#a", "one"), 60)
+        links.set(("#a", "three"), entry("Three"))
+        self.assertIsNone(links.get(("#a", "two"), 60))
+        self.assertEqual(links.get(("#a", "one"), 60)["title"], "One")
+        self.assertEqual(links.get(("#a", "three"), 60)["title"], "Three")
+        self.assertEqual(links.evictions, 1)
+
+    def testMaxBytes(self):
+        links = cache.LinkCache(max_entries=0, max_bytes=1000)
+        for i in range(10):
+            links.set(("#a", str(i)), entry("x" * 200))
+        self.assertEqual(len(links), 2)
+        self.assertLessEqual(links.stats()["bytes"], 1000)
+        links.resize(1, 0)
+        self.assertEqual(len(links), 1)
+        self.assertIsNotNone(links.get(("#a", "9"), 60))
+
+    def testExpiry(self):
+        links = cache.LinkCache()
+        links.set(("#a", "old"), entry("Old", age=120))
+        links.set(("#a", "new"), entry("New", age=30))
+        self.assertIsNone(links.get(("#a", "old"), 60))
+        self.assertEqual(links.get(("#a", "new"), 60)["title"], "New")
+        self.assertEqual((links.expirations, len(links)), (1, 1))
+
+
+class TitleStoreTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.store = cache.TitleStore(
+            ":memory:", 600, flush_size=3, flush_interval=3600
+        )
+        self.addCleanup(self.store.close)
+
+    def testWriteBehind(self):
+        self.store.put(("#a", "one"), entry("One"))
+        self.store.put(("#a", "two"), entry("Two"))
+        self.assertEqual(self.store.count(), 0)
+        # Pending writes are already visible
+        self.assertEqual(self.store.get(("#a", "one"), 60)["title"], "One")
+        self.store.put(("#a", "three"), entry("Three"))
+        self.assertEqual(self.store.count(), 3)
+        self.store.put(("#a", "four"), entry("Four"))
+        self.store.flush()
+        self.assertEqual(self.store.count(), 4)
+
+    def testPrune(self):
+        self.store.max_entries = 2
+        self.store.put(("#a", "expired"), entry("Expired", age=900))
+        self.store.put(("#a", "old"), entry("Old", age=300))
+        self.store.put(("#a", "newer"), entry("Newer", age=200))
+        self.store.put(("#a", "newest"), entry("Newest", age=100))
+        self.store.flush()
+        self.assertEqual(
+            [key for (key, value) in self.store.load(600)],
+            [("#a", "newer"), ("#a", "newest")],
+        )
+
+    def testWarm(self):
+        for (i, name) in enumerate(("one", "two", "three")):
+            self.store.put(("#a", name), entry(name, age=300 - i))
+        self.store.put(("#a", "recent"), entry("recent", age=60))
+        links = cache.LinkCache(max_entries=2, store=self.store)
+        links.warm(120)
+        self.assertEqual(len(links), 1)
+        links.warm(600)
+        self.assertEqual(len(links), 2)
+        self.assertEqual(links.get(("#a", "three"), 600)["title"], "three")
+        self.assertEqual(links.get(("#a", "recent"), 600)["title"], "recent")
+        self.assertEqual(links.store_hits, 0)
+        # Entries that didn't fit are still found in the store
+        self.assertEqual(links.get(("#a", "one"), 600)["title"], "one")
+        self.assertEqual(links.store_hits, 1)
+
+
+class DomainRouterTestCase(SupyTestCase):
+    handlers = {
+        "youtube.com": "youtube",
+        "wikipedia.org": "wikipedia",
+        "twitch.tv": "twitch",
+        "clips.twitch.tv": "clips",
+    }
+    cases = [
+        # Exact hosts
+        ("youtube.com", "youtube"),
+        ("twitch.tv", "twitch"),
+        ("clips.twitch.tv", "clips"),
+        ("YouTube.COM.", "youtube"),
+        ("youtube.com:8080", "youtube"),
+        # Subdomains fall back to the longest registered suffix
+        ("www.youtube.com", "youtube"),
+        ("en.m.wikipedia.org", "wikipedia"),
+        ("www.twitch.tv", "twitch"),
+        ("a.clips.twitch.tv", "clips"),
+        # No match
+        ("example.com", None),
+        ("notyoutube.com", None),
+        ("youtube.com.example", None),
+        ("tv", None),
+        ("[::1]:8080", None),
+    ]
+
+    def testMatch(self):
+        domains = router.DomainRouter(self.handlers)
+        for (host, handler) in self.cases:
+            self.assertEqual(domains.match(host), handler, host)
+
+
+class SettingsCacheTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.value = conf.supybot.plugins.SpiffyTitles.badLinkText
+        self.addCleanup(self.value.setValue, self.value())
+        self.settings = router.SettingsCache()
+        self.addCleanup(self.settings.close)
+        self.reads = 0
+
+    def get(self):
+        self.reads += 1
+        return self.value
+
+    def testInvalidation(self):
+        self.value.setValue("Nope")
+        self.assertEqual(self.settings.get("badLinkText", self.get), "Nope")
+        self.assertEqual(self.settings.memo("length", len, "Nope"), 4)
+        self.assertEqual(self.settings.get("badLinkText", self.get), "Nope")
+        self.assertEqual(self.reads, 1)
+        self.value.setValue("Broken link")
+        self.assertEqual(self.settings.get("badLinkText", self.get), "Broken link")
+        self.assertEqual(self.reads, 2)
+        self.assertEqual(self.settings.memo("length", len, "Broken link"), 11)
+
+
+class ResolverTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.resolver = resolver.ConcurrentResolver(max_workers=2, per_domain=1)
+        self.addCleanup(self.resolver.shutdown)
+        self.started = []
+        self.release = threading.Event()
+
+    def lookup(self, name, wait=False):
+        self.started.append(name)
+        if wait:
+            self.release.wait(WAIT)
+        return name.upper()
+
+    def testResults(self):
+        jobs = [
+            ("a.example", self.lookup, ("a1",)),
+            ("a.example", int, ("not a number",)),
+            ("b.example", self.lookup, ("b1",)),
+        ]
+        self.assertEqual(self.resolver.resolve(jobs, WAIT), ["A1", None, "B1"])
+
+    def testPerDomain(self):
+        # a2 waits for a1 without holding the other worker, so b1 still runs
+        jobs = [
+            ("a.example", self.lookup, ("a1", True)),
+            ("a.example", self.lookup, ("a2",)),
+            ("b.example", self.lookup, ("b1",)),
+        ]
+        try:
+            self.assertEqual(self.resolver.resolve(jobs, 0.2), [None, None, "B1"])
+            self.assertCountEqual(self.started, ["a1", "b1"])
+        finally:
+            self.release.set()
+
+    def testCancel(self):
+        # Jobs still queued at the deadline are never started
+        jobs = [
+            ("a.example", self.lookup, ("a1", True)),
+            ("a.example", self.lookup, ("a2",)),
+        ]
+        self.assertEqual(self.resolver.resolve(jobs, 0.2), [None, None])
+        self.release.set()
+        jobs = [("a.example", self.lookup, ("a3",))]
+        self.assertEqual(self.resolver.resolve(jobs, WAIT), ["A3"])
+        self.assertEqual(self.started, ["a1", "a3"])
+
+
+class MicroBatcherTestCase(SupyTestCase):
+    ids = ["dQw4w9WgXcQ", "9bZkp7q19f0", "kJQP7kiw5Fk"]
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.calls = []
+
+    def fetch(self, ids):
+        self.calls.append(ids)
+        if "error" in ids:
+            raise requests.exceptions.HTTPError("quota exceeded")
+        # Like the API, no item for videos that don't exist
+        return {id: {"id": id} for id in ids if id != "missing"}
+
+    def getAll(self, ids):
+        """
+        Looks up each id in its own thread, the batch being sent once they
+        have all joined, and returns the result or exception of each
+        """
+        batcher = resolver.MicroBatcher(self.fetch, window=WAIT, max_size=len(ids))
+        results = {}
+
+        def get(id):
+            try:
+                results[id] = batcher.get(id)
+            except Exception as e:
+                results[id] = e
+
+        threads = [threading.Thread(target=get, args=(id,)) for id in ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(WAIT)
+        return results
+
+    def testBatch(self):
+        results = self.getAll(self.ids)
+        self.assertEqual(results, {id: {"id": id} for id in self.ids})
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(sorted(self.calls[0]), sorted(self.ids))
+
+    def testMissing(self):
+        results = self.getAll(self.ids + ["missing"])
+        self.assertEqual(len(self.calls), 1)
+        self.assertIsNone(results["missing"])
+        self.assertEqual(results[self.ids[0]], {"id": self.ids[0]})
+
+    def testError(self):
+        results = self.getAll(self.ids + ["error"])
+        self.assertEqual(len(self.calls), 1)
+        for id in self.ids + ["error"]:
+            self.assertIsInstance(results[id], requests.exceptions.HTTPError)
+
+
+class ChunkedResponse:
+    """
+    Stands in for a streamed response, handing out the given chunks and
+    counting how many were read.
+    """
+
+    def __init__(self, chunks, content_type="text/html", encoding=None):
+        self.chunks = chunks
+        self.headers = CaseInsensitiveDict({"Content-Type": content_type})
+        self.encoding = encoding
+        self.read = 0
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+class TitleReaderTestCase(SupyTestCase):
+    # Enough to get past the <meta charset> sniffing before the title
+    padding = b"<html><head>" + b" " * titlereader.SNIFF_SIZE
+
+    def testStopsAtTitle(self):
+        response = ChunkedResponse(
+            [self.padding + b"<title>First</title>"] + [b"<p>more</p>"] * 4
+        )
+        (title, body) = titlereader.read_title(response)
+        self.assertEqual(title, "First")
+        self.assertEqual(response.read, 1)
+
+    def testStopsAtOgTitle(self):
+        response = ChunkedResponse(
+            [
+                self.padding,
+                b'<meta property="og:title" content="Open Graph">',
+                b"</head><body>",
+                b"<p>more</p>",
+                b"<p>more</p>",
+            ]
+        )
+        (title, body) = titlereader.read_title(response)
+        self.assertEqual(title, "Open Graph")
+        self.assertEqual(response.read, 3)
+
+    def testMetaCharset(self):
+        page = '<meta charset="utf-8"><title>Café</title>'.encode("utf-8")
+        response = ChunkedResponse(
+            [page], "text/html; charset=ISO-8859-1", "ISO-8859-1"
+        )
+        self.assertEqual(titlereader.read_title(response)[0], "Café")
+        # Without one the header is used
+        page = "<title>Café</title>".encode("iso-8859-1")
+        response = ChunkedResponse(
+            [page], "text/html; charset=ISO-8859-1", "ISO-8859-1"
+        )
+        self.assertEqual(titlereader.read_title(response)[0], "Café")
+
+    def testMaxBytes(self):
+        response = ChunkedResponse(
+            [b"<p>" + b"x" * 996 + b"</p>"] * 8 + [b"<title>Too far</title>"]
+        )
+        (title, body) = titlereader.read_title(response, max_bytes=2500)
+        self.assertIsNone(title)
+        self.assertEqual(len(body), 2500)
+        self.assertEqual(response.read, 3)
+
+    def testSplitTitle(self):
+        title = "Déjà vu".encode("utf-8")
+        response = ChunkedResponse(
+            [
+                self.padding + b"<ti",
+                b"tle>" + title[:2],
+                title[2:5],
+                title[5:] + b"</ti",
+                b"tle>",
+                b"<p>more</p>",
+            ]
+        )
+        self.assertEqual(titlereader.read_title(response)[0], "Déjà vu")
+        self.assertEqual(response.read, 5)
+        # All of a short page is parsed once it ends
+        response = ChunkedResponse([b"<ti", b"tle>Short", b"</title>"])
+        self.assertEqual(titlereader.read_title(response)[0], "Short")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeSession:
+    """
+    Fails with error if one is set, else answers
+    """
+
+    def __init__(self):
+        self.error = None
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        if self.error is not None:
+            raise self.error
+        return "response"
+
+
+class CircuitBreakerTestCase(SupyTestCase):
+    host = "api.example"
+    url = "https://api.example/v1"
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.clock = Clock()
+        patcher = mock.patch.object(breaker, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = breaker.CircuitBreaker(threshold=2, delay=30, max_delay=100)
+        self.breaker.probe_timeout = 10
+        self.session = FakeSession()
+        self.pool = sessions.SessionPool(breaker=self.breaker)
+        self.pool.session = lambda url: self.session
+
+    def get_error(self, error):
+        self.session.error = error
+        with self.assertRaises(type(error)):
+            self.pool.get(self.url)
+
+    def open(self):
+        for _ in range(self.breaker.threshold):
+            self.get_error(requests.exceptions.ConnectionError())
+        self.assertEqual(self.breaker.state(self.host), breaker.OPEN)
+
+    def testClosed(self):
+        self.get_error(requests.exceptions.Timeout())
+        self.assertEqual(self.breaker.state(self.host), breaker.CLOSED)
+        self.session.error = None
+        self.assertEqual(self.pool.get(self.url), "response")
+        # Failures have to be consecutive
+        self.get_error(requests.exceptions.Timeout())
+        self.assertEqual(self.breaker.state(self.host), breaker.CLOSED)
+
+    def testOpen(self):
+        self.open()
+        requests_count = self.session.requests
+        self.assertRaises(breaker.CircuitOpenError, self.pool.get, self.url)
+        self.clock.now += 29
+        self.assertRaises(breaker.CircuitOpenError, self.pool.get, self.url)
+        self.assertEqual(self.session.requests, requests_count)
+        self.assertEqual(self.breaker.open_hosts(), [self.host])
+
+    def testProbeSuccess(self):
+        self.open()
+        self.clock.now += 30
+        self.session.error = None
+        self.assertEqual(self.pool.get(self.url), "response")
+        self.assertEqual(self.breaker.state(self.host), breaker.CLOSED)
+        self.assertEqual(self.breaker.open_hosts(), [])
+
+    def testProbeFailure(self):
+        self.open()
+        self.clock.now += 30
+        self.get_error(requests.exceptions.Timeout())
+        self.assertEqual(self.breaker.state(self.host), breaker.OPEN)
+        # Twice as long this time
+        self.clock.now += 59
+        self.assertRaises(breaker.CircuitOpenError, self.pool.get, self.url)
+        self.clock.now += 1
+        self.get_error(requests.exceptions.Timeout())
+        # Up to max_delay
+        self.clock.now += 100
+        self.assertTrue(self.breaker.allow(self.host))
+
+    def testProbeOtherError(self):
+        self.open()
+        self.clock.now += 30
+        self.get_error(requests.exceptions.TooManyRedirects())
+        self.assertEqual(self.breaker.state(self.host), breaker.CLOSED)
+        self.get_error(ValueError())
+        self.assertEqual(self.breaker.state(self.host), breaker.CLOSED)
+
+    def testLostProbe(self):
+        self.open()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow(self.host))
+        self.assertEqual(self.breaker.state(self.host), breaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow(self.host))
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow(self.host))
+        self.assertFalse(self.breaker.allow(self.host))
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    """
+    /login sets a cookie and redirects to /home, which echoes the cookies
+    it was sent
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/login":
+            self.send_response(302)
+            self.send_header("Set-Cookie", "session=secret; Path=/")
+            self.send_header("Location", "/home")
+            body = b""
+        else:
+            self.send_response(200)
+            body = self.headers.get("Cookie", "").encode("utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SessionPoolTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CookieHandler)
+        self.url = "http://127.0.0.1:%s" % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.pool = sessions.SessionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
+    def testCookies(self):
+        # Kept across the redirects of one lookup, but not for the next one
+        self.assertEqual(self.pool.get(self.url + "/login").text, "session=secret")
+        self.assertEqual(len(self.pool.session(self.url).cookies), 0)
+        self.assertEqual(self.pool.get(self.url + "/home").text, "")
+
+    def testStats(self):
+        # The redirect and both lookups go over one kept-alive connection
+        self.pool.get(self.url + "/login")
+        self.pool.get(self.url + "/home")
+        self.assertEqual(
+            self.pool.stats(),
+            {"sessions": 1, "requests": 3, "connections": 1, "reuse_ratio": 2 / 3},
+        )
+        # Counts of closed sessions are kept
+        self.pool.close()
+        self.assertEqual(self.pool.stats()["requests"], 3)
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
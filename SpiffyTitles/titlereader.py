@@ -0,0 +1,149 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+titlereader: reads just enough of an HTML response to find its title.
+"""
+
+import codecs
+import re
+from html.parser import HTMLParser
+
+CHUNK_SIZE = 8192
+# Bytes looked at for a <meta charset> before decoding starts
+SNIFF_SIZE = 2048
+
+meta_charset_re = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)""", re.IGNORECASE
+)
+
+
+class TitleParser(HTMLParser):
+    """
+    Incremental parser that stops caring about the document once <title> is
+    complete. og:title is remembered as a fallback for pages without a
+    <title> in their <head>.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.og_title = None
+        self.head_done = False
+        self._in_title = False
+        self._parts = []
+
+    @property
+    def done(self):
+        return self.title is not None or (self.head_done and self.og_title)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and self.title is None:
+            self._in_title = True
+            self._parts = []
+        elif tag == "meta" and self.og_title is None:
+            attrs = dict(attrs)
+            name = attrs.get("property") or attrs.get("name") or ""
+            content = (attrs.get("content") or "").strip()
+            if name.lower() == "og:title" and content:
+                self.og_title = content
+        elif tag == "body":
+            self.head_done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            title = "".join(self._parts).strip()
+            if title:
+                self.title = title
+        elif tag == "head":
+            self.head_done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._parts.append(data)
+
+
+def get_encoding(response, head):
+    """
+    Charset from a BOM, a <meta> tag or the Content-Type header, in that
+    order, defaulting to UTF-8. The page knows its own encoding better than
+    servers that send a default charset with everything.
+    """
+    content_type = response.headers.get("content-type", "")
+    encodings = []
+    if head.startswith(codecs.BOM_UTF8):
+        encodings.append("utf-8-sig")
+    match = meta_charset_re.search(head)
+    if match:
+        encodings.append(match.group(1).decode("ascii"))
+    if "charset=" in content_type.lower() and response.encoding:
+        encodings.append(response.encoding)
+    for encoding in encodings:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+def read_title(response, max_bytes=0):
+    """
+    Streams the body of response until its title is found or max_bytes have
+    been read (0 means no limit). Returns (title, body) where title is None if
+    none was found and body holds the bytes read, for fallback parsing.
+    """
+    parser = TitleParser()
+    decoder = None
+    body = bytearray()
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if max_bytes and len(body) + len(chunk) > max_bytes:
+            chunk = chunk[: max_bytes - len(body)]
+        body += chunk
+        if decoder is None:
+            if len(body) < SNIFF_SIZE and not (max_bytes and len(body) >= max_bytes):
+                continue
+            decoder = codecs.getincrementaldecoder(get_encoding(response, body))(
+                errors="replace"
+            )
+            chunk = bytes(body)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or (max_bytes and len(body) >= max_bytes):
+            break
+    else:
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(get_encoding(response, body))(
+                errors="replace"
+            )
+            parser.feed(decoder.decode(bytes(body), final=True))
+        else:
+            parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+    title = parser.title or parser.og_title
+    return (title, bytes(body))
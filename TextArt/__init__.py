@@ -48,12 +48,26 @@ __contributors__ = {}
 # This is a url where the most recent plugin package can be downloaded.
 __url__ = "https://github.com/oddluck/limnoria-plugins/"
 
+from . import cache
 from . import config
+from . import download
+from . import encoder
+from . import palette
+from . import pool
+from . import render
+from . import sgr
 from . import plugin
 from importlib import reload
 
 # In case we're being reloaded.
+reload(cache)
 reload(config)
+reload(download)
+reload(encoder)
+reload(palette)
+reload(pool)
+reload(render)
+reload(sgr)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
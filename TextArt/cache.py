@@ -0,0 +1,224 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+cache: rendered images, least recently used evicted first, optionally kept on
+disk.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Rough per-entry bookkeeping cost (list, key tuple, OrderedDict node)
+ENTRY_OVERHEAD = 256
+
+
+def image_digest(data):
+    """
+    Content hash of downloaded image bytes
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+def render_key(digest, options):
+    """
+    Cache key of an image rendered with a dict of render options
+    """
+    return (digest,) + tuple(sorted(options.items()))
+
+
+def render_size(lines):
+    return ENTRY_OVERHEAD + sum(len(line.encode("utf-8")) for line in lines)
+
+
+class RenderCache:
+    """
+    Maps render keys to (lines, source colors). The least recently used
+    renders are evicted once max_bytes is exceeded, 0 disables the cache.
+
+    With a directory, renders are also written there as JSON files and
+    lookups that miss in memory fall back to them. The directory is pruned
+    to max_disk_bytes, least recently used files first, 0 means unlimited.
+    """
+
+    def __init__(self, max_bytes=8388608, directory=None, max_disk_bytes=67108864):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._files = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def get(self, key):
+        """
+        Returns (lines, source colors) rendered for key, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return
+            self._insert(key, entry)
+            self.hits += 1
+            self.disk_hits += 1
+            return entry
+
+    def put(self, key, lines, source_colors):
+        entry = (list(lines), source_colors)
+        with self._lock:
+            self._insert(key, entry)
+        if self.directory:
+            self._store(key, entry)
+
+    def resize(self, max_bytes, max_disk_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.max_disk_bytes = max_disk_bytes
+            self._evict()
+            self._prune()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "disk_hits": self.disk_hits,
+                "files": len(self._files),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _insert(self, key, entry):
+        if key in self._entries:
+            self._bytes -= self._sizes.pop(key)
+            del self._entries[key]
+        size = render_size(entry[0])
+        if not self.max_bytes or size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._sizes[key] = size
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._entries and self._bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            del self._entries[key]
+            self._bytes -= self._sizes.pop(key)
+
+    def _filename(self, key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".json"
+
+    def _scan(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+        for (mtime, name, size) in sorted(files):
+            self._files[name] = size
+            self._disk_bytes += size
+        self._prune()
+
+    def _load(self, key):
+        if not self.directory:
+            return
+        name = self._filename(key)
+        with self._lock:
+            if name not in self._files:
+                return
+            self._files.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return
+        # Different keys could share a file name in theory, compare them
+        if data.get("key") != repr(key):
+            return
+        return (data["lines"], data["colors"])
+
+    def _store(self, key, entry):
+        name = self._filename(key)
+        path = os.path.join(self.directory, name)
+        data = json.dumps(
+            {"key": repr(key), "lines": entry[0], "colors": entry[1]},
+            ensure_ascii=False,
+        )
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= self._files.pop(name, 0)
+            self._files[name] = len(data.encode("utf-8"))
+            self._disk_bytes += self._files[name]
+            self._prune()
+
+    def _prune(self):
+        while (
+            self._files
+            and self.max_disk_bytes
+            and self._disk_bytes > self.max_disk_bytes
+        ):
+            (name, size) = self._files.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
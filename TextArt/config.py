@@ -67,7 +67,135 @@ conf.registerChannelValue(
 )
 
 conf.registerGlobalValue(
-    TextArt, "cacheColors", registry.Boolean(False, _("""Cache color calculations.""")),
+    TextArt,
+    "cacheColors",
+    registry.Boolean(
+        False,
+        _(
+            """
+            Keep the color lookup tables memory-mapped in the data directory,
+            so color matches survive restarts.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "colorTableBits",
+    registry.Integer(
+        8,
+        _(
+            """
+            Bits per RGB channel of the color lookup tables (1-8). 8 bits match
+            every color exactly; fewer bits make smaller tables (2**(3*bits)
+            bytes, 256 KiB for 6 bits) at the cost of slightly different
+            colors.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "renderCacheMaxBytes",
+    registry.NonNegativeInteger(
+        8388608,
+        _(
+            """
+            Maximum size in bytes of the img render cache, which keeps the output
+            of images rendered with the same options. The least recently used
+            renders are evicted first. 0 disables the cache.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "renderCachePersistent",
+    registry.Boolean(
+        False,
+        _(
+            """
+            Also keep rendered images in the data directory so they survive
+            restarts. Requires reloading the plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "renderCacheDiskMaxBytes",
+    registry.NonNegativeInteger(
+        67108864,
+        _(
+            """
+            Maximum size in bytes of the rendered images kept in the data
+            directory. The least recently used are removed first. 0 means
+            unlimited.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "maxImageBytes",
+    registry.NonNegativeInteger(
+        20971520,
+        _(
+            """
+            Largest image file img downloads, in bytes. 0 means unlimited.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "maxImagePixels",
+    registry.NonNegativeInteger(
+        40000000,
+        _(
+            """
+            Largest image img decodes, in pixels. JPEGs are decoded at a reduced
+            resolution close to the render size, this applies to that
+            resolution. 0 means unlimited.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "renderWorkers",
+    registry.NonNegativeInteger(
+        2,
+        _(
+            """
+            Number of worker processes converting images, so renders don't hold
+            up the rest of the bot. 0 renders in the command's own thread.
+            Requires reloading the plugin.
+            """
+        ),
+    ),
+)
+
+conf.registerGlobalValue(
+    TextArt,
+    "renderQueueSize",
+    registry.PositiveInteger(
+        8,
+        _(
+            """
+            Maximum number of images waiting for a render worker. Channels take
+            turns; requests beyond this are refused until the queue drains.
+            Requires reloading the plugin.
+            """
+        ),
+    ),
 )
 
 conf.registerChannelValue(
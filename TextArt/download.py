@@ -0,0 +1,60 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+download: size-capped image downloads.
+"""
+
+CHUNK_SIZE = 65536
+
+
+class ImageTooLarge(Exception):
+    """
+    Raised for images over the byte or pixel limits
+    """
+
+
+def read_capped(response, max_bytes, chunk_size=CHUNK_SIZE):
+    """
+    Reads the body of a streamed requests response, raising ImageTooLarge as
+    soon as it is known to be over max_bytes (0 means unlimited).
+    """
+    length = response.headers.get("content-length", "")
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        response.close()
+        raise ImageTooLarge("image is over {0} bytes".format(max_bytes))
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size):
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            response.close()
+            raise ImageTooLarge("image is over {0} bytes".format(max_bytes))
+        chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,214 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+encoder: turns rows of IRC color codes into half block lines.
+"""
+
+SPACE = " "
+UPPER = "▀"
+LOWER = "▄"
+FULL = "█"
+# Colors no pixel has, so the first cell of a line always sets its colors
+NO_COLOR = 99
+
+
+def encode_halfblocks(codes, tops=False):
+    """
+    Encodes rows of IRC color codes as lines of half blocks, one line for
+    every two rows. With tops, only upper half blocks are used.
+    """
+    return [
+        encode_row(codes[j], codes[j + 1], tops) for j in range(0, len(codes) - 1, 2)
+    ]
+
+
+def encode_row(top, bottom, tops=False):
+    """
+    Encodes one line from the colors of its top and bottom pixel rows. Cells
+    only carry a color code where the colors change, picking whichever of
+    upper half, lower half, full block or space needs the fewest codes.
+    """
+    # Each token is [fg, bg, text], a fg of None is text without a color code.
+    # Some cells take back the token of the previous one to merge with it.
+    tokens = []
+    (old1, old2) = (NO_COLOR, NO_COLOR)
+    old_char = None
+    for (c1, c2) in zip(top, bottom):
+        char = SPACE if c1 == c2 else UPPER
+        if c1 == old1 and c2 == old2:
+            tokens.append([None, None, char])
+            old_char = char
+        elif char == SPACE and c1 == old2:
+            tokens.append([None, None, SPACE])
+            old_char = char
+        elif char == SPACE and c1 == old1 and old_char in (FULL, "^" + FULL):
+            tokens[-1] = [1, c1, SPACE * 2]
+            (old1, old2) = (1, c1)
+            old_char = char
+        elif char == SPACE and c1 == old1 and old_char == "^^" + UPPER and not tops:
+            tokens[-1] = [old2, c1, LOWER + SPACE]
+            (old1, old2) = (old2, c1)
+            old_char = char
+        elif char == SPACE and c1 == old1 and old_char != FULL and not tops:
+            tokens.append([None, None, FULL])
+            old_char = FULL
+        elif char == SPACE and not tops:
+            tokens.append([c1, None, FULL])
+            old1 = c1
+            old_char = "^" + FULL
+        elif char != SPACE and c1 == old1 and old_char == "^" + FULL and not tops:
+            tokens[-1] = [c2, c1, SPACE + LOWER]
+            (old1, old2) = (c2, c1)
+            old_char = LOWER
+        elif char != SPACE and c2 == old1 and old_char == "^" + FULL:
+            tokens[-1] = [c1, c2, SPACE + UPPER]
+            (old1, old2) = (c1, c2)
+            old_char = char
+        elif (
+            char != SPACE
+            and c1 == old2
+            and c2 == old1
+            and old_char == "^^" + UPPER
+            and not tops
+        ):
+            tokens[-1] = [c1, c2, LOWER + UPPER]
+            (old1, old2) = (c1, c2)
+            old_char = char
+        elif (
+            char != SPACE
+            and c1 == old1
+            and c2 != old2
+            and old_char in ("^^" + UPPER, "^" + UPPER)
+            and not tops
+        ):
+            tokens[-1] = [old2, c1, LOWER]
+            tokens.append([c2, None, LOWER])
+            (old1, old2) = (c2, c1)
+            old_char = LOWER
+        elif char != SPACE and c1 == old2 and c2 == old1 and not tops:
+            tokens.append([None, None, LOWER])
+            old_char = LOWER
+        elif char != SPACE and c1 == old2 and not tops:
+            tokens.append([c2, None, LOWER])
+            old1 = c2
+            old_char = LOWER
+        elif c1 != old1 and c2 == old2:
+            tokens.append([c1, None, char])
+            old1 = c1
+            old_char = char if char == SPACE else "^" + UPPER
+        else:
+            tokens.append([c1, c2, char])
+            (old1, old2) = (c1, c2)
+            old_char = char if char == SPACE else "^^" + UPPER
+    if tops:
+        _blank_foregrounds(tokens)
+    _merge_foregrounds(tokens)
+    return "".join(_format(token) for token in tokens)
+
+
+def _space_run(tokens, i):
+    """
+    End of the spaces starting at the colored token i, or None if it has
+    other text. The end is the index of the next token that isn't a space
+    without color code.
+    """
+    if tokens[i][2].strip(SPACE):
+        return None
+    j = i + 1
+    while j < len(tokens) and tokens[j][0] is None and tokens[j][2] == SPACE:
+        j += 1
+    return j
+
+
+def _blank_foregrounds(tokens):
+    """
+    Sets the unused foreground of spaces with both colors to 1, where the
+    spaces run up to the next color code or the end of the line.
+    """
+    blank = set()
+    # Runs ending in a color code take that code with them, so the token
+    # right after a match never starts one itself.
+    i = 0
+    while i < len(tokens):
+        j = _space_run(tokens, i) if tokens[i][1] is not None else None
+        if j is not None and j < len(tokens) and tokens[j][0] is not None:
+            blank.add(i)
+            i = j + 1
+        else:
+            i += 1
+    for i in range(len(tokens)):
+        if tokens[i][1] is not None and _space_run(tokens, i) == len(tokens):
+            blank.add(i)
+    i = 0
+    while i < len(tokens):
+        if (
+            tokens[i][1] is not None
+            and tokens[i][2] == SPACE
+            and i + 1 < len(tokens)
+            and tokens[i + 1][0] is not None
+        ):
+            blank.add(i)
+            i += 2
+        else:
+            i += 1
+    for i in blank:
+        tokens[i][0] = 1
+
+
+def _merge_foregrounds(tokens):
+    """
+    Moves the foreground of a color code that follows spaces with foreground
+    1 up to those spaces, saving the code's background.
+    """
+    i = 0
+    while i < len(tokens):
+        j = None
+        if tokens[i][0] == 1 and tokens[i][1] is not None:
+            j = _space_run(tokens, i)
+        if (
+            j is not None
+            and j < len(tokens)
+            and tokens[j][0] is not None
+            and tokens[j][1] is None
+        ):
+            tokens[i][0] = tokens[j][0]
+            tokens[j][0] = None
+            i = j + 1
+        else:
+            i += 1
+
+
+def _format(token):
+    (fg, bg, text) = token
+    if fg is None:
+        return text
+    if bg is None:
+        return "\x03{0}{1}".format(fg, text)
+    return "\x03{0},{1}{2}".format(fg, bg, text)
@@ -0,0 +1,284 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+"""
+palette: vectorized matching of RGB pixels to the nearest IRC color, through
+lookup tables shared by all renders.
+"""
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from .colors import colors16, colors83, colors99
+
+PALETTES = {16: colors16, 83: colors83, 99: colors99}
+# Colors compared against the palette at once, bounds temporary arrays
+CHUNK_SIZE = 4096
+# Cube cells hold IRC code + 1, 0 for cells that have not been matched yet
+UNKNOWN = 0
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def palette_arrays(colors):
+    """
+    Returns the Lab values and IRC codes of a palette (16, 83 or 99 colors)
+    """
+    palette = PALETTES.get(colors, colors83)
+    labs = np.array(list(palette.keys()), dtype=np.float64)
+    codes = np.array(list(palette.values()), dtype=np.uint8)
+    return (labs, codes)
+
+
+def rgb2lab(rgb):
+    """
+    Converts an array of RGB values (last axis) to CIE Lab, D65/2°, with the
+    same rounding as the palette tables.
+    """
+    value = np.asarray(rgb, dtype=np.float64) / 255
+    value = np.where(value > 0.04045, ((value + 0.055) / 1.055) ** 2.4, value / 12.92)
+    value = value * 100
+    (r, g, b) = (value[..., 0], value[..., 1], value[..., 2])
+    xyz = np.stack(
+        [
+            np.round(r * 0.4124 + g * 0.3576 + b * 0.1805, 4) / 95.047,
+            np.round(r * 0.2126 + g * 0.7152 + b * 0.0722, 4) / 100.0,
+            np.round(r * 0.0193 + g * 0.1192 + b * 0.9505, 4) / 108.883,
+        ],
+        axis=-1,
+    )
+    xyz = np.where(
+        xyz > 0.008856, xyz ** 0.3333333333333333, (7.787 * xyz) + (16 / 116)
+    )
+    (x, y, z) = (xyz[..., 0], xyz[..., 1], xyz[..., 2])
+    return np.stack(
+        [
+            np.round((116 * y) - 16, 4),
+            np.round(500 * (x - y), 4),
+            np.round(200 * (y - z), 4),
+        ],
+        axis=-1,
+    )
+
+
+def ciede2000(lab1, lab2):
+    """
+    CIEDE2000 color difference, https://peteroupc.github.io/colorgen.html
+    Broadcasts over all leading axes of lab1 and lab2.
+    """
+    (l1, a1, b1) = (lab1[..., 0], lab1[..., 1], lab1[..., 2])
+    (l2, a2, b2) = (lab2[..., 0], lab2[..., 1], lab2[..., 2])
+    dl = l2 - l1
+    hl = l1 + dl * 0.5
+    sqb1 = b1 * b1
+    sqb2 = b2 * b2
+    c1 = np.sqrt(a1 * a1 + sqb1)
+    c2 = np.sqrt(a2 * a2 + sqb2)
+    hc7 = ((c1 + c2) * 0.5) ** 7
+    trc = np.sqrt(hc7 / (hc7 + 6103515625))
+    t2 = 1.5 - trc * 0.5
+    ap1 = a1 * t2
+    ap2 = a2 * t2
+    c1 = np.sqrt(ap1 * ap1 + sqb1)
+    c2 = np.sqrt(ap2 * ap2 + sqb2)
+    dc = c2 - c1
+    hc = c1 + dc * 0.5
+    hc7 = hc ** 7
+    trc = np.sqrt(hc7 / (hc7 + 6103515625))
+    h1 = np.arctan2(b1, ap1)
+    h1 = np.where(h1 < 0, h1 + np.pi * 2, h1)
+    h2 = np.arctan2(b2, ap2)
+    h2 = np.where(h2 < 0, h2 + np.pi * 2, h2)
+    hdiff = h2 - h1
+    hh = h1 + h2
+    wrap = np.abs(hdiff) > np.pi
+    hh = np.where(wrap, hh + np.pi * 2, hh)
+    hdiff = np.where(
+        wrap, np.where(h2 <= h1, hdiff + np.pi * 2, hdiff - np.pi * 2), hdiff
+    )
+    hh = hh * 0.5
+    t2 = 1 - 0.17 * np.cos(hh - np.pi / 6) + 0.24 * np.cos(hh * 2)
+    t2 = t2 + 0.32 * np.cos(hh * 3 + np.pi / 30)
+    t2 = t2 - 0.2 * np.cos(hh * 4 - np.pi * 63 / 180)
+    dh = 2 * np.sqrt(c1 * c2) * np.sin(hdiff * 0.5)
+    sqhl = (hl - 50) * (hl - 50)
+    fl = dl / (1 + (0.015 * sqhl / np.sqrt(20 + sqhl)))
+    fc = dc / (hc * 0.045 + 1)
+    fh = dh / (t2 * hc * 0.015 + 1)
+    dt = 30 * np.exp(-((36 * hh - 55 * np.pi) ** 2) / (25 * np.pi * np.pi))
+    r = -2 * trc * np.sin(2 * dt * np.pi / 180)
+    de = np.sqrt(fl * fl + fc * fc + fh * fh + r * fc * fh)
+    return 1.43 * de ** 0.70
+
+
+def nearest(labs, palette_labs, speed):
+    """
+    Index of the nearest palette color for each Lab value, by Euclidean
+    distance ("fast") or CIEDE2000 ("slow"). Ties go to the first color.
+    """
+    result = np.empty(len(labs), dtype=np.intp)
+    for start in range(0, len(labs), CHUNK_SIZE):
+        chunk = labs[start : start + CHUNK_SIZE, np.newaxis, :]
+        if speed == "fast":
+            distances = ((chunk - palette_labs) ** 2).sum(axis=-1)
+        else:
+            distances = ciede2000(chunk, palette_labs)
+        result[start : start + CHUNK_SIZE] = distances.argmin(axis=1)
+    return result
+
+
+class ColorTable:
+    """
+    Nearest IRC color of every RGB color, as a cube of 2**bits cells per
+    channel (16 MiB for 8 bits, 256 KiB for 6). A cell is matched by its
+    center color the first time a pixel falls into it, so 8 bits matches
+    every color exactly. The cube starts out zeroed, memory is only taken for
+    the pages that have been filled. With a filename the cube is a
+    memory-mapped .npy file, so matches are kept across restarts.
+    """
+
+    def __init__(self, colors, speed, bits=8, filename=None):
+        self.colors = colors
+        self.speed = speed
+        self.bits = bits
+        self.shift = 8 - bits
+        self.filename = filename
+        size = 1 << (3 * bits)
+        cube = None
+        if filename and os.path.exists(filename):
+            try:
+                cube = np.load(filename, mmap_mode="r+")
+            except (OSError, ValueError):
+                cube = None
+            if cube is not None and (cube.shape != (size,) or cube.dtype != np.uint8):
+                cube = None
+        if cube is None and filename:
+            cube = self.create(filename, size)
+        elif cube is None:
+            cube = np.zeros(size, dtype=np.uint8)
+        self.cube = cube
+
+    def create(self, filename, size):
+        """
+        Writes an empty cube next to filename and moves it into place, so no
+        other process or later start ever opens a partly written table
+        """
+        (fd, temp) = tempfile.mkstemp(
+            prefix=".colors-", suffix=".npy", dir=os.path.dirname(filename) or "."
+        )
+        os.close(fd)
+        try:
+            cube = np.lib.format.open_memmap(
+                temp, mode="w+", dtype=np.uint8, shape=(size,)
+            )
+            cube.flush()
+            del cube
+            os.replace(temp, filename)
+        except BaseException:
+            os.remove(temp)
+            raise
+        # Cells are filled in place from now on, each write is a single byte
+        return np.load(filename, mmap_mode="r+")
+
+    def index(self, pixels):
+        """
+        Cube cell of each RGB pixel (last axis)
+        """
+        rgb = np.asarray(pixels, dtype=np.uint8).astype(np.intp) >> self.shift
+        return (
+            (rgb[..., 0] << (2 * self.bits)) | (rgb[..., 1] << self.bits) | rgb[..., 2]
+        )
+
+    def lookup(self, pixels):
+        """
+        Maps an array of RGB pixels (e.g. an image of shape rows × cols × 3) to
+        IRC color codes of shape rows × cols. Returns (codes, number of distinct
+        source colors at the table's resolution).
+        """
+        index = self.index(pixels)
+        cells = np.unique(index)
+        missing = cells[self.cube[cells] == UNKNOWN]
+        if len(missing):
+            # Renders racing on the same cells write the same codes, no lock
+            self.fill(missing)
+        return (self.cube[index] - 1, len(cells))
+
+    def fill(self, cells):
+        mask = (1 << self.bits) - 1
+        rgb = np.stack(
+            [
+                (cells >> (2 * self.bits)) & mask,
+                (cells >> self.bits) & mask,
+                cells & mask,
+            ],
+            axis=-1,
+        )
+        rgb = (rgb << self.shift) + ((1 << self.shift) >> 1)
+        (palette_labs, palette_codes) = palette_arrays(self.colors)
+        matches = nearest(rgb2lab(rgb), palette_labs, self.speed)
+        self.cube[cells] = palette_codes[matches] + 1
+
+    def flush(self):
+        if isinstance(self.cube, np.memmap):
+            self.cube.flush()
+
+
+def color_table(colors, speed, bits=8, directory=None):
+    """
+    Returns the ColorTable shared by all renders with this palette size
+    (16, 83 or 99), distance mode and resolution. With a directory the table
+    is kept there.
+    """
+    colors = colors if colors in PALETTES else 83
+    speed = "fast" if speed == "fast" else "slow"
+    bits = min(max(int(bits), 1), 8)
+    key = (colors, speed, bits, directory)
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is None:
+            filename = None
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+                filename = os.path.join(
+                    directory, "colors-{0}-{1}-{2}.npy".format(colors, speed, bits)
+                )
+            table = _tables[key] = ColorTable(colors, speed, bits, filename)
+        return table
+
+
+def flush_tables():
+    with _tables_lock:
+        tables = list(_tables.values())
+    for table in tables:
+        table.flush()
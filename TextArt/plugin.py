@@ -27,7 +27,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
-import supybot.ansi as ansi
+import supybot.conf as conf
+import supybot.world as world
 import supybot.utils as utils
 from supybot.commands import *
 import supybot.plugins as plugins
@@ -38,27 +39,23 @@ import supybot.ircmsgs as ircmsgs
 import supybot.log as log
 import os
 import requests
-from PIL import Image, ImageOps, ImageFont, ImageDraw, ImageEnhance
-import numpy as np
-import sys, math
+from PIL import ImageOps
+import sys
 import re
 import asyncio
+from concurrent.futures import CancelledError
 import pexpect
 import time
 import random
 import pyimgur
 from bs4 import BeautifulSoup
 import json
-from .colors import (
-    rgbColors,
-    colors16,
-    colors83,
-    colors99,
-    ansi16,
-    ansi83,
-    ansi99,
-    x16colors,
-)
+from .cache import RenderCache, image_digest, render_key
+from .download import ImageTooLarge, read_capped
+from .palette import flush_tables
+from .pool import RenderPool, RenderQueueFull
+from .render import render_data, render_text
+from .sgr import ansi2irc
 
 try:
     from supybot.i18n import PluginInternationalization
@@ -78,12 +75,54 @@ class TextArt(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(TextArt, self)
         self.__parent.__init__(irc)
-        self.colors = 99
         self.stopped = {}
-        self.old_color = None
-        self.source_colors = 0
+        # Number of cq per channel, renders started before the last one stop
+        self.stops = {}
         self.agents = self.registryValue("userAgents")
-        self.matches = {}
+        self.render_cache = RenderCache(
+            self.registryValue("renderCacheMaxBytes"),
+            self.getRenderDirectory(),
+            self.registryValue("renderCacheDiskMaxBytes"),
+        )
+        self.render_pool = RenderPool(
+            self.registryValue("renderWorkers"), self.registryValue("renderQueueSize")
+        )
+        world.flushers.append(flush_tables)
+
+    def die(self):
+        if flush_tables in world.flushers:
+            world.flushers.remove(flush_tables)
+        flush_tables()
+        self.render_pool.shutdown()
+        self.__parent.die()
+
+    def render(self, irc, channel, function, *args, **kwargs):
+        """
+        Runs function(*args, **kwargs) on the render pool in channel's turn and
+        returns its result. Returns None if the queue is full or the render was
+        stopped with cq.
+        """
+        stops = self.stops.get(channel, 0)
+        try:
+            future = self.render_pool.submit(
+                channel,
+                lambda: self.stops.get(channel, 0) != stops,
+                function,
+                *args,
+                **kwargs
+            )
+        except RenderQueueFull:
+            irc.reply(
+                "Too many images in progress, try again later.",
+                private=False,
+                notice=False,
+            )
+            return
+        try:
+            return future.result()
+        except CancelledError:
+            log.debug("TextArt: render for {0} stopped".format(channel))
+            return
 
     def doPrivmsg(self, irc, msg):
         channel = msg.args[0]
@@ -91,7 +130,30 @@ class TextArt(callbacks.Plugin):
             channel = msg.nick
         self.stopped.setdefault(channel, None)
         if msg.args[1].lower().strip()[1:] == "cq":
-            self.stopped[channel] = True
+            self.stop(channel)
+
+    def stop(self, channel):
+        """
+        Stops the output and the renders in progress for channel
+        """
+        self.stopped[channel] = True
+        self.stops[channel] = self.stops.get(channel, 0) + 1
+
+    def getTableDirectory(self):
+        """
+        Where color lookup tables are kept, None to keep them in memory only
+        """
+        if self.registryValue("cacheColors"):
+            return conf.supybot.directories.data.dirize("TextArt")
+        return None
+
+    def getRenderDirectory(self):
+        """
+        Where rendered images are kept, None to keep them in memory only
+        """
+        if self.registryValue("renderCachePersistent"):
+            return conf.supybot.directories.data.dirize("TextArt/renders")
+        return None
 
     def doPaste(self, description, paste):
         try:
@@ -110,315 +172,6 @@ class TextArt(callbacks.Plugin):
                 " https://paste.ee/account/api"
             )
 
-    def renderImage(self, text, size=18, defaultBg=1, defaultFg=0):
-        try:
-            if utf8 and not isinstance(text, unicode):
-                text = text.decode("utf-8")
-        except:
-            pass
-        text = text.replace("\t", " ")
-        self.strip_colors_regex = re.compile(
-            "(\x03([0-9]{1,2})(,[0-9]{1,2})?)|[\x0f\x02\x1f\x03\x16]"
-        ).sub
-        path = os.path.dirname(os.path.abspath(__file__))
-        defaultFont = "{0}/DejaVu.ttf".format(path)
-
-        def strip_colors(string):
-            return self.strip_colors_regex("", string)
-
-        _colorRegex = re.compile("(([0-9]{1,2})(,([0-9]{1,2}))?)")
-        IGNORE_CHRS = ("\x16", "\x1f", "\x02", "\x03", "\x0f")
-        lineLens = [len(line) for line in strip_colors(text).splitlines()]
-        maxWidth, height = max(lineLens), len(lineLens)
-        font = ImageFont.truetype(defaultFont, size)
-        fontX = 10
-        fontY = 20
-        imageX, imageY = maxWidth * fontX, height * fontY
-        image = Image.new("RGB", (imageX, imageY), rgbColors[defaultBg])
-        draw = ImageDraw.Draw(image)
-        dtext, drect, match, x, y, fg, bg = (
-            draw.text,
-            draw.rectangle,
-            _colorRegex.match,
-            0,
-            0,
-            defaultFg,
-            defaultBg,
-        )
-        for text in text.split("\n"):
-            ll, i = len(text), 0
-            while i < ll:
-                chr = text[i]
-                if chr == "\x03":
-                    m = match(text[i + 1 : i + 6])
-                    if m:
-                        i += len(m.group(1))
-                        fg = int(m.group(2))
-                        if m.group(4) is not None:
-                            bg = int(m.group(4))
-                    else:
-                        bg, fg = defaultBg, defaultFg
-                elif chr == "\x0f":
-                    fg, bg = defaultFg, defaultBg
-                elif chr not in IGNORE_CHRS:
-                    if bg != defaultBg:  # bg is not white, render it
-                        drect((x, y, x + fontX, y + fontY), fill=rgbColors[bg])
-                    if bg != fg:  # text will show, render it. this saves a lot of time!
-                        dtext((x, y), chr, font=font, fill=rgbColors[fg])
-                    x += fontX
-                i += 1
-            y += fontY
-            fg, bg, x = defaultFg, defaultBg, 0
-        return image
-
-    def getColor(self, pixel, speed):
-        pixel = tuple(pixel)
-        try:
-            return self.matches[pixel]
-        except KeyError:
-            if self.colors == 16:
-                colors = list(colors16.keys())
-            elif self.colors == 99:
-                colors = list(colors99.keys())
-            else:
-                colors = list(colors83.keys())
-            closest_colors = sorted(
-                colors,
-                key=lambda color: self.distance(color, self.rgb2lab(pixel), speed),
-            )
-            closest_color = closest_colors[0]
-            if self.colors == 16:
-                self.matches[pixel] = colors16[closest_color]
-            elif self.colors == 99:
-                self.matches[pixel] = colors99[closest_color]
-            else:
-                self.matches[pixel] = colors83[closest_color]
-            self.source_colors += 1
-            return self.matches[pixel]
-
-    def rgb2lab(self, inputColor):
-        try:
-            return self.labmatches[inputColor]
-        except:
-            num = 0
-            RGB = [0, 0, 0]
-            for value in inputColor:
-                value = float(value) / 255
-                if value > 0.04045:
-                    value = ((value + 0.055) / 1.055) ** 2.4
-                else:
-                    value = value / 12.92
-                RGB[num] = value * 100
-                num = num + 1
-            XYZ = [
-                0,
-                0,
-                0,
-            ]
-            X = RGB[0] * 0.4124 + RGB[1] * 0.3576 + RGB[2] * 0.1805
-            Y = RGB[0] * 0.2126 + RGB[1] * 0.7152 + RGB[2] * 0.0722
-            Z = RGB[0] * 0.0193 + RGB[1] * 0.1192 + RGB[2] * 0.9505
-            XYZ[0] = round(X, 4)
-            XYZ[1] = round(Y, 4)
-            XYZ[2] = round(Z, 4)
-            XYZ[0] = (
-                float(XYZ[0]) / 95.047
-            )  # ref_X =  95.047   Observer= 2°, Illuminant= D65
-            XYZ[1] = float(XYZ[1]) / 100.0  # ref_Y = 100.000
-            XYZ[2] = float(XYZ[2]) / 108.883  # ref_Z = 108.883
-            num = 0
-            for value in XYZ:
-                if value > 0.008856:
-                    value = value ** (0.3333333333333333)
-                else:
-                    value = (7.787 * value) + (16 / 116)
-                XYZ[num] = value
-                num = num + 1
-            Lab = [0, 0, 0]
-            L = (116 * XYZ[1]) - 16
-            a = 500 * (XYZ[0] - XYZ[1])
-            b = 200 * (XYZ[1] - XYZ[2])
-            Lab[0] = round(L, 4)
-            Lab[1] = round(a, 4)
-            Lab[2] = round(b, 4)
-            self.labmatches[inputColor] = Lab
-            return self.labmatches[inputColor]
-
-    def ciede2000(self, lab1, lab2):
-        """ CIEDE2000 color difference formula. https://peteroupc.github.io/colorgen.html"""
-        dl = lab2[0] - lab1[0]
-        hl = lab1[0] + dl * 0.5
-        sqb1 = lab1[2] * lab1[2]
-        sqb2 = lab2[2] * lab2[2]
-        c1 = math.sqrt(lab1[1] * lab1[1] + sqb1)
-        c2 = math.sqrt(lab2[1] * lab2[1] + sqb2)
-        hc7 = math.pow((c1 + c2) * 0.5, 7)
-        trc = math.sqrt(hc7 / (hc7 + 6103515625))
-        t2 = 1.5 - trc * 0.5
-        ap1 = lab1[1] * t2
-        ap2 = lab2[1] * t2
-        c1 = math.sqrt(ap1 * ap1 + sqb1)
-        c2 = math.sqrt(ap2 * ap2 + sqb2)
-        dc = c2 - c1
-        hc = c1 + dc * 0.5
-        hc7 = math.pow(hc, 7)
-        trc = math.sqrt(hc7 / (hc7 + 6103515625))
-        h1 = math.atan2(lab1[2], ap1)
-        if h1 < 0:
-            h1 = h1 + math.pi * 2
-        h2 = math.atan2(lab2[2], ap2)
-        if h2 < 0:
-            h2 = h2 + math.pi * 2
-        hdiff = h2 - h1
-        hh = h1 + h2
-        if abs(hdiff) > math.pi:
-            hh = hh + math.pi * 2
-            if h2 <= h1:
-                hdiff = hdiff + math.pi * 2
-            else:
-                hdiff = hdiff - math.pi * 2
-        hh = hh * 0.5
-        t2 = 1 - 0.17 * math.cos(hh - math.pi / 6) + 0.24 * math.cos(hh * 2)
-        t2 = t2 + 0.32 * math.cos(hh * 3 + math.pi / 30)
-        t2 = t2 - 0.2 * math.cos(hh * 4 - math.pi * 63 / 180)
-        dh = 2 * math.sqrt(c1 * c2) * math.sin(hdiff * 0.5)
-        sqhl = (hl - 50) * (hl - 50)
-        fl = dl / (1 + (0.015 * sqhl / math.sqrt(20 + sqhl)))
-        fc = dc / (hc * 0.045 + 1)
-        fh = dh / (t2 * hc * 0.015 + 1)
-        dt = 30 * math.exp(
-            -math.pow(36 * hh - 55 * math.pi, 2) / (25 * math.pi * math.pi)
-        )
-        r = -2 * trc * math.sin(2 * dt * math.pi / 180)
-        de =  math.sqrt(fl * fl + fc * fc + fh * fh + r * fc * fh)
-        dep = 1.43 * de ** 0.70
-        return dep
-
-    def distance(self, c1, c2, speed):
-        if speed == "fast":
-            delta_e = math.sqrt(
-                (c1[0] - c2[0]) ** 2 + (c1[1] - c2[1]) ** 2 + (c1[2] - c2[2]) ** 2
-            )
-        elif speed == "slow":
-            delta_e = self.ciede2000(c1, c2)
-        return delta_e
-
-    def process_ansi(self, ansi):
-        if self.colors == 16:
-            colors = ansi16
-        elif self.colors == 99:
-            colors = ansi99
-        else:
-            colors = ansi83
-        x16color1 = None
-        x16color2 = None
-        x256color1 = None
-        x256color2 = None
-        effect = None
-        ansi = ansi.lower().strip("\x1b[").strip("m").split(";")
-        if len(ansi) > 1:
-            i = 0
-            while i < len(ansi):
-                if i >= len(ansi):
-                    break
-                elif ansi[i] == "0":
-                    effect = 0
-                    i += 1
-                    continue
-                elif ansi[i] == "1":
-                    effect = 1
-                    i += 1
-                    continue
-                elif ansi[i] == "4":
-                    effect = 4
-                    i += 1
-                    continue
-                elif ansi[i] == "2":
-                    effect = 2
-                    i += 1
-                    continue
-                elif int(ansi[i]) > 29 and int(ansi[i]) < 38:
-                    if effect == 1 or ansi[-1] == "1":
-                        x16color1 = x16colors["{0};1".format(ansi[i])]
-                        effect = None
-                        i += 1
-                        continue
-                    else:
-                        x16color1 = x16colors[ansi[i]]
-                        i += 1
-                        continue
-                elif int(ansi[i]) > 39 and int(ansi[i]) < 48:
-                    if effect == 1 or ansi[-1] == "1":
-                        x16color2 = x16colors["{0};1".format(ansi[i])]
-                        effect = None
-                        i += 1
-                        continue
-                    else:
-                        x16color2 = x16colors[ansi[i]]
-                        i += 1
-                        continue
-                elif ansi[i] == "38":
-                    x256color1 = colors[int(ansi[i + 2])]
-                    i += 3
-                    continue
-                elif ansi[i] == "48":
-                    x256color2 = colors[int(ansi[i + 2])]
-                    i += 3
-                    continue
-                else:
-                    i += 1
-                    continue
-            if x16color1 and x16color2:
-                color = "\x03{0},{1}".format(x16color1, x16color2)
-            elif x256color1 and x256color2:
-                color = "\x03{0},{1}".format(x256color1, x256color2)
-            elif x16color1:
-                color = "\x03{0}".format(x16color1)
-            elif x16color2:
-                color = "\x0399,{0}".format(x16color2)
-            elif x256color1:
-                color = "\x03{0}".format(x256color1)
-            elif x256color2:
-                color = "\x0399,{0}".format(x256color2)
-            else:
-                color = ""
-            if effect == 1:
-                color += "\x02"
-            if effect == 4:
-                color += "\x1F"
-        elif len(ansi[0]) > 0:
-            if ansi[0] == "0":
-                color = "\x0F"
-            elif ansi[0] == "1" or ansi[0] == "2":
-                color = "\x02"
-            elif ansi[0] == "4":
-                color = "\x1F"
-            elif int(ansi[0]) > 29 and int(ansi[0]) < 38:
-                color = "\x03{0}".format(x16colors[ansi[0]])
-            elif int(ansi[0]) > 39 and int(ansi[0]) < 48:
-                color = "\x0399,{0}".format(x16colors[ansi[0]])
-            elif ansi[0][-1] == "c":
-                color = " " * int(ansi[0][:-1])
-            else:
-                color = ""
-        else:
-            color = ""
-        if color != self.old_color:
-            self.old_color = color
-            return color
-        else:
-            return ""
-
-    def ansi2irc(self, output):
-        output = output.replace("\x1b(B\x1b[m", "\x1b[0m")
-        output = output.replace("\x1b\x1b", "\x1b")
-        output = re.sub(
-            "\x1B\[[0-?]*[ -/]*[@-~]", lambda m: self.process_ansi(m.group(0)), output
-        )
-        output = re.sub("\x0399,(\d\d)\x03(\d\d)", "\x03\g<2>,\g<1>", output)
-        output = output.replace("\x0F\x03", "\x03")
-        return output
-
     def png(self, irc, msg, args, optlist, url):
         """[--bg] [--fg] <url>
         Generate PNG from text file
@@ -458,7 +211,12 @@ class TextArt(callbacks.Plugin):
         file = re.sub("(\x03(\d+).*)\x03,", "\g<1>\x03\g<2>,", file).replace(
             "\r\n", "\n"
         )
-        im = self.renderImage(file, 18, bg, fg)
+        channel = msg.args[0]
+        if not irc.isChannel(channel):
+            channel = msg.nick
+        im = self.render(irc, channel, render_text, file, 18, bg, fg)
+        if im is None:
+            return
         path = os.path.dirname(os.path.abspath(__file__))
         filepath = "{0}/tmp/tldr.png".format(path)
         im.save(filepath, "PNG")
@@ -670,13 +428,13 @@ class TextArt(callbacks.Plugin):
         optlist = dict(optlist)
         gscale = "\xa0"
         if "16" in optlist:
-            self.colors = 16
+            colors = 16
         elif "83" in optlist:
-            self.colors = 83
+            colors = 83
         elif "99" in optlist:
-            self.colors = 99
+            colors = 99
         else:
-            self.colors = self.registryValue("colors", msg.args[0])
+            colors = self.registryValue("colors", msg.args[0])
         if "fast" in optlist:
             speed = "fast"
         elif "slow" in optlist:
@@ -744,296 +502,74 @@ class TextArt(callbacks.Plugin):
             cols = self.registryValue("blockWidth", msg.args[0])
         if "s" in optlist:
             s = float(optlist.get("s"))
+        else:
+            s = None
+        if "resize" in optlist:
+            resize = optlist.get("resize")
+        else:
+            resize = self.registryValue("resize", msg.args[0])
         ua = random.choice(self.agents)
         header = {"User-Agent": ua}
         image_formats = ("image/png", "image/jpeg", "image/jpg", "image/gif")
         try:
             r = requests.get(url, stream=True, headers=header, timeout=10)
             r.raise_for_status()
+            if r.headers["content-type"] in image_formats and r.status_code == 200:
+                data = read_capped(r, self.registryValue("maxImageBytes"))
+            else:
+                irc.reply("Error: Invalid file type.", private=False, notice=False)
+                return
         except (
             requests.exceptions.RequestException,
             requests.exceptions.HTTPError,
         ) as e:
             log.debug("TextArt: error retrieving data for img: {0}".format(e))
             return
-        if r.headers["content-type"] in image_formats and r.status_code == 200:
-            r.raw.decode_content = True
-            image = Image.open(r.raw)
-        else:
-            irc.reply("Error: Invalid file type.", private=False, notice=False)
+        except ImageTooLarge as e:
+            irc.reply("Error: {0}.".format(e), private=False, notice=False)
             return
-        # open image and convert to grayscale
         start_time = time.time()
-        self.source_colors = 0
-        if image.mode == "RGBA":
-            if bg == 99:
-                newbg = 1
-            else:
-                newbg = bg
-            image = Image.alpha_composite(
-                Image.new("RGBA", image.size, rgbColors[newbg] + (255,)), image
-            )
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        try:
-            os.remove(filename)
-        except:
-            pass
-        # store dimensions
-        W, H = image.size[0], image.size[1]
-        # compute width of tile
-        w = W / cols
-        # compute tile height based on aspect ratio and scale
-        if type == "1/2":
-            scale = 1.0
-        else:
-            scale = 0.5
-        h = w / scale
-        # compute number of rows
-        rows = int(H / h)
-        if "resize" in optlist:
-            resize = optlist.get("resize")
+        options = {
+            "type": type,
+            "cols": cols,
+            "gscale": gscale,
+            "colors": colors,
+            "speed": speed,
+            "quantize": quantize,
+            "bg": bg,
+            "fg": fg,
+            "saturation": s,
+            "resize": resize,
+            "tops": "tops" in optlist,
+            "chars": "chars" in optlist,
+            "bits": self.registryValue("colorTableBits"),
+        }
+        self.render_cache.resize(
+            self.registryValue("renderCacheMaxBytes"),
+            self.registryValue("renderCacheDiskMaxBytes"),
+        )
+        key = render_key(image_digest(data), options)
+        cached = self.render_cache.get(key)
+        if cached:
+            (aimg, source_colors) = cached
         else:
-            resize = self.registryValue("resize", msg.args[0])
-        if type != "no-color":
-            image2 = image.resize((cols, rows), resize)
-            if "s" in optlist:
-                image2 = ImageEnhance.Color(image2).enhance(s)
-            if quantize:
-                image2 = image2.quantize(dither=None)
-                image2 = image2.convert("RGB")
-            colormap = np.array(image2)
-            self.labmatches = {}
-            if not self.registryValue("cacheColors"):
-                self.matches = {}
-        # ascii image is a list of character strings
-        aimg = []
-        if type == "1/2":
-            k = 0
-            for j in range(0, rows - 1, 2):
-                # append an empty string
-                aimg.append("")
-                old_color1 = "99"
-                old_color2 = "99"
-                old_char = None
-                for i in range(cols):
-                    color1 = "%02d" % self.getColor(colormap[j][i].tolist(), speed)
-                    color2 = "%02d" % self.getColor(colormap[j + 1][i].tolist(), speed)
-                    if color1 == color2:
-                        gsval = " "
-                    else:
-                        gsval = "▀"
-                    if color1 == old_color1 and color2 == old_color2:
-                        aimg[k] += gsval
-                        old_char = gsval
-                    elif gsval == " " and color1 == old_color2:
-                        aimg[k] += " "
-                        old_char = gsval
-                    elif gsval == " " and color1 == old_color1 and old_char == "█":
-                        aimg[k] = aimg[k][:-1]
-                        aimg[k] += "\x0301,{0}  ".format(color1)
-                        old_color1 = "01"
-                        old_color2 = color1
-                        old_char = gsval
-                    elif gsval == " " and color1 == old_color1 and old_char == "^█":
-                        aimg[k] = aimg[k][:-4]
-                        aimg[k] += "\x0301,{0}  ".format(color1)
-                        old_color1 = "01"
-                        old_color2 = color1
-                        old_char = gsval
-                    elif (
-                        gsval == " "
-                        and color1 == old_color1
-                        and old_char == "^^▀"
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] = aimg[k][:-7]
-                        aimg[k] += "\x03{0},{1}▄ ".format(old_color2, color1)
-                        old_color1 = old_color2
-                        old_color2 = color1
-                        old_char = gsval
-                    elif (
-                        gsval == " "
-                        and color1 == old_color1
-                        and old_char != "█"
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] += "█"
-                        old_char = "█"
-                    elif gsval == " " and "tops" not in optlist:
-                        aimg[k] += "\x03{0}█".format(color1)
-                        old_color1 = color1
-                        old_char = "^█"
-                    elif (
-                        gsval != " "
-                        and color1 == old_color1
-                        and old_char == "^█"
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] = aimg[k][:-4]
-                        aimg[k] += "\x03{0},{1} ▄".format(color2, color1)
-                        old_color1 = color2
-                        old_color2 = color1
-                        old_char = "▄"
-                    elif gsval != " " and color2 == old_color1 and old_char == "^█":
-                        aimg[k] = aimg[k][:-4]
-                        aimg[k] += "\x03{0},{1} ▀".format(color1, color2)
-                        old_color1 = color1
-                        old_color2 = color2
-                        old_char = gsval
-                    elif (
-                        gsval != " "
-                        and color1 == old_color2
-                        and color2 == old_color1
-                        and old_char == "^^▀"
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] = aimg[k][:-7]
-                        aimg[k] += "\x03{0},{1}▄▀".format(color1, color2)
-                        old_color1 = color1
-                        old_color2 = color2
-                        old_char = gsval
-                    elif (
-                        gsval != " "
-                        and color1 == old_color1
-                        and color2 != old_color2
-                        and old_char == "^^▀"
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] = aimg[k][:-7]
-                        aimg[k] += "\x03{0},{1}▄\x03{2}▄".format(
-                            old_color2, color1, color2
-                        )
-                        old_color1 = color2
-                        old_color2 = color1
-                        old_char = "▄"
-                    elif (
-                        gsval != " "
-                        and color1 == old_color1
-                        and color2 != old_color2
-                        and old_char == "^▀"
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] = aimg[k][:-4]
-                        aimg[k] += "\x03{0},{1}▄\x03{2}▄".format(
-                            old_color2, color1, color2
-                        )
-                        old_color1 = color2
-                        old_color2 = color1
-                        old_char = "▄"
-                    elif (
-                        gsval != " "
-                        and color1 == old_color2
-                        and color2 == old_color1
-                        and "tops" not in optlist
-                    ):
-                        aimg[k] += "▄"
-                        old_char = "▄"
-                    elif (
-                        gsval != " " and color1 == old_color2 and "tops" not in optlist
-                    ):
-                        aimg[k] += "\x03{0}▄".format(color2)
-                        old_color1 = color2
-                        old_char = "▄"
-                    elif color1 != old_color1 and color2 == old_color2:
-                        aimg[k] += "\x03{0}{1}".format(color1, gsval)
-                        old_color1 = color1
-                        if gsval == " ":
-                            old_char = gsval
-                        else:
-                            old_char = "^▀"
-                    else:
-                        aimg[k] += "\x03{0},{1}{2}".format(color1, color2, gsval)
-                        old_color1 = color1
-                        old_color2 = color2
-                        if gsval == " ":
-                            old_char = gsval
-                        else:
-                            old_char = "^^▀"
-                if "tops" in optlist:
-                    aimg[k] = re.sub("\x03\d\d,(\d\d\s+\x03)", "\x0301,\g<1>", aimg[k])
-                    aimg[k] = re.sub("\x03\d\d,(\d\d\s+$)", "\x0301,\g<1>", aimg[k])
-                    aimg[k] = re.sub("\x03\d\d,(\d\d\s\x03)", "\x0301,\g<1>", aimg[k])
-                aimg[k] = re.sub(
-                    "\x0301,(\d\d)(\s+)\x03(\d\d)([^,])",
-                    "\x03\g<3>,\g<1>\g<2>\g<4>",
-                    aimg[k],
+            try:
+                rendered = self.render(
+                    irc,
+                    channel,
+                    render_data,
+                    data,
+                    directory=self.getTableDirectory(),
+                    max_pixels=self.registryValue("maxImagePixels"),
+                    **options
                 )
-                for i in range(0, 98):
-                    i = "%02d" % i
-                    aimg[k] = aimg[k].replace("{0}".format(i), "{0}".format(int(i)))
-                k += 1
-        else:
-            if "chars" not in optlist and gscale != "\xa0":
-                image = image.resize((cols, rows), resize)
-                image = image.convert("L")
-                lumamap = np.array(image)
-            # generate list of dimensions
-            char = 0
-            for j in range(rows):
-                # append an empty string
-                aimg.append("")
-                old_color = None
-                for i in range(cols):
-                    if "chars" not in optlist and gscale != "\xa0":
-                        # get average luminance
-                        avg = int(np.average(lumamap[j][i]))
-                        # look up ascii char
-                        gsval = gscale[int((avg * (len(gscale) - 1)) / 255)]
-                    elif "chars" in optlist and gscale != "\xa0":
-                        if char < len(gscale):
-                            gsval = gscale[char]
-                            char += 1
-                        else:
-                            char = 0
-                            gsval = gscale[char]
-                            char += 1
-                    else:
-                        gsval = "\xa0"
-                    # get color value
-                    if type != "no-color" and gscale != "\xa0" and i == 0:
-                        color = self.getColor(colormap[j][i].tolist(), speed)
-                        old_color = color
-                        if bg != 99:
-                            color = "{0},{1}".format(color, "{:02d}".format(int(bg)))
-                        if gsval != "\xa0":
-                            aimg[j] += "\x03{0}{1}".format(color, gsval)
-                        else:
-                            aimg[j] += "\x030,{0} ".format(int(color))
-                    elif type == "no-color" and i == 0:
-                        if bg != 99 and fg != 99:
-                            aimg[j] += "\x03{0},{1}{2}".format(
-                                "{:02d}".format(int(fg)),
-                                "{:02d}".format(int(bg)),
-                                gsval,
-                            )
-                        elif fg != 99:
-                            aimg[j] += "\x03{0}{1}".format(
-                                "{:02d}".format(int(fg)), gsval
-                            )
-                        elif bg != 99:
-                            aimg[j] += "\x03{0},{1}{2}".format(
-                                "{:02d}".format(int(fg)),
-                                "{:02d}".format(int(bg)),
-                                gsval,
-                            )
-                    elif type != "no-color" and gsval != " ":
-                        color = self.getColor(colormap[j][i].tolist(), speed)
-                        if color != old_color:
-                            old_color = color
-                            # append ascii char to string
-                            if gsval != "\xa0":
-                                if gsval.isdigit():
-                                    color = "{:02d}".format(int(color))
-                                    aimg[j] += "\x03{0}{1}".format(color, gsval)
-                                else:
-                                    aimg[j] += "\x03{0}{1}".format(int(color), gsval)
-                            else:
-                                aimg[j] += "\x030,{0} ".format(int(color))
-                        else:
-                            aimg[j] += "{0}".format(gsval)
-                    else:
-                        aimg[j] += "{0}".format(gsval)
+            except ImageTooLarge as e:
+                irc.reply("Error: {0}.".format(e), private=False, notice=False)
+                return
+            if rendered is None:
+                return
+            (aimg, source_colors) = rendered
+            self.render_cache.put(key, aimg, source_colors)
         output = aimg
         self.stopped[channel] = False
         end_time = time.time()
@@ -1049,7 +585,7 @@ class TextArt(callbacks.Plugin):
             render_time = "{0:.2f}".format(end_time - start_time)
             irc.reply(
                 "[Source Colors: {0}, Render Time: {1} seconds, Longest Line: {2}"
-                " bytes]".format(self.source_colors, render_time, longest),
+                " bytes]".format(source_colors, render_time, longest),
                 prefixNick=False,
             )
         if self.registryValue("pasteEnable", msg.args[0]):
@@ -1191,13 +727,18 @@ class TextArt(callbacks.Plugin):
                 filename = "{0}/{1}".format(filepath, url.split("/")[-1])
                 open(filename, "wb").write(r.content.replace(b";5;", b";"))
                 try:
-                    output = pexpect.run(
-                        "a2m {0} {1}".format(opts.strip(), str(filename))
+                    output = self.render(
+                        irc,
+                        channel,
+                        pexpect.run,
+                        "a2m {0} {1}".format(opts.strip(), str(filename)),
                     )
                     try:
                         os.remove(filename)
                     except:
                         pass
+                    if output is None:
+                        return
                 except:
                     irc.reply(
                         "Error. Have you installed A2M? https://github.com/tat3r/a2m",
@@ -1303,13 +844,18 @@ class TextArt(callbacks.Plugin):
             with open("{0}".format(filename), "wb") as f:
                 f.write(r.content)
             try:
-                output = pexpect.run(
-                    "p2u -f m {0} {1}".format(opts.strip(), str(filename))
+                output = self.render(
+                    irc,
+                    channel,
+                    pexpect.run,
+                    "p2u -f m {0} {1}".format(opts.strip(), str(filename)),
                 )
                 try:
                     os.remove(filename)
                 except:
                     pass
+                if output is None:
+                    return
             except:
                 irc.reply(
                     "Error. Have you installed p2u? https://git.trollforge.org/p2u",
@@ -1594,14 +1140,14 @@ class TextArt(callbacks.Plugin):
         else:
             delay = self.registryValue("delay", msg.args[0])
         if "16" in optlist:
-            self.colors = 16
+            colors = 16
         elif "99" in optlist:
-            self.colors = 99
+            colors = 99
         else:
-            self.colors = self.registryValue("colors", msg.args[0])
+            colors = self.registryValue("colors", msg.args[0])
         file = requests.get("http://wttr.in/{0}".format(location), timeout=10)
         output = file.content.decode()
-        output = self.ansi2irc(output)
+        output = ansi2irc(output, colors)
         output = re.sub("⚡", "☇ ", output)
         output = re.sub("‘‘", "‘ ", output)
         output = re.sub("\n\nFollow.*$", "", output)
@@ -1649,11 +1195,11 @@ class TextArt(callbacks.Plugin):
         else:
             delay = self.registryValue("delay", msg.args[0])
         if "16" in optlist:
-            self.colors = 16
+            colors = 16
         elif "99" in optlist:
-            self.colors = 99
+            colors = 99
         else:
-            self.colors = self.registryValue("colors", msg.args[0])
+            colors = self.registryValue("colors", msg.args[0])
         if "sub" in optlist:
             sub = optlist.get("sub")
         else:
@@ -1662,7 +1208,7 @@ class TextArt(callbacks.Plugin):
             coin = ""
         file = requests.get("http://{0}.rate.sx/{1}".format(sub, coin), timeout=10)
         output = file.content.decode()
-        output = self.ansi2irc(output)
+        output = ansi2irc(output, colors)
         output = output.replace("\x1b(B", "")
         output = re.sub(r"\n\x0307NEW FEATURE:.*\n.*", "", output).strip()
         output = output.splitlines()
@@ -1774,10 +1320,34 @@ class TextArt(callbacks.Plugin):
         self.stopped.setdefault(channel, None)
         if not self.stopped[channel]:
             irc.reply("Stopping.")
-        self.stopped[channel] = True
+        self.stop(channel)
 
     cq = wrap(cq)
 
+    def rendercache(self, irc, msg, args):
+        """takes no arguments
+
+        Shows the size and hit/miss counters of the img render cache.
+        """
+        stats = self.render_cache.stats()
+        irc.reply(
+            "Render cache: {0} renders ({1} bytes) :: {2} hits, {3} misses ({4:.1%}"
+            " hit ratio){5}".format(
+                stats["entries"],
+                stats["bytes"],
+                stats["hits"],
+                stats["misses"],
+                stats["hit_ratio"],
+                " :: {0} stored ({1} bytes), {2} served from disk".format(
+                    stats["files"], stats["disk_bytes"], stats["disk_hits"]
+                )
+                if self.render_cache.directory
+                else "",
+            )
+        )
+
+    rendercache = wrap(rendercache, ["admin"])
+
     def codes(self, irc, msg, args, optlist):
         """
         Show a grid of IRC color codes.
@@ -0,0 +1,224 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+pool: runs renders in worker processes, taking turns between channels.
+"""
+
+import importlib.machinery
+import importlib.util
+import multiprocessing
+import os
+import runpy
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import (
+    BrokenExecutor,
+    CancelledError,
+    Future,
+    ProcessPoolExecutor,
+)
+
+
+PACKAGE = __name__.rpartition(".")[0]
+# Name this file runs under in the workers
+WORKER = "__worker__"
+
+
+def _register_package(package, path):
+    """
+    Lets a worker import the plugin's modules (render functions are sent by
+    name) without running the plugin's __init__, which needs a bot.
+    """
+    if package not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(package, None, is_package=True)
+        module = importlib.util.module_from_spec(spec)
+        module.__path__ = [path]
+        sys.modules[package] = module
+
+
+class RenderQueueFull(Exception):
+    """
+    Raised when a render is submitted while the queue is full
+    """
+
+
+class _Job:
+    __slots__ = ("future", "function", "args", "kwargs", "cancelled")
+
+    def __init__(self, function, args, kwargs, cancelled):
+        self.future = Future()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = cancelled
+
+
+class RenderPool:
+    """
+    Runs functions in worker processes. Jobs wait in a queue per channel and
+    channels take turns, so one channel asking for many renders doesn't hold
+    up the others. At most max_queued jobs wait for a worker.
+
+    A job is dropped if its cancelled() returns true before it starts, and
+    its result is dropped if it does when the job finishes; its future then
+    raises CancelledError. With no workers, jobs run in the calling thread.
+    """
+
+    def __init__(self, workers=2, max_queued=8):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = self._new_executor() if workers > 0 else None
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def submit(self, channel, cancelled, function, *args, **kwargs):
+        """
+        Queues function(*args, **kwargs) for channel and returns a Future of
+        its result. Raises RenderQueueFull if max_queued jobs are waiting.
+        """
+        job = _Job(function, args, kwargs, cancelled)
+        if self._executor is None:
+            self._run_inline(job)
+            return job.future
+        with self._lock:
+            if self._queued >= self.max_queued:
+                raise RenderQueueFull()
+            self._queues.setdefault(channel, deque()).append(job)
+            self._queued += 1
+            jobs = self._next_jobs()
+        self._start(jobs)
+        return job.future
+
+    def shutdown(self):
+        with self._lock:
+            queues = list(self._queues.values())
+            self._queues.clear()
+            self._queued = 0
+        for jobs in queues:
+            for job in jobs:
+                job.future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _new_executor(self):
+        # Forking the bot would copy its threads' locks in whatever state
+        # they are in, so workers start from a fresh interpreter.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        else:
+            context = multiprocessing.get_context("spawn")
+        # Nothing of the plugin can be unpickled in a new worker before its
+        # package is registered there, so this file is run by path to do it.
+        return ProcessPoolExecutor(
+            self.workers,
+            mp_context=context,
+            initializer=runpy.run_path,
+            initargs=(os.path.abspath(__file__), {"WORKER_PACKAGE": PACKAGE}, WORKER),
+        )
+
+    def _next_jobs(self):
+        """
+        Takes jobs for the free workers, one channel at a time
+        """
+        jobs = []
+        while self._running < self.workers and self._queues:
+            (channel, queue) = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                self._queues[channel] = queue
+            self._queued -= 1
+            if job.cancelled():
+                job.future.cancel()
+                continue
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            self._running += 1
+            jobs.append(job)
+        return jobs
+
+    def _start(self, jobs):
+        for job in jobs:
+            try:
+                inner = self._submit(job)
+            except Exception as e:
+                self._finish(job, None, e)
+            else:
+                inner.add_done_callback(lambda inner, job=job: self._done(job, inner))
+
+    def _submit(self, job):
+        executor = self._executor
+        try:
+            return executor.submit(job.function, *job.args, **job.kwargs)
+        except BrokenExecutor:
+            # A worker died (e.g. out of memory), start over with new ones
+            with self._lock:
+                if self._executor is executor:
+                    executor.shutdown(wait=False)
+                    self._executor = self._new_executor()
+                executor = self._executor
+            return executor.submit(job.function, *job.args, **job.kwargs)
+
+    def _done(self, job, inner):
+        try:
+            result = inner.result()
+        except BaseException as e:
+            self._finish(job, None, e)
+        else:
+            self._finish(job, result, None)
+
+    def _finish(self, job, result, error):
+        if error is None and job.cancelled():
+            error = CancelledError()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+        with self._lock:
+            self._running -= 1
+            jobs = self._next_jobs()
+        self._start(jobs)
+
+    def _run_inline(self, job):
+        if job.cancelled() or not job.future.set_running_or_notify_cancel():
+            job.future.cancel()
+            return
+        try:
+            result = job.function(*job.args, **job.kwargs)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+
+
+if __name__ == WORKER:
+    _register_package(WORKER_PACKAGE, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,397 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+render: turns images into lines of IRC text art and IRC text into images.
+These run in worker processes, so they only take picklable arguments.
+"""
+
+import os
+import re
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+from .colors import rgbColors
+from .download import ImageTooLarge
+from .encoder import encode_halfblocks
+from .palette import color_table
+
+# Images are decoded and shrunk to this many times the render size
+SHRINK_MARGIN = 2
+FONT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DejaVu.ttf")
+# Size of a character cell in png, and the room around it for glyphs that
+# spill over into the next cells
+CELL_X = 10
+CELL_Y = 20
+GLYPH_PAD = 5
+# Cells drawn at once by png, bounds temporary arrays
+TEXT_CHUNK = 4096
+STRIP_COLORS = re.compile("(\x03([0-9]{1,2})(,[0-9]{1,2})?)|[\x0f\x02\x1f\x03\x16]")
+COLOR_CODES = re.compile("\x03(?:([0-9]{1,2})(?:,([0-9]{1,2}))?)?|[\x0f\x02\x1f\x16]")
+
+_fonts = {}
+_glyphs = {}
+
+
+def shrink(image, size, max_pixels=0):
+    """
+    Loads an opened image at the lowest resolution that is still at least
+    SHRINK_MARGIN times size: JPEGs are decoded at a reduced scale, then the
+    image is box filtered down by a whole factor. Raises ImageTooLarge if the
+    decoded image would have more than max_pixels pixels (0 means unlimited).
+    """
+    target = (max(size[0], 1) * SHRINK_MARGIN, max(size[1], 1) * SHRINK_MARGIN)
+    image.draft("RGB", target)
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+        raise ImageTooLarge("image is over {0} pixels".format(max_pixels))
+    factor = min(image.size[0] // target[0], image.size[1] // target[1])
+    if factor > 1:
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGB")
+        image = image.reduce(factor)
+    return image
+
+
+def render_img(
+    image,
+    type,
+    cols,
+    gscale,
+    colors,
+    speed,
+    quantize=False,
+    bg=99,
+    fg=99,
+    saturation=None,
+    resize=3,
+    tops=False,
+    chars=False,
+    bits=8,
+    directory=None,
+    max_pixels=0,
+):
+    """
+    Renders a PIL image for img as a list of IRC lines, cols characters wide.
+    type is "1/2", "ascii" or "no-color" and gscale the characters to draw
+    with. Returns (lines, number of distinct source colors).
+    """
+    source_colors = 0
+    # store dimensions
+    W, H = image.size[0], image.size[1]
+    # compute width of tile
+    w = W / cols
+    # compute tile height based on aspect ratio and scale
+    if type == "1/2":
+        scale = 1.0
+    else:
+        scale = 0.5
+    h = w / scale
+    # compute number of rows
+    rows = int(H / h)
+    image = shrink(image, (cols, rows), max_pixels)
+    if image.mode == "RGBA":
+        if bg == 99:
+            newbg = 1
+        else:
+            newbg = bg
+        image = Image.alpha_composite(
+            Image.new("RGBA", image.size, rgbColors[newbg] + (255,)), image
+        )
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if type != "no-color":
+        image2 = image.resize((cols, rows), resize)
+        if saturation is not None:
+            image2 = ImageEnhance.Color(image2).enhance(saturation)
+        if quantize:
+            image2 = image2.quantize(dither=None)
+            image2 = image2.convert("RGB")
+        table = color_table(colors, speed, bits, directory)
+        (codes, source_colors) = table.lookup(np.array(image2))
+        codes = codes.tolist()
+    # ascii image is a list of character strings
+    aimg = []
+    if type == "1/2":
+        aimg = encode_halfblocks(codes, tops)
+    else:
+        if not chars and gscale != "\xa0":
+            image = image.resize((cols, rows), resize)
+            image = image.convert("L")
+            lumamap = np.array(image)
+        # generate list of dimensions
+        char = 0
+        for j in range(rows):
+            # append an empty string
+            aimg.append("")
+            old_color = None
+            for i in range(cols):
+                if not chars and gscale != "\xa0":
+                    # get average luminance
+                    avg = int(np.average(lumamap[j][i]))
+                    # look up ascii char
+                    gsval = gscale[int((avg * (len(gscale) - 1)) / 255)]
+                elif chars and gscale != "\xa0":
+                    if char < len(gscale):
+                        gsval = gscale[char]
+                        char += 1
+                    else:
+                        char = 0
+                        gsval = gscale[char]
+                        char += 1
+                else:
+                    gsval = "\xa0"
+                # get color value
+                if type != "no-color" and gscale != "\xa0" and i == 0:
+                    color = codes[j][i]
+                    old_color = color
+                    if bg != 99:
+                        color = "{0},{1}".format(color, "{:02d}".format(int(bg)))
+                    if gsval != "\xa0":
+                        aimg[j] += "\x03{0}{1}".format(color, gsval)
+                    else:
+                        aimg[j] += "\x030,{0} ".format(int(color))
+                elif type == "no-color" and i == 0:
+                    if bg != 99 and fg != 99:
+                        aimg[j] += "\x03{0},{1}{2}".format(
+                            "{:02d}".format(int(fg)),
+                            "{:02d}".format(int(bg)),
+                            gsval,
+                        )
+                    elif fg != 99:
+                        aimg[j] += "\x03{0}{1}".format("{:02d}".format(int(fg)), gsval)
+                    elif bg != 99:
+                        aimg[j] += "\x03{0},{1}{2}".format(
+                            "{:02d}".format(int(fg)),
+                            "{:02d}".format(int(bg)),
+                            gsval,
+                        )
+                elif type != "no-color" and gsval != " ":
+                    color = codes[j][i]
+                    if color != old_color:
+                        old_color = color
+                        # append ascii char to string
+                        if gsval != "\xa0":
+                            if gsval.isdigit():
+                                color = "{:02d}".format(int(color))
+                                aimg[j] += "\x03{0}{1}".format(color, gsval)
+                            else:
+                                aimg[j] += "\x03{0}{1}".format(int(color), gsval)
+                        else:
+                            aimg[j] += "\x030,{0} ".format(int(color))
+                    else:
+                        aimg[j] += "{0}".format(gsval)
+                else:
+                    aimg[j] += "{0}".format(gsval)
+    return (aimg, source_colors)
+
+
+def render_data(data, **options):
+    """
+    Same as render_img, for the bytes of an image file
+    """
+    return render_img(Image.open(BytesIO(data)), **options)
+
+
+def load_font(size):
+    """
+    Returns the DejaVu font at size, loaded once per size and process
+    """
+    font = _fonts.get(size)
+    if font is None:
+        font = _fonts[size] = ImageFont.truetype(FONT_FILE, size)
+    return font
+
+
+def glyph(char, size):
+    """
+    Coverage mask of char as drawn in a cell at size, with GLYPH_PAD pixels of
+    room on every side for the parts that spill out of the cell.
+    """
+    key = (char, size)
+    mask = _glyphs.get(key)
+    if mask is None:
+        image = Image.new("L", (CELL_X + 2 * GLYPH_PAD, CELL_Y + 2 * GLYPH_PAD))
+        ImageDraw.Draw(image).text(
+            (GLYPH_PAD, GLYPH_PAD), char, font=load_font(size), fill=255
+        )
+        mask = _glyphs[key] = np.array(image)
+    return mask
+
+
+def parse_colors(line, defaultFg, defaultBg):
+    """
+    Splits a line of IRC formatted text into its printed characters and the
+    fg and bg color of each of them (lists as long as the characters).
+    """
+    (chars, fgs, bgs) = ([], [], [])
+    (fg, bg, pos) = (defaultFg, defaultBg, 0)
+    for match in COLOR_CODES.finditer(line):
+        if match.start() > pos:
+            run = line[pos : match.start()]
+            chars.append(run)
+            fgs.extend([fg] * len(run))
+            bgs.extend([bg] * len(run))
+        pos = match.end()
+        if match.group(0)[0] == "\x03" and match.group(1) is not None:
+            fg = int(match.group(1))
+            if match.group(2) is not None:
+                bg = int(match.group(2))
+        elif match.group(0)[0] in "\x03\x0f":
+            (fg, bg) = (defaultFg, defaultBg)
+    run = line[pos:]
+    chars.append(run)
+    fgs.extend([fg] * len(run))
+    bgs.extend([bg] * len(run))
+    return ("".join(chars), fgs, bgs)
+
+
+def render_text(text, size=18, defaultBg=1, defaultFg=0):
+    """
+    Draws IRC formatted text as a PIL image, for png. The text is parsed into
+    arrays of cell colors and characters; glyphs are rasterized once per size
+    and blended in by cell, so the work grows with the number of cells.
+    """
+    text = text.replace("\t", " ")
+    lineLens = [len(line) for line in STRIP_COLORS.sub("", text).splitlines()]
+    maxWidth, height = max(lineLens), len(lineLens)
+    imageX, imageY = maxWidth * CELL_X, height * CELL_Y
+    palette = np.array(rgbColors, dtype=np.uint16)
+    # 99 is the default color
+    defaultBg = defaultBg if defaultBg < len(palette) else 1
+    defaultFg = defaultFg if defaultFg < len(palette) else 0
+    chars = np.zeros((height, maxWidth), dtype=np.uint32)
+    fg = np.full((height, maxWidth), defaultFg, dtype=np.intp)
+    bg = np.full((height, maxWidth), defaultBg, dtype=np.intp)
+    for j, line in enumerate(text.split("\n")[:height]):
+        (line, fgs, bgs) = parse_colors(line, defaultFg, defaultBg)
+        n = min(len(line), maxWidth)
+        chars[j, :n] = np.frombuffer(line[:n].encode("utf-32-le"), dtype=np.uint32)
+        fg[j, :n] = fgs[:n]
+        bg[j, :n] = bgs[:n]
+    fg[fg >= len(palette)] = defaultFg
+    bg[bg >= len(palette)] = defaultBg
+    visible = (chars != 0) & (chars != 32) & (fg != bg)
+    (codes, inverse) = np.unique(chars[visible], return_inverse=True)
+    # Mask 0 is empty, for the cells without a glyph
+    masks = np.zeros(
+        (len(codes) + 1, CELL_Y + 2 * GLYPH_PAD, CELL_X + 2 * GLYPH_PAD), dtype=np.uint8
+    )
+    for i, code in enumerate(codes):
+        masks[i + 1] = glyph(chr(code), size)
+    glyphs = np.zeros((height, maxWidth), dtype=np.intp)
+    glyphs[visible] = inverse.ravel() + 1
+    # Cells are drawn in row major order, rectangles only for the filled ones
+    order = np.arange(1, height * maxWidth + 1).reshape(height, maxWidth)
+    latest = np.zeros((height + 2, maxWidth + 2), dtype=np.intp)
+    latest[1:-1, 1:-1] = np.where(bg != defaultBg, order, 0)
+    # Background of the pixels by the drawing order of the last rectangle
+    fills = np.concatenate([palette[defaultBg][None], palette[bg].reshape(-1, 3)])
+    layers = []
+    for oy in (-1, 0, 1):
+        (ty, my) = band(oy, CELL_Y)
+        for ox in (-1, 0, 1):
+            (tx, mx) = band(ox, CELL_X)
+            parts = masks[:, my, mx].astype(np.uint16)
+            drawn = parts.reshape(len(parts), -1).any(axis=1)
+            if drawn.any():
+                source = (
+                    neighbours(glyphs, oy, ox),
+                    neighbours(palette[fg], oy, ox),
+                    neighbours(order, oy, ox),
+                )
+                layers.append((ty, tx, parts, drawn, source))
+    image = np.empty((imageY, imageX, 3), dtype=np.uint8)
+    step = max(1, TEXT_CHUNK // max(maxWidth, 1))
+    for start in range(0, height, step):
+        stop = min(start + step, height)
+        cover = covering(latest, start, stop)
+        cells = np.empty(cover.shape + (3,), dtype=np.uint16)
+        cells[...] = fills[cover[:, 1:2, :, 1:2]]
+        cells[:, :, :, :1] = fills[cover[:, :, :, :1]]
+        cells[:, :1] = fills[cover[:, :1]]
+        for ty, tx, parts, drawn, (source, inks, orders) in layers:
+            # Only the cells this part of a glyph is drawn over
+            (r, c) = np.nonzero(drawn[source[start:stop]])
+            alpha = parts[source[start + r, c]]
+            # Parts of glyphs drawn before the last rectangle over them
+            alpha[cover[r, ty, c, tx] > orders[start + r, c][:, None, None]] = 0
+            alpha = alpha[..., None]
+            view = cells[r, ty, c, tx]
+            tmp = view * (255 - alpha) + inks[start + r, c][:, None, None] * alpha + 128
+            cells[r, ty, c, tx] = ((tmp >> 8) + tmp) >> 8
+        image[start * CELL_Y : stop * CELL_Y] = cells.reshape(
+            ((stop - start) * CELL_Y, imageX, 3)
+        )
+    return Image.fromarray(image, "RGB")
+
+
+def band(offset, cell):
+    """
+    Returns the slices of a cell, and of a padded glyph mask, where the glyph
+    of the cell offset cells away (-1, 0 or 1) is drawn over it.
+    """
+    first = max(offset * cell - GLYPH_PAD, 0)
+    last = min(offset * cell + cell + GLYPH_PAD, cell)
+    shift = GLYPH_PAD - offset * cell
+    return (slice(first, last), slice(first + shift, last + shift))
+
+
+def neighbours(array, oy, ox):
+    """
+    Returns array shifted so that each cell holds the value of the cell oy
+    rows and ox columns away from it, 0 past the edges.
+    """
+    (rows, cols) = array.shape[:2]
+    result = np.zeros_like(array)
+    result[max(-oy, 0) : rows - max(oy, 0), max(-ox, 0) : cols - max(ox, 0)] = array[
+        max(oy, 0) : rows - max(-oy, 0), max(ox, 0) : cols - max(-ox, 0)
+    ]
+    return result
+
+
+def covering(latest, start, stop):
+    """
+    Drawing order of the last rectangle drawn over each pixel of the cell rows
+    from start to stop, 0 for none, as an array of rows × CELL_Y × cols ×
+    CELL_X. Rectangles are one pixel larger than their cell, they also cover
+    the first pixel row and column of the next cells.
+    """
+    own = latest[start + 1 : stop + 1, 1:-1]
+    (rows, cols) = own.shape
+    cover = np.empty((rows, CELL_Y, cols, CELL_X), dtype=np.int32)
+    cover[...] = own[:, None, :, None]
+    left = latest[start + 1 : stop + 1, :-2]
+    up = latest[start:stop, 1:-1]
+    corner = latest[start:stop, :-2]
+    cover[:, :, :, 0] = np.maximum(own, left)[:, None, :]
+    cover[:, 0, :, :] = np.maximum(own, up)[:, :, None]
+    cover[:, 0, :, 0] = np.maximum(np.maximum(own, left), np.maximum(up, corner))
+    return cover
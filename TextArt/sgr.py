@@ -0,0 +1,162 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+"""
+sgr: translates the ANSI escape sequences in program output (wttr.in,
+rate.sx) to IRC formatting codes in one pass over the text.
+"""
+
+import re
+from functools import lru_cache
+
+from .colors import ansi16, ansi83, ansi99, x16colors
+
+# Control sequences, with a doubled escape, and the reset "\x1b(B\x1b[m"
+SEQUENCES = re.compile("\x1b(?:\\(B\x1b\\[m|\x1b?\\[[0-?]*[ -/]*[@-~])")
+# A background only color, merged with the foreground that follows it
+BACKGROUND = re.compile("\x0399,([0-9]{2})")
+FOREGROUND = re.compile("\x03[0-9]{2}")
+
+
+def ansi2irc(output, colors):
+    """
+    Translates the ANSI escape sequences in output to IRC codes for a palette
+    of 16, 83 or 99 colors. Codes that repeat the previous ones are left out,
+    so is a reset right before a color.
+    """
+    pieces = []
+    (last, pos, adjacent) = (None, 0, False)
+    for match in SEQUENCES.finditer(output):
+        if match.start() > pos:
+            pieces.append(output[pos : match.start()])
+            adjacent = False
+        pos = match.end()
+        sequence = match.group(0)
+        if sequence[1] == "(":
+            sequence = "\x1b[0m"
+        code = sgr2irc(sequence, colors)
+        if code == last:
+            continue
+        last = code
+        if not code:
+            continue
+        if adjacent and code[0] == "\x03":
+            previous = pieces[-1]
+            background = BACKGROUND.fullmatch(previous)
+            if background and FOREGROUND.match(code):
+                code = "{0},{1}{2}".format(code[:3], background.group(1), code[3:])
+                pieces.pop()
+            elif previous[-1] == "\x0f":
+                pieces[-1] = previous[:-1]
+                if not pieces[-1]:
+                    pieces.pop()
+        pieces.append(code)
+        adjacent = True
+    pieces.append(output[pos:])
+    return "".join(pieces)
+
+
+@lru_cache(maxsize=4096)
+def sgr2irc(sequence, colors):
+    """
+    IRC codes for one ANSI escape sequence: colors and effects of SGR
+    sequences, spaces for cursor forward, nothing for the others.
+    """
+    if colors == 16:
+        table = ansi16
+    elif colors == 99:
+        table = ansi99
+    else:
+        table = ansi83
+    x16color1 = None
+    x16color2 = None
+    x256color1 = None
+    x256color2 = None
+    effect = None
+    ansi = sequence.lower().strip("\x1b[").strip("m").split(";")
+    try:
+        if len(ansi) > 1:
+            i = 0
+            while i < len(ansi):
+                value = int(ansi[i]) if ansi[i].isdigit() else -1
+                if ansi[i] in ("0", "1", "2", "4"):
+                    effect = value
+                elif 29 < value < 38 or 39 < value < 48:
+                    if effect == 1 or ansi[-1] == "1":
+                        color = x16colors["{0};1".format(ansi[i])]
+                        effect = None
+                    else:
+                        color = x16colors[ansi[i]]
+                    if value < 38:
+                        x16color1 = color
+                    else:
+                        x16color2 = color
+                elif ansi[i] == "38":
+                    x256color1 = table[int(ansi[i + 2])]
+                    i += 2
+                elif ansi[i] == "48":
+                    x256color2 = table[int(ansi[i + 2])]
+                    i += 2
+                i += 1
+            if x16color1 and x16color2:
+                color = "\x03{0},{1}".format(x16color1, x16color2)
+            elif x256color1 and x256color2:
+                color = "\x03{0},{1}".format(x256color1, x256color2)
+            elif x16color1:
+                color = "\x03{0}".format(x16color1)
+            elif x16color2:
+                color = "\x0399,{0}".format(x16color2)
+            elif x256color1:
+                color = "\x03{0}".format(x256color1)
+            elif x256color2:
+                color = "\x0399,{0}".format(x256color2)
+            else:
+                color = ""
+            if effect == 1:
+                color += "\x02"
+            if effect == 4:
+                color += "\x1F"
+        elif ansi[0] == "0":
+            color = "\x0F"
+        elif ansi[0] == "1" or ansi[0] == "2":
+            color = "\x02"
+        elif ansi[0] == "4":
+            color = "\x1F"
+        elif ansi[0].isdigit() and 29 < int(ansi[0]) < 38:
+            color = "\x03{0}".format(x16colors[ansi[0]])
+        elif ansi[0].isdigit() and 39 < int(ansi[0]) < 48:
+            color = "\x0399,{0}".format(x16colors[ansi[0]])
+        elif ansi[0][-1:] == "c" and ansi[0][:-1].isdigit():
+            color = " " * int(ansi[0][:-1])
+        else:
+            color = ""
+    except (IndexError, KeyError, ValueError):
+        color = ""
+    return color
@@ -0,0 +1,494 @@
+###
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import itertools
+import math
+import os
+import shutil
+import tempfile
+from concurrent.futures import CancelledError, Future
+
+import numpy as np
+from PIL import Image, ImageDraw
+from requests.structures import CaseInsensitiveDict
+
+# Through the modules: loading the plugin reloads them
+from . import cache, colors, download, encoder, palette, pool, render, sgr
+
+
+class EncoderTestCase(SupyTestCase):
+    # Rows of color codes, and the lines they encode to without and with tops.
+    # These match what img --1/2 sent before the encoder was split out.
+    golden = [
+        (
+            [[1, 1, 4, 4, 2, 2], [1, 4, 4, 2, 2, 3]],
+            ["\x034,1 ▄█\x034,2▀ \x033▄"],
+            ["\x031,1 \x031,4▀ \x034,2▀ \x032,3▀"],
+        ),
+        (
+            [
+                [0, 0, 0, 5, 5, 12],
+                [0, 3, 3, 5, 12, 12],
+                [7, 7, 1, 1, 1, 9],
+                [7, 1, 1, 9, 9, 9],
+            ],
+            ["\x033,0 ▄▄\x0312,5 ▄█", "\x031,7 ▄█\x031,9▀▀ "],
+            ["\x031,0 \x030,3▀▀\x031,5 \x035,12▀ ", "\x031,7 \x037,1▀ \x031,9▀▀ "],
+        ),
+        ([[4, 4, 4, 4], [4, 4, 4, 4]], ["\x031,4    "], ["\x031,4    "]),
+        (
+            [[1, 2, 1, 2, 3, 3, 5], [2, 1, 2, 1, 3, 5, 5]],
+            ["\x032,1▄▀▄▀\x035,3 ▄█"],
+            ["\x031,2▀\x032,1▀\x031,2▀\x032,1▀\x031,3 \x033,5▀ "],
+        ),
+    ]
+
+    def testHalfblocks(self):
+        for (codes, lines, tops) in self.golden:
+            self.assertEqual(encoder.encode_halfblocks(codes), lines)
+            self.assertEqual(encoder.encode_halfblocks(codes, tops=True), tops)
+
+    def testOddRows(self):
+        # The last row of an odd number of rows is dropped
+        self.assertEqual(
+            encoder.encode_halfblocks([[1, 1], [2, 2], [3, 3]]),
+            encoder.encode_halfblocks([[1, 1], [2, 2]]),
+        )
+
+
+def draw_text(text, size=18, defaultBg=1, defaultFg=0):
+    """
+    Draws IRC formatted text one character at a time, the way png did
+    before render_text
+    """
+    font = render.load_font(size)
+    lines = render.STRIP_COLORS.sub("", text).splitlines()
+    (width, height) = (render.CELL_X, render.CELL_Y)
+    image = Image.new(
+        "RGB",
+        (max(map(len, lines)) * width, len(lines) * height),
+        colors.rgbColors[defaultBg],
+    )
+    draw = ImageDraw.Draw(image)
+    for (y, line) in enumerate(text.split("\n")):
+        (line, fgs, bgs) = render.parse_colors(line, defaultFg, defaultBg)
+        for (x, (char, fg, bg)) in enumerate(zip(line, fgs, bgs)):
+            box = (x * width, y * height, (x + 1) * width, (y + 1) * height)
+            if bg != defaultBg:
+                draw.rectangle(box, fill=colors.rgbColors[bg])
+            if bg != fg:
+                draw.text(box[:2], char, font=font, fill=colors.rgbColors[fg])
+    return image
+
+
+class RenderTextTestCase(SupyTestCase):
+    text = (
+        "Hello, \x034World\x03!\n"
+        "\x030,2 W@g \x038,4|Qy_\x0f ok\n"
+        "\x031,1hidden\x03 ▀▄█ \x039,5 j\x0f\t."
+    )
+
+    def testGolden(self):
+        image = render.render_text(self.text, 18)
+        self.assertEqual(image.size, (15 * render.CELL_X, 3 * render.CELL_Y))
+        expected = draw_text(self.text.replace("\t", " "), 18)
+        self.assertTrue(np.array_equal(np.array(image), np.array(expected)))
+
+
+def scalar_rgb2lab(color):
+    """
+    RGB to Lab one color at a time, as the plugin converted pixels before
+    palette matching was vectorized
+    """
+    rgb = []
+    for value in color:
+        value = float(value) / 255
+        if value > 0.04045:
+            value = ((value + 0.055) / 1.055) ** 2.4
+        else:
+            value = value / 12.92
+        rgb.append(value * 100)
+    xyz = [
+        round(rgb[0] * 0.4124 + rgb[1] * 0.3576 + rgb[2] * 0.1805, 4) / 95.047,
+        round(rgb[0] * 0.2126 + rgb[1] * 0.7152 + rgb[2] * 0.0722, 4) / 100.0,
+        round(rgb[0] * 0.0193 + rgb[1] * 0.1192 + rgb[2] * 0.9505, 4) / 108.883,
+    ]
+    xyz = [
+        value ** (0.3333333333333333) if value > 0.008856 else 7.787 * value + 16 / 116
+        for value in xyz
+    ]
+    return [
+        round(116 * xyz[1] - 16, 4),
+        round(500 * (xyz[0] - xyz[1]), 4),
+        round(200 * (xyz[1] - xyz[2]), 4),
+    ]
+
+
+def scalar_ciede2000(lab1, lab2):
+    """
+    CIEDE2000 of two colors, as the plugin computed it before palette
+    matching was vectorized
+    """
+    dl = lab2[0] - lab1[0]
+    hl = lab1[0] + dl * 0.5
+    sqb1 = lab1[2] * lab1[2]
+    sqb2 = lab2[2] * lab2[2]
+    c1 = math.sqrt(lab1[1] * lab1[1] + sqb1)
+    c2 = math.sqrt(lab2[1] * lab2[1] + sqb2)
+    hc7 = math.pow((c1 + c2) * 0.5, 7)
+    trc = math.sqrt(hc7 / (hc7 + 6103515625))
+    t2 = 1.5 - trc * 0.5
+    ap1 = lab1[1] * t2
+    ap2 = lab2[1] * t2
+    c1 = math.sqrt(ap1 * ap1 + sqb1)
+    c2 = math.sqrt(ap2 * ap2 + sqb2)
+    dc = c2 - c1
+    hc = c1 + dc * 0.5
+    hc7 = math.pow(hc, 7)
+    trc = math.sqrt(hc7 / (hc7 + 6103515625))
+    h1 = math.atan2(lab1[2], ap1)
+    if h1 < 0:
+        h1 = h1 + math.pi * 2
+    h2 = math.atan2(lab2[2], ap2)
+    if h2 < 0:
+        h2 = h2 + math.pi * 2
+    hdiff = h2 - h1
+    hh = h1 + h2
+    if abs(hdiff) > math.pi:
+        hh = hh + math.pi * 2
+        if h2 <= h1:
+            hdiff = hdiff + math.pi * 2
+        else:
+            hdiff = hdiff - math.pi * 2
+    hh = hh * 0.5
+    t2 = 1 - 0.17 * math.cos(hh - math.pi / 6) + 0.24 * math.cos(hh * 2)
+    t2 = t2 + 0.32 * math.cos(hh * 3 + math.pi / 30)
+    t2 = t2 - 0.2 * math.cos(hh * 4 - math.pi * 63 / 180)
+    dh = 2 * math.sqrt(c1 * c2) * math.sin(hdiff * 0.5)
+    sqhl = (hl - 50) * (hl - 50)
+    fl = dl / (1 + (0.015 * sqhl / math.sqrt(20 + sqhl)))
+    fc = dc / (hc * 0.045 + 1)
+    fh = dh / (t2 * hc * 0.015 + 1)
+    dt = 30 * math.exp(-math.pow(36 * hh - 55 * math.pi, 2) / (25 * math.pi * math.pi))
+    r = -2 * trc * math.sin(2 * dt * math.pi / 180)
+    de = math.sqrt(fl * fl + fc * fc + fh * fh + r * fc * fh)
+    return 1.43 * de**0.70
+
+
+class PaletteTestCase(SupyTestCase):
+    # A grid through the RGB cube, off the palette colors' usual values
+    steps = (0, 37, 90, 128, 161, 215, 255)
+    pixels = np.array(list(itertools.product(steps, repeat=3)), dtype=np.uint8)
+
+    def scalarMatch(self, colors, speed):
+        "IRC code of each pixel, found the way the plugin used to"
+        palette_colors = palette.PALETTES[colors]
+        result = []
+        for pixel in self.pixels.tolist():
+            lab = scalar_rgb2lab(pixel)
+            if speed == "fast":
+                distance = lambda color: math.sqrt(
+                    sum((color[i] - lab[i]) ** 2 for i in range(3))
+                )
+            else:
+                distance = lambda color: scalar_ciede2000(color, lab)
+            result.append(palette_colors[sorted(palette_colors, key=distance)[0]])
+        return result
+
+    def testRgb2Lab(self):
+        labs = palette.rgb2lab(self.pixels)
+        for (pixel, lab) in zip(self.pixels.tolist(), labs.tolist()):
+            self.assertEqual(lab, scalar_rgb2lab(pixel), pixel)
+
+    def testNearest(self):
+        for colors in (16, 83, 99):
+            (labs, codes) = palette.palette_arrays(colors)
+            for speed in ("fast", "slow"):
+                indexes = palette.nearest(palette.rgb2lab(self.pixels), labs, speed)
+                self.assertEqual(
+                    codes[indexes].tolist(),
+                    self.scalarMatch(colors, speed),
+                    (colors, speed),
+                )
+
+
+class ColorTableTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.filename = os.path.join(self.directory, "colors.npy")
+        self.pixels = np.array([[[255, 0, 0], [0, 0, 255], [250, 250, 250]]])
+        self.codes = palette.ColorTable(16, "fast", bits=4).lookup(self.pixels)[0]
+
+    def testCreate(self):
+        table = palette.ColorTable(16, "fast", bits=4, filename=self.filename)
+        self.assertEqual(os.listdir(self.directory), ["colors.npy"])
+        self.assertFalse(table.cube.any())
+        (codes, count) = table.lookup(self.pixels)
+        self.assertEqual((codes.tolist(), count), (self.codes.tolist(), 3))
+        table.flush()
+        # Filled cells are kept for the next start
+        cube = np.load(self.filename)
+        self.assertEqual(cube.shape, (1 << 12,))
+        self.assertEqual(np.count_nonzero(cube), 3)
+        table = palette.ColorTable(16, "fast", bits=4, filename=self.filename)
+        self.assertEqual(np.count_nonzero(table.cube), 3)
+
+    def testReplaceBroken(self):
+        # A table of another size, and a file that isn't a table at all
+        palette.ColorTable(16, "fast", bits=3, filename=self.filename)
+        table = palette.ColorTable(16, "fast", bits=4, filename=self.filename)
+        self.assertEqual(table.cube.shape, (1 << 12,))
+        with open(self.filename, "wb") as f:
+            f.write(b"\x93NUMPY")
+        table = palette.ColorTable(16, "fast", bits=4, filename=self.filename)
+        self.assertEqual(table.lookup(self.pixels)[0].tolist(), self.codes.tolist())
+        self.assertEqual(os.listdir(self.directory), ["colors.npy"])
+
+
+class AnsiTestCase(SupyTestCase):
+    def testColors16(self):
+        self.assertEqual(sgr.ansi2irc("\x1b[31mred\x1b[0m", 16), "\x0305red\x0f")
+        # Bright colors, and a background merged with the foreground after it
+        self.assertEqual(sgr.ansi2irc("\x1b[1;31mred", 16), "\x0304red")
+        self.assertEqual(sgr.ansi2irc("\x1b[44m\x1b[37mx", 16), "\x0315,02x")
+        self.assertEqual(sgr.ansi2irc("\x1b[31ma\x1b[31mb", 16), "\x0305ab")
+
+    def testColors256(self):
+        self.assertEqual(sgr.ansi2irc("\x1b[38;5;196mx", 83), "\x0352x")
+        self.assertEqual(sgr.ansi2irc("\x1b[38;5;196mx", 16), "\x0304x")
+        self.assertEqual(sgr.ansi2irc("\x1b[38;5;196;48;5;21mx", 99), "\x0304,60x")
+
+    def testReset(self):
+        self.assertEqual(sgr.ansi2irc("\x1b[32mx\x1b(B\x1b[m", 16), "\x0303x\x0f")
+        # A reset right before a color is left out
+        self.assertEqual(sgr.ansi2irc("a\x1b[0m\x1b[32mb", 16), "a\x0303b")
+
+    def testEffects(self):
+        output = "\x1b[1mbold\x1b[0m \x1b[4munder\x1b[0m"
+        self.assertEqual(sgr.ansi2irc(output, 16), "\x02bold\x0f \x1funder\x0f")
+
+    def testUnknown(self):
+        self.assertEqual(sgr.ansi2irc("\x1b[2J\x1b[?25lhi\x1b[K", 16), "hi")
+        self.assertEqual(sgr.ansi2irc("a\x1b[3Cb", 16), "a   b")
+
+
+class StreamedResponse:
+    """
+    Stands in for a streamed response with chunks of chunk_size bytes,
+    counting how many were read and whether it was closed.
+    """
+
+    def __init__(self, count, chunk_size, length=None):
+        self.chunk = b"x" * chunk_size
+        self.count = count
+        self.headers = CaseInsensitiveDict()
+        if length is not None:
+            self.headers["Content-Length"] = str(length)
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for _ in range(self.count):
+            self.read += 1
+            yield self.chunk
+
+    def close(self):
+        self.closed = True
+
+
+class DownloadTestCase(SupyTestCase):
+    def testRead(self):
+        response = StreamedResponse(4, 100, length=400)
+        self.assertEqual(download.read_capped(response, 400), b"x" * 400)
+        self.assertEqual(response.read, 4)
+        # No limit
+        response = StreamedResponse(4, 100)
+        self.assertEqual(len(download.read_capped(response, 0)), 400)
+
+    def testContentLength(self):
+        response = StreamedResponse(100, 100, length=10000)
+        with self.assertRaises(download.ImageTooLarge):
+            download.read_capped(response, 1000)
+        self.assertEqual(response.read, 0)
+        self.assertTrue(response.closed)
+
+    def testStreamed(self):
+        # No length, or a wrong one: stops at the first chunk over the limit
+        for length in (None, 500):
+            response = StreamedResponse(100, 100, length=length)
+            with self.assertRaises(download.ImageTooLarge):
+                download.read_capped(response, 1000)
+            self.assertEqual(response.read, 11)
+            self.assertTrue(response.closed)
+
+
+class RenderCacheTestCase(SupyTestCase):
+    lines = ["\x031,2" + "▄" * 40]
+    size = cache.render_size(lines)
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def key(self, name):
+        return cache.render_key(cache.image_digest(name.encode()), {"w": 80})
+
+    def testKey(self):
+        self.assertEqual(
+            cache.render_key("abc", {"w": 80, "mode": "1/2"}),
+            cache.render_key("abc", {"mode": "1/2", "w": 80}),
+        )
+        self.assertNotEqual(
+            cache.render_key("abc", {"w": 80}), cache.render_key("abc", {"w": 40})
+        )
+
+    def testEviction(self):
+        renders = cache.RenderCache(2 * self.size + self.size // 2)
+        (one, two, three) = (self.key("one"), self.key("two"), self.key("three"))
+        renders.put(one, self.lines, [1])
+        renders.put(two, self.lines, [2])
+        self.assertEqual(renders.get(one), (self.lines, [1]))
+        # two is now the least recently used
+        renders.put(three, self.lines, [3])
+        self.assertIsNone(renders.get(two))
+        self.assertEqual(renders.get(one), (self.lines, [1]))
+        self.assertEqual(renders.get(three), (self.lines, [3]))
+        self.assertEqual(renders.stats()["bytes"], 2 * self.size)
+        # Smaller than an entry: nothing is kept
+        renders.resize(self.size - 1, 0)
+        self.assertEqual(renders.stats()["entries"], 0)
+        renders.put(two, self.lines, [2])
+        self.assertIsNone(renders.get(two))
+
+    def testReload(self):
+        renders = cache.RenderCache(directory=self.directory)
+        renders.put(self.key("one"), self.lines, [1, 2])
+        # After a restart
+        renders = cache.RenderCache(directory=self.directory)
+        self.assertEqual(renders.get(self.key("one")), (self.lines, [1, 2]))
+        self.assertIsNone(renders.get(self.key("two")))
+        self.assertEqual(renders.stats()["disk_hits"], 1)
+        self.assertEqual(renders.stats()["misses"], 1)
+
+    def testPrune(self):
+        renders = cache.RenderCache(directory=self.directory)
+        renders.put(self.key("one"), self.lines, [1])
+        file_size = renders.stats()["disk_bytes"]
+        renders.resize(renders.max_bytes, 2 * file_size)
+        renders.put(self.key("two"), self.lines, [1])
+        renders.put(self.key("three"), self.lines, [1])
+        self.assertEqual(renders.stats()["disk_bytes"], 2 * file_size)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        # The oldest file went, and files are pruned oldest first when read
+        # again too
+        for (age, name) in enumerate(("three", "two")):
+            path = os.path.join(self.directory, renders._filename(self.key(name)))
+            os.utime(path, (1000 - age, 1000 - age))
+        renders = cache.RenderCache(directory=self.directory, max_disk_bytes=file_size)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertIsNone(renders.get(self.key("one")))
+        self.assertIsNone(renders.get(self.key("two")))
+        self.assertIsNotNone(renders.get(self.key("three")))
+
+    def testCorruptFile(self):
+        renders = cache.RenderCache(directory=self.directory)
+        renders.put(self.key("one"), self.lines, [1])
+        (name,) = os.listdir(self.directory)
+        with open(os.path.join(self.directory, name), "w") as f:
+            f.write('{"key": ')
+        renders = cache.RenderCache(directory=self.directory)
+        self.assertIsNone(renders.get(self.key("one")))
+        self.assertEqual(renders.stats()["misses"], 1)
+
+
+class RenderPoolTestCase(SupyTestCase):
+    def testWorkers(self):
+        workers = pool.RenderPool(workers=1)
+        self.addCleanup(workers.shutdown)
+        codes = [[1, 1, 4], [1, 4, 4]]
+        future = workers.submit(
+            "#test", lambda: False, encoder.encode_halfblocks, codes
+        )
+        self.assertEqual(future.result(60), encoder.encode_halfblocks(codes))
+        future = workers.submit("#test", lambda: False, render.render_text, "hi")
+        image = future.result(60)
+        self.assertEqual(image.tobytes(), render.render_text("hi").tobytes())
+
+    def testCancelled(self):
+        workers = pool.RenderPool(workers=0)
+        future = workers.submit("#test", lambda: True, len, "abc")
+        self.assertRaises(CancelledError, future.result)
+        self.assertEqual(workers.submit("#test", lambda: False, len, "abc").result(), 3)
+
+
+class RecordingPool:
+    """
+    Finishes every job at once, keeping what tells if it was stopped
+    """
+
+    def __init__(self):
+        self.cancelled = []
+
+    def submit(self, channel, cancelled, function, *args, **kwargs):
+        self.cancelled.append(cancelled)
+        future = Future()
+        future.set_result(function(*args, **kwargs))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+class TextArtTestCase(ChannelPluginTestCase):
+    plugins = ("TextArt",)
+
+    def testStop(self):
+        cb = self.irc.getCallback("TextArt")
+        (cb.render_pool, workers) = (RecordingPool(), cb.render_pool)
+        self.addCleanup(workers.shutdown)
+        self.assertEqual(cb.render(None, self.channel, len, "abc"), 3)
+        (first,) = cb.render_pool.cancelled
+        self.assertFalse(first())
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, "!cq", prefix=self.prefix))
+        self.assertTrue(first())
+        # A render asked for after cq doesn't resume the earlier one
+        cb.render(None, self.channel, len, "abc")
+        self.assertTrue(first())
+        self.assertFalse(cb.render_pool.cancelled[1]())
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -56,9 +56,18 @@ __contributors__ = {}
 __url__ = "https://github.com/oddluck/limnoria-plugins/"
 
 from . import config
+from . import dictionary
+from . import pool
+from . import solver
+from . import trie
 from . import plugin
 
-importlib.reload(plugin)  # In case we're being reloaded.
+# In case we're being reloaded.
+importlib.reload(trie)
+importlib.reload(dictionary)
+importlib.reload(pool)
+importlib.reload(solver)
+importlib.reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
 
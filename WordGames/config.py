@@ -63,6 +63,17 @@ conf.registerGlobalValue(
     ),
 )
 
+conf.registerGlobalValue(
+    WordGames,
+    "dictionaryCache",
+    registry.Boolean(
+        True,
+        "Keep the word index built from the dictionary file in the data "
+        + "directory, so it is only built again when the file or wordRegexp "
+        + "changes.",
+    ),
+)
+
 conf.registerGlobalValue(
     WordGames,
     "boggleDelay",
@@ -87,4 +98,54 @@ conf.registerGlobalValue(
     registry.String("easy", "Default difficulty for Boggle games."),
 )
 
+conf.registerGlobalValue(
+    WordGames,
+    "boggleSize",
+    registry.PositiveInteger(
+        4, "Number of rows and columns of a Boggle board (3 to 12)."
+    ),
+)
+
+conf.registerGlobalValue(
+    WordGames,
+    "boggleAttempts",
+    registry.PositiveInteger(
+        5,
+        "Number of random boards generated for a Boggle game, the one with the "
+        + "most words is played.",
+    ),
+)
+
+conf.registerGlobalValue(
+    WordGames,
+    "boggleWorkers",
+    registry.NonNegativeInteger(
+        0,
+        "Number of processes that solve the candidate Boggle boards in "
+        + "parallel (0 or 1 to solve them in the bot's process). They need "
+        + "dictionaryCache and are started when the plugin is loaded.",
+    ),
+)
+
+conf.registerGlobalValue(
+    WordGames,
+    "puzzlePoolSize",
+    registry.NonNegativeInteger(
+        5,
+        "Number of puzzles generated ahead of time for each game and "
+        + "difficulty, so games start right away. They are kept in the data "
+        + "directory. 0 disables the pool.",
+    ),
+)
+
+conf.registerGlobalValue(
+    WordGames,
+    "puzzlePoolLowWater",
+    registry.NonNegativeInteger(
+        2,
+        "The puzzles of a game and difficulty are generated again in the "
+        + "background when no more than this many are left.",
+    ),
+)
+
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,164 @@
+###
+# Copyright (c) 2012, Mike Mueller
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+The words of the dictionary file, loaded once and shared by all games until
+the file changes, with the word maps of the word chain games.
+"""
+
+import hashlib
+import os
+import re
+import threading
+
+from .trie import load_dawg
+
+
+def shrink_map(words):
+    """
+    Map each word (and its sorted letters) to the words made by dropping one
+    of its letters and rearranging the rest.
+    """
+    keymap = {}
+    for word in words:
+        s = "".join(sorted(word))
+        if s in keymap:
+            keymap[s].append(word)
+        else:
+            keymap[s] = [word]
+    word_map = {}
+    for word1 in words:
+        s = "".join(sorted(word1))
+        if s in word_map:
+            word_map[word1] = word_map[s]
+        else:
+            word_map[s] = word_map[word1] = []
+            keys = set()
+            for i in range(0, len(s)):
+                keys.add(s[0:i] + s[i + 1 :])
+            for key in keys:
+                for word2 in keymap.get(key, []):
+                    word_map[s].append(word2)
+    return word_map
+
+
+def twist_map(words):
+    "Map each word to the words made by changing one of its letters."
+    keymap = {}
+    wildcard = "*"
+    for word in words:
+        for pos in range(0, len(word)):
+            key = word[0:pos] + wildcard + word[pos + 1 :]
+            if key not in keymap:
+                keymap[key] = [word]
+            else:
+                keymap[key].append(word)
+    word_map = {}
+    for word in words:
+        word_map[word] = []
+        for pos in range(0, len(word)):
+            key = word[0:pos] + wildcard + word[pos + 1 :]
+            word_map[word] += [w for w in keymap.get(key, []) if w != word]
+    return word_map
+
+
+class Dictionary(object):
+    """
+    The words of a word file that match a pattern, in file order. Everything
+    derived from them is computed once and shared, so it must not be
+    modified. version tells apart the contents of the file over time.
+    """
+
+    def __init__(self, path, pattern, version=None):
+        regexp = re.compile(pattern)
+        with open(path) as wordFile:
+            self.words = list(filter(regexp.match, map(str.strip, wordFile)))
+        self.path = path
+        self.pattern = pattern
+        self.version = version
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, build, *args):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = build(*args)
+            return self._cache[key]
+
+    def filter(self, word_lengths=None):
+        "Return the words of the given lengths (default: 3 letters or more)."
+        lengths = tuple(word_lengths) if word_lengths else None
+        if lengths:
+            build = lambda: [w for w in self.words if len(w) in lengths]
+        else:
+            build = lambda: [w for w in self.words if len(w) >= 3]
+        return self._cached(("words", lengths), build)
+
+    def word_set(self, word_lengths=None):
+        "Return filter(word_lengths) as a set, for membership tests."
+        lengths = tuple(word_lengths) if word_lengths else None
+        return self._cached(("set", lengths), frozenset, self.filter(lengths))
+
+    def shrink_map(self, word_lengths=None):
+        "Return the WordShrink map of filter(word_lengths)."
+        lengths = tuple(word_lengths) if word_lengths else None
+        return self._cached(("shrink", lengths), shrink_map, self.filter(lengths))
+
+    def twist_map(self, word_lengths=None):
+        "Return the WordTwist map of filter(word_lengths)."
+        lengths = tuple(word_lengths) if word_lengths else None
+        return self._cached(("twist", lengths), twist_map, self.filter(lengths))
+
+    def wordtrie(self, directory=None):
+        "Return the word graph of all the words (see trie.load_dawg)."
+        return load_dawg(self.path, self.pattern, lambda: self.words, directory)
+
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def load_dictionary(path, pattern):
+    """
+    Return the Dictionary of the words in the word file at path that match
+    pattern, read again only when the file changes. Raises OSError if the
+    file can't be read and re.error if the pattern is invalid.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size, pattern)
+    with _dictionaries_lock:
+        dictionary = _dictionaries.get(key)
+        if dictionary is None:
+            version = hashlib.sha1(repr(key).encode()).hexdigest()
+            dictionary = Dictionary(path, pattern, version)
+            for old in [k for k in _dictionaries if k[0] == path and k[3] == pattern]:
+                del _dictionaries[old]
+            _dictionaries[key] = dictionary
+        return dictionary
@@ -29,6 +29,7 @@
 ###
 
 from operator import add, mul
+import itertools
 import random
 import re
 import time
@@ -44,7 +45,9 @@ import supybot.schedule as schedule
 import supybot.log as log
 import supybot.world as world
 
-from .trie import Trie
+from .dictionary import load_dictionary
+from .pool import PuzzlePool
+from .solver import BoardSolver, solve
 from functools import reduce
 
 DEBUG = False
@@ -156,11 +159,23 @@ class WordGames(callbacks.Plugin):
         self.parent = super(WordGames, self)
         self.parent.__init__(irc)
         self.games = {}
+        self.puzzles = PuzzlePool(
+            conf.supybot.directories.data.dirize("WordGames/puzzles.json"),
+            self.registryValue("puzzlePoolSize"),
+            self.registryValue("puzzlePoolLowWater"),
+        )
+        world.flushers.append(self.puzzles.flush)
+        self.solver = BoardSolver(self.registryValue("boggleWorkers"))
 
     def die(self):
         for channel, game in self.games.items():
             if game.is_running():
                 game.stop(now=True)
+        if self.puzzles.flush in world.flushers:
+            world.flushers.remove(self.puzzles.flush)
+        self.puzzles.stop()
+        self.puzzles.flush()
+        self.solver.shutdown()
         self.parent.die()
 
     def doPrivmsg(self, irc, msg):
@@ -205,7 +220,17 @@ class WordGames(callbacks.Plugin):
                     delay = self.registryValue("boggleDelay")
                     duration = self.registryValue("boggleDuration")
                     self._start_game(
-                        Boggle, irc, channel, msgs.nick, delay, duration, difficulty
+                        Boggle,
+                        irc,
+                        channel,
+                        msgs.nick,
+                        delay,
+                        duration,
+                        difficulty,
+                        self._get_wordtrie(),
+                        size=self.registryValue("boggleSize"),
+                        attempts=self.registryValue("boggleAttempts"),
+                        solver=self.solver,
                     )
             elif command == "stop":
                 # Alias for @wordquit
@@ -284,17 +309,27 @@ class WordGames(callbacks.Plugin):
                     break
         return my_game
 
-    def _get_words(self):
-        try:
-            regexp = re.compile(self.registryValue("wordRegexp"))
-        except Exception as e:
-            raise WordGamesError("Bad value for wordRegexp: %s" % str(e))
+    def _get_dictionary(self):
+        "Return the words of the word file, read again only when it changes."
         path = self.registryValue("wordFile")
         try:
-            wordFile = open(path)
-        except Exception as e:
+            return load_dictionary(path, self.registryValue("wordRegexp"))
+        except re.error as e:
+            raise WordGamesError("Bad value for wordRegexp: %s" % str(e))
+        except OSError:
             raise WordGamesError("Unable to open word file: %s" % path)
-        return list(filter(regexp.match, list(map(str.strip, wordFile.readlines()))))
+
+    def _get_wordtrie(self):
+        "Return the word graph of the word file, built once per file version."
+        directory = None
+        if self.registryValue("dictionaryCache"):
+            directory = conf.supybot.directories.data.dirize("WordGames")
+        try:
+            return self._get_dictionary().wordtrie(directory)
+        except OSError:
+            raise WordGamesError(
+                "Unable to open word file: %s" % self.registryValue("wordFile")
+            )
 
     def _start_game(self, Game, irc, channel, *args, **kwargs):
         try:
@@ -303,9 +338,19 @@ class WordGames(callbacks.Plugin):
                 irc.reply("A word game is already running here.")
                 game.show()
             else:
-                words = self._get_words()
-                self.games[channel] = Game(words, irc, channel, *args, **kwargs)
-                self.games[channel].start()
+                dictionary = self._get_dictionary()
+                game = Game(dictionary, irc, channel, *args, **kwargs)
+                self.games[channel] = game
+                # Take a puzzle generated beforehand, the pool makes more
+                generate = lambda: Game(
+                    dictionary, irc, channel, *args, **kwargs
+                ).make_puzzle()
+                kind = game.puzzle_kind()
+                if kind:
+                    puzzle = self.puzzles.take(kind, dictionary.version, generate)
+                    if puzzle:
+                        game.use_puzzle(puzzle)
+                game.start()
         except WordGamesError as e:
             # Get rid of the game in case it's in an indeterminate state
             if channel in self.games:
@@ -327,8 +372,9 @@ class WordGames(callbacks.Plugin):
 class BaseGame(object):
     "Base class for the games in this plugin."
 
-    def __init__(self, words, irc, channel):
-        self.words = words
+    def __init__(self, dictionary, irc, channel):
+        self.dictionary = dictionary
+        self.words = dictionary.words
         self.irc = irc
         self.channel = channel
         self.running = False
@@ -356,6 +402,21 @@ class BaseGame(object):
         "Show the current state of the game."
         pass
 
+    def puzzle_kind(self):
+        """
+        Return a tuple telling apart the puzzles of this game (e.g. by
+        difficulty) for the puzzle pool, None for games without puzzles.
+        """
+        return None
+
+    def make_puzzle(self):
+        "Generate a puzzle for use_puzzle, as JSON-serializable data."
+        return None
+
+    def use_puzzle(self, puzzle):
+        "Play a puzzle made by make_puzzle for the same puzzle_kind."
+        pass
+
     def is_running(self):
         return self.running
 
@@ -392,6 +453,8 @@ class Boggle(BaseGame):
     "The Boggle game implementation."
 
     BOARD_SIZE = 4
+    # The letters are drawn from FREQUENCY_TABLE, 150 of them
+    MAX_BOARD_SIZE = 12
     FREQUENCY_TABLE = {
         19: "E",
         13: "T",
@@ -528,19 +591,36 @@ class Boggle(BaseGame):
         def sorted_results(self):
             return sorted(list(self.player_results.values()), reverse=True)
 
-    def __init__(self, words, irc, channel, nick, delay, duration, difficulty):
+    def __init__(
+        self,
+        dictionary,
+        irc,
+        channel,
+        nick,
+        delay,
+        duration,
+        difficulty,
+        wordtrie,
+        size=BOARD_SIZE,
+        attempts=5,
+        solver=None,
+    ):
         # See tech note in the WordGames class.
         self.parent = super(Boggle, self)
-        self.parent.__init__(words, irc, channel)
+        self.parent.__init__(dictionary, irc, channel)
+        self.wordtrie = wordtrie
+        self.size = min(max(size, 3), Boggle.MAX_BOARD_SIZE)
+        self.attempts = max(attempts, 1)
+        self.solver = solver or BoardSolver()
         self.delay = delay
         self.duration = duration
         self.difficulty = difficulty
         self.max_targets = get_max_targets(irc)
         self._handle_difficulty()
-        self.board = self._generate_board()
+        self.board = None
         self.event_name = "Boggle.%d" % id(self)
         self.init_time = time.time()
-        self.longest_len = len(max(self.board.solutions, key=len))
+        self.longest_len = 0
         self.starter = nick
         self.state = Boggle.State.PREGAME
         self.players = []
@@ -611,6 +691,9 @@ class Boggle(BaseGame):
         self.announce("Solutions: " + " ".join(sorted(self.board.solutions)))
 
     def start(self):
+        if self.board is None:
+            self.use_puzzle(self.make_puzzle())
+            self.init_time = time.time()
         self.parent.start()
         self._broadcast("startup", [self.channel], True, seconds=self.delay)
         self.join(self.starter)
@@ -778,7 +861,7 @@ class Boggle(BaseGame):
     def _display_board(self, nick=None):
         "Display the board to everyone or just one nick if specified."
         commandChar = str(conf.supybot.reply.whenAddressedBy.chars)[0]
-        help_msgs = [""] * Boggle.BOARD_SIZE
+        help_msgs = [""] * self.size
         help_msgs[1] = "%sLet's GO!" % (WHITE)
         help_msgs[2] = "%s%s%s seconds left!" % (
             LYELLOW,
@@ -792,28 +875,46 @@ class Boggle(BaseGame):
             else:
                 self._broadcast_text(text, self.players + [self.channel], True)
 
+    def puzzle_kind(self):
+        return ("Boggle", Difficulty.name(self.difficulty), self.size, self.attempts)
+
+    def make_puzzle(self):
+        board = self._generate_board()
+        return {"rows": board.rows, "solutions": sorted(board.solutions)}
+
+    def use_puzzle(self, puzzle):
+        self.board = BoggleBoard(
+            self.wordtrie,
+            self.size,
+            self.min_length,
+            puzzle["rows"],
+            set(puzzle["solutions"]),
+        )
+        self.longest_len = len(max(self.board.solutions, key=len))
+
     def _generate_board(self):
         "Generate several boards and return the most bountiful board."
-        attempts = 5
-        wordtrie = Trie()
-        list(map(wordtrie.add, self.words))
         boards = [
-            BoggleBoard(wordtrie, Boggle.BOARD_SIZE, self.min_length)
-            for i in range(0, attempts)
+            BoggleBoard._generate_rows(self.size) for i in range(0, self.attempts)
         ]
-        board_quality = lambda b: len(b.solutions)
-        return max(boards, key=board_quality)
+        solutions = self.solver.solve_boards(self.wordtrie, boards, self.min_length)
+        best = max(range(0, len(boards)), key=lambda i: len(solutions[i]))
+        return BoggleBoard(
+            self.wordtrie, self.size, self.min_length, boards[best], solutions[best]
+        )
 
 
 class BoggleBoard(object):
     "Represents the board in a Boggle game."
 
-    def __init__(self, wordtrie, n, min_length):
-        "Generate a new n x n Boggle board."
+    def __init__(self, wordtrie, n, min_length, rows=None, solutions=None):
+        "Generate a new n x n Boggle board, or use the given rows."
         self.size = n
         self.min_length = min_length
-        self.rows = self._generate_rows()
-        self.solutions = self._find_solutions(wordtrie)
+        self.rows = rows if rows else self._generate_rows(n)
+        if solutions is None:
+            solutions = self._find_solutions(wordtrie)
+        self.solutions = solutions
 
     def render(self):
         "Render the board for display in IRC as a list of strings."
@@ -824,50 +925,13 @@ class BoggleBoard(object):
             result.append(text)
         return result
 
-    def _find_solutions(self, wordtrie, visited=None, row=0, col=0, prefix=""):
+    def _find_solutions(self, wordtrie):
         "Discover and return the set of all solutions for the current board."
-        result = set()
-        if visited == None:
-            for row in range(0, self.size):
-                for col in range(0, self.size):
-                    result.update(self._find_solutions(wordtrie, [], row, col, ""))
-        else:
-            visited = visited + [(row, col)]
-            current = prefix + self.rows[row][col].lower()
-            if current[-1] == "q":
-                current += "u"
-            node = wordtrie.find_prefix(current)
-            if node:
-                if node["*"] and len(current) >= self.min_length:
-                    result.add(current)
-                # Explore all 8 directions out from here
-                offsets = [
-                    (-1, -1),
-                    (-1, 0),
-                    (-1, 1),
-                    (0, -1),
-                    (0, 1),
-                    (1, -1),
-                    (1, 0),
-                    (1, 1),
-                ]
-                for offset in offsets:
-                    point = (row + offset[0], col + offset[1])
-                    if point in visited:
-                        continue
-                    if point[0] < 0 or point[0] >= self.size:
-                        continue
-                    if point[1] < 0 or point[1] >= self.size:
-                        continue
-                    result.update(
-                        self._find_solutions(
-                            wordtrie, visited, point[0], point[1], current
-                        )
-                    )
-        return result
+        return solve(wordtrie, self.rows, self.min_length)
 
-    def _generate_rows(self):
-        "Randomly generate a Boggle board (a list of lists)."
+    @staticmethod
+    def _generate_rows(size):
+        "Randomly generate a size x size Boggle board (a list of lists)."
         letters = reduce(
             add,
             (
@@ -881,10 +945,10 @@ class BoggleBoard(object):
             ),
         )
         rows = []
-        values = random.sample(letters, self.size ** 2)
-        for i in range(0, self.size):
-            start = self.size * i
-            end = start + self.size
+        values = random.sample(letters, size ** 2)
+        for i in range(0, size):
+            start = size * i
+            end = start + size
             rows.append(values[start:end])
         return rows
 
@@ -892,6 +956,9 @@ class BoggleBoard(object):
 class WordChain(BaseGame):
     "Base class for word-chain games like WordShrink and WordTwist."
 
+    # Solutions kept and shown by solve(), the others are only counted
+    SHOWN_SOLUTIONS = 3
+
     class Settings:
         """
         Parameters affecting the behavior of this class:
@@ -909,23 +976,24 @@ class WordChain(BaseGame):
             self.word_lengths = word_lengths
             self.num_solutions = num_solutions
 
-    def __init__(self, words, irc, channel, settings):
+    def __init__(self, dictionary, irc, channel, settings):
         # See tech note in the WordGames class.
         self.parent = super(WordChain, self)
-        self.parent.__init__(words, irc, channel)
+        self.parent.__init__(dictionary, irc, channel)
         self.settings = settings
         self.solution_length = random.choice(settings.puzzle_lengths)
         self.solution = []
         self.solutions = []
+        self.num_solutions = 0
         self.word_map = {}
-        if settings.word_lengths:
-            self.words = [w for w in self.words if len(w) in settings.word_lengths]
-        else:
-            self.words = [w for w in self.words if len(w) >= 3]
+        self.words = dictionary.filter(settings.word_lengths)
+        self.word_set = dictionary.word_set(settings.word_lengths)
         self.build_word_map()
 
-    def start(self):
-        # Build a puzzle
+    def puzzle_kind(self):
+        return (self.__class__.__name__, self.difficulty)
+
+    def make_puzzle(self):
         attempts = 100000  # Prevent infinite loops
         while attempts:
             self.solution = []
@@ -946,20 +1014,15 @@ class WordChain(BaseGame):
                     if not values:
                         break
                     self.solution.append(random.choice(values))
-            self.solutions = []
-            self._find_solutions()
-            # Enforce maximum solutions limit (difficulty parameter)
-            happy = True
-            if (
-                self.settings.num_solutions
-                and len(self.solutions) not in self.settings.num_solutions
-            ):
-                happy = False
-            # Ensure no solution is trivial
-            for solution in self.solutions:
-                if self.is_trivial_solution(solution):
-                    happy = False
-                    break
+            # Enforce solutions limit (difficulty parameter), counting no
+            # further than the limit, then ensure no solution is trivial
+            limit = None
+            if self.settings.num_solutions:
+                limit = max(self.settings.num_solutions) + 1
+            self.num_solutions = self._count_solutions(limit)
+            happy = (
+                not limit or self.num_solutions in self.settings.num_solutions
+            ) and not self.has_trivial_solution()
             if happy:
                 break
         if not happy:
@@ -970,8 +1033,23 @@ class WordChain(BaseGame):
                 )
                 % self.__class__.__name__
             )
+        solutions = self._iter_solutions()
+        self.solutions = list(itertools.islice(solutions, self.SHOWN_SOLUTIONS))
+        return {
+            "solution": self.solution,
+            "solutions": self.solutions,
+            "num_solutions": self.num_solutions,
+        }
 
-        # Start the game
+    def use_puzzle(self, puzzle):
+        self.solution = puzzle["solution"]
+        self.solutions = puzzle["solutions"][: self.SHOWN_SOLUTIONS]
+        self.num_solutions = puzzle.get("num_solutions", len(puzzle["solutions"]))
+        self.solution_length = len(self.solution)
+
+    def start(self):
+        if not self.solution:
+            self.use_puzzle(self.make_puzzle())
         self.show()
         self.parent.start()
 
@@ -981,17 +1059,16 @@ class WordChain(BaseGame):
             words.append("-" * len(word))
         words.append(self.solution[-1])
         self.announce(self._join_words(words))
-        num = len(self.solutions)
+        num = self.num_solutions
         self.send(
             "(%s%d%s possible solution%s)"
             % (WHITE, num, LGRAY, "" if num == 1 else "s")
         )
 
     def solve(self):
-        show = 3
-        for solution in self.solutions[:show]:
+        for solution in self.solutions:
             self.announce(self._join_words(solution))
-        not_shown = len(self.solutions) - show
+        not_shown = self.num_solutions - len(self.solutions)
         if not_shown > 0:
             self.announce(
                 "(%d more solution%s not shown.)"
@@ -1020,7 +1097,10 @@ class WordChain(BaseGame):
 
     # Override in game class
     def build_word_map(self):
-        "Build a map of word -> [word1, word2] for all valid transitions."
+        """
+        Build a map of word -> [word1, word2] for all valid transitions. The
+        map may be shared with other games and must not be modified.
+        """
         pass
 
     # Override in game class
@@ -1031,24 +1111,60 @@ class WordChain(BaseGame):
         "Lookup a word in the map and return list of possible successor words."
         return self.word_map.get(word, [])
 
-    def _find_solutions(self, seed=None):
-        "Recursively find and save all solutions for the puzzle."
-        if seed is None:
-            seed = [self.solution[0]]
-            self.solutions = []
-            self._find_solutions(seed)
-        elif len(seed) == len(self.solution) - 1:
-            if self.solution[-1] in self._get_successors(seed[-1]):
-                self.solutions.append(seed + [self.solution[-1]])
-        else:
-            words = self._get_successors(seed[-1])
-            for word in words:
-                if word in seed:
+    def has_trivial_solution(self):
+        "Return True if any solution of the puzzle is trivial."
+        for solution in self._iter_solutions():
+            if self.is_trivial_solution(solution):
+                return True
+        return False
+
+    def _count_chains(self, word, steps, limit, memo):
+        """
+        Count the chains of at most steps words after word that end with the
+        final word, stopping at limit. Counts are memoized by (word, steps)
+        in memo, which must only be shared by calls with the same limit.
+        """
+        if word == self.solution[-1]:
+            return 1
+        if steps == 0:
+            return 0
+        key = (word, steps)
+        if key not in memo:
+            total = 0
+            for successor in self._get_successors(word):
+                total += self._count_chains(successor, steps - 1, limit, memo)
+                if limit and total >= limit:
+                    total = limit
+                    break
+            memo[key] = total
+        return memo[key]
+
+    def _count_solutions(self, limit=None, steps=None):
+        """
+        Count the solutions for the puzzle, or the ones of at most steps hops,
+        stopping at limit. Chains repeating a word are counted too, but such
+        a chain contains a shorter solution, which WordShrink can't have and
+        WordTwist considers trivial.
+        """
+        if steps is None:
+            steps = len(self.solution) - 1
+        return self._count_chains(self.solution[0], steps, limit, {})
+
+    def _iter_solutions(self):
+        "Generate the solutions for the puzzle, in the order of the word map."
+        memo = {}
+
+        def extend(seed):
+            steps = len(self.solution) - len(seed) - 1
+            for word in self._get_successors(seed[-1]):
+                if word in seed or not self._count_chains(word, steps, 1, memo):
                     continue
                 if word == self.solution[-1]:
-                    self.solutions.append(seed + [word])
+                    yield seed + [word]
                 else:
-                    self._find_solutions(seed + [word])
+                    yield from extend(seed + [word])
+
+        return extend([self.solution[0]])
 
     def _join_words(self, words):
         sep = "%s > %s" % (LGREEN, YELLOW)
@@ -1070,7 +1186,7 @@ class WordChain(BaseGame):
             return False
         # Check dictionary
         for word in words:
-            if word not in self.words:
+            if word not in self.word_set:
                 self.send("%s: %s is not a word I know." % (nick, word))
                 return False
         # Enforce pairwise relationships
@@ -1084,7 +1200,7 @@ class WordChain(BaseGame):
 
 
 class WordShrink(WordChain):
-    def __init__(self, words, irc, channel, difficulty):
+    def __init__(self, dictionary, irc, channel, difficulty):
         assert difficulty in ["easy", "medium", "hard", "evil"], "Bad mojo."
         settings = {
             "easy": WordChain.Settings([4], list(range(3, 9)), list(range(15, 100))),
@@ -1092,30 +1208,12 @@ class WordShrink(WordChain):
             "hard": WordChain.Settings([6], list(range(4, 12)), list(range(4, 12))),
             "evil": WordChain.Settings([7], list(range(4, 15)), list(range(1, 10))),
         }
-        super(WordShrink, self).__init__(words, irc, channel, settings[difficulty])
+        self.difficulty = difficulty
+        super(WordShrink, self).__init__(dictionary, irc, channel, settings[difficulty])
 
     def build_word_map(self):
         "Build a map of word -> [word1, word2] for all valid transitions."
-        keymap = {}
-        for word in self.words:
-            s = "".join(sorted(word))
-            if s in keymap:
-                keymap[s].append(word)
-            else:
-                keymap[s] = [word]
-        self.word_map = {}
-        for word1 in self.words:
-            s = "".join(sorted(word1))
-            if s in self.word_map:
-                self.word_map[word1] = self.word_map[s]
-            else:
-                self.word_map[s] = self.word_map[word1] = []
-                keys = set()
-                for i in range(0, len(s)):
-                    keys.add(s[0:i] + s[i + 1 :])
-                for key in keys:
-                    for word2 in keymap.get(key, []):
-                        self.word_map[s].append(word2)
+        self.word_map = self.dictionary.shrink_map(self.settings.word_lengths)
 
     def is_trivial_solution(self, solution):
         "Consider pure substring solutions trivial."
@@ -1127,7 +1225,7 @@ class WordShrink(WordChain):
 
 
 class WordTwist(WordChain):
-    def __init__(self, words, irc, channel, difficulty):
+    def __init__(self, dictionary, irc, channel, difficulty):
         assert difficulty in ["easy", "medium", "hard", "evil"], "Bad mojo."
         settings = {
             "easy": WordChain.Settings([4], [3, 4], list(range(10, 100))),
@@ -1135,30 +1233,20 @@ class WordTwist(WordChain):
             "hard": WordChain.Settings([6], [4, 5, 6], list(range(2, 5))),
             "evil": WordChain.Settings([7], [4, 5, 6], list(range(1, 3))),
         }
-        super(WordTwist, self).__init__(words, irc, channel, settings[difficulty])
+        self.difficulty = difficulty
+        super(WordTwist, self).__init__(dictionary, irc, channel, settings[difficulty])
 
     def build_word_map(self):
         "Build the map of word -> [word1, word2, ...] for all valid pairs."
-        keymap = {}
-        wildcard = "*"
-        for word in self.words:
-            for pos in range(0, len(word)):
-                key = word[0:pos] + wildcard + word[pos + 1 :]
-                if key not in keymap:
-                    keymap[key] = [word]
-                else:
-                    keymap[key].append(word)
-        self.word_map = {}
-        for word in self.words:
-            self.word_map[word] = []
-            for pos in range(0, len(word)):
-                key = word[0:pos] + wildcard + word[pos + 1 :]
-                self.word_map[word] += [w for w in keymap.get(key, []) if w != word]
+        self.word_map = self.dictionary.twist_map(self.settings.word_lengths)
 
     def is_trivial_solution(self, solution):
         "If it's possible to get there in fewer hops, this is trivial."
         return len(solution) < self.solution_length
 
+    def has_trivial_solution(self):
+        return self._count_solutions(1, len(self.solution) - 2) > 0
+
 
 Class = WordGames
 
@@ -0,0 +1,158 @@
+###
+# Copyright (c) 2012, Mike Mueller
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Pool of pre-generated puzzles, refilled in the background so that games
+start without generating one.
+"""
+
+import json
+import os
+import threading
+
+from supybot import log
+
+
+class PuzzlePool(object):
+    """
+    Puzzles by kind (a tuple such as ("WordTwist", "evil")) for a version of
+    the dictionary. A background thread tops a kind up to size puzzles as
+    soon as it is down to low_water puzzles. With a filename, the puzzles are
+    kept there (see flush).
+    """
+
+    def __init__(self, filename=None, size=5, low_water=2):
+        self.filename = filename
+        self.size = size
+        self.low_water = min(low_water, size - 1)
+        self._puzzles = {}
+        self._generators = {}
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._dirty = False
+        self._load()
+
+    def take(self, kind, version, generate):
+        """
+        Remove and return a puzzle of kind generated for this version of the
+        dictionary, None if there is none. generate() makes a new puzzle of
+        kind, it is used to refill the pool.
+        """
+        if self.size <= 0:
+            return None
+        key = "\t".join(map(str, kind))
+        with self._condition:
+            puzzles = [p for p in self._puzzles.get(key, []) if p[0] == version]
+            puzzle = puzzles.pop(0)[1] if puzzles else None
+            if puzzle is not None or len(puzzles) != len(self._puzzles.get(key, [])):
+                self._dirty = True
+            self._puzzles[key] = puzzles
+            self._generators[key] = (version, generate)
+            if len(puzzles) <= self.low_water and key not in self._pending:
+                self._pending.append(key)
+                self._start()
+                self._condition.notify()
+        return puzzle
+
+    def count(self, kind):
+        "Return the number of puzzles of kind in the pool."
+        with self._condition:
+            return len(self._puzzles.get("\t".join(map(str, kind)), []))
+
+    def stop(self):
+        "Stop refilling the pool."
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def flush(self):
+        "Write the puzzles to the pool's file, if they changed."
+        if not self.filename:
+            return
+        with self._condition:
+            if not self._dirty:
+                return
+            data = json.dumps({"puzzles": self._puzzles})
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            temp = "%s.tmp" % self.filename
+            with open(temp, "w") as f:
+                f.write(data)
+            os.replace(temp, self.filename)
+        except OSError as e:
+            log.error("WordGames: unable to save puzzles: %s" % str(e))
+
+    def _load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                puzzles = json.load(f)["puzzles"]
+            self._puzzles = {
+                key: [(version, puzzle) for (version, puzzle) in value]
+                for (key, value) in puzzles.items()
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            log.error("WordGames: ignoring puzzle file %s: %s" % (self.filename, e))
+
+    def _start(self):
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(
+                target=self._run, name="WordGames puzzle pool", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                key = self._pending[0]
+                (version, generate) = self._generators[key]
+                if len(self._puzzles.get(key, [])) >= self.size:
+                    self._pending.pop(0)
+                    continue
+            try:
+                puzzle = generate()
+            except Exception as e:
+                log.error("WordGames: unable to generate a puzzle: %s" % str(e))
+                with self._condition:
+                    self._pending.remove(key)
+                continue
+            with self._condition:
+                # Puzzles for an older dictionary than the last game's are dropped
+                if self._generators[key][0] == version:
+                    self._puzzles.setdefault(key, []).append((version, puzzle))
+                    self._dirty = True
@@ -0,0 +1,197 @@
+###
+# Copyright (c) 2012, Mike Mueller
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Boggle solver: finds every word of a board by walking the board and the word
+graph (trie.Dawg) together.
+"""
+
+import importlib.machinery
+import importlib.util
+import multiprocessing
+import os
+import runpy
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+PACKAGE = __name__.rpartition(".")[0]
+# Name this file runs under in the workers
+WORKER = "__worker__"
+
+# Word graph of a worker process, as (file name, Dawg)
+_worker_trie = None
+
+
+@lru_cache(maxsize=None)
+def neighbours(size):
+    """
+    Return the cells next to each cell (in all 8 directions) of a size x size
+    board, cells being numbered row by row.
+    """
+    result = []
+    for cell in range(size * size):
+        (row, col) = divmod(cell, size)
+        result.append(
+            tuple(
+                r * size + c
+                for r in range(row - 1, row + 2)
+                for c in range(col - 1, col + 2)
+                if 0 <= r < size and 0 <= c < size and (r, c) != (row, col)
+            )
+        )
+    return tuple(result)
+
+
+def solve(wordtrie, rows, min_length):
+    """
+    Return the set of words of at least min_length letters that can be made
+    from adjacent cells of the board rows (a list of lists of letters, "Q"
+    standing for "qu"), each cell used once.
+    """
+    size = len(rows)
+    cells = [letter.lower() for row in rows for letter in row]
+    cells = [letters + "u" if letters == "q" else letters for letters in cells]
+    adjacent = neighbours(size)
+    (labels, first, targets, finals) = (
+        wordtrie.labels,
+        wordtrie.first,
+        wordtrie.targets,
+        wordtrie.finals,
+    )
+
+    def descend(node, letters):
+        for letter in letters:
+            edge = labels.find(letter, first[node], first[node + 1])
+            if edge < 0:
+                return -1
+            node = targets[edge]
+        return node
+
+    result = set()
+    for start in range(len(cells)):
+        node = descend(0, cells[start])
+        if node < 0:
+            continue
+        stack = [(start, node, 1 << start, cells[start])]
+        while stack:
+            (cell, node, visited, word) = stack.pop()
+            if finals[node] == 1 and len(word) >= min_length:
+                result.add(word)
+            (low, high) = (first[node], first[node + 1])
+            for other in adjacent[cell]:
+                if visited >> other & 1:
+                    continue
+                letters = cells[other]
+                edge = labels.find(letters[0], low, high)
+                if edge < 0:
+                    continue
+                child = targets[edge]
+                if len(letters) > 1:
+                    child = descend(child, letters[1:])
+                if child >= 0:
+                    stack.append(
+                        (other, child, visited | 1 << other, word + cells[other])
+                    )
+    return result
+
+
+def _register_package(package, path):
+    """
+    Lets a worker import the plugin's modules (the solver is sent by name)
+    without running the plugin's __init__, which needs a bot.
+    """
+    if package not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(package, None, is_package=True)
+        module = importlib.util.module_from_spec(spec)
+        module.__path__ = [path]
+        sys.modules[package] = module
+
+
+def _solve_in_worker(filename, rows, min_length):
+    global _worker_trie
+    if _worker_trie is None or _worker_trie[0] != filename:
+        # Not imported at the top: this file also runs outside of its package
+        from .trie import Dawg
+
+        _worker_trie = (filename, Dawg.load(filename))
+    return solve(_worker_trie[1], rows, min_length)
+
+
+class BoardSolver(object):
+    """
+    Solves boards (see solve) in a pool of worker processes, or in the
+    calling thread with fewer than 2 workers. The workers map the word graph
+    from its file, so graphs that aren't saved (see trie.load_dawg) are also
+    solved in the calling thread.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._executor = self._new_executor() if workers > 1 else None
+
+    def solve_boards(self, wordtrie, boards, min_length):
+        "Return the solutions of each board."
+        if self._executor is None or wordtrie.filename is None or len(boards) < 2:
+            return [solve(wordtrie, rows, min_length) for rows in boards]
+        count = len(boards)
+        return list(
+            self._executor.map(
+                _solve_in_worker,
+                [wordtrie.filename] * count,
+                boards,
+                [min_length] * count,
+            )
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _new_executor(self):
+        # Forking the bot would copy its threads' locks in whatever state they
+        # are in, so workers start from a fresh interpreter. Nothing of the
+        # plugin can be unpickled there before its package is registered, so
+        # this file is run by path to do it.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        else:
+            context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(
+            self.workers,
+            mp_context=context,
+            initializer=runpy.run_path,
+            initargs=(os.path.abspath(__file__), {"WORKER_PACKAGE": PACKAGE}, WORKER),
+        )
+
+
+if __name__ == WORKER:
+    _register_package(WORKER_PACKAGE, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,321 @@
+###
+# Copyright (c) 2012, Mike Mueller
+# Copyright (c) 2020, oddluck <oddluck@riseup.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Through the modules: loading the plugin reloads them
+from . import dictionary, plugin, pool, solver, trie
+
+# Long enough that the pool's thread never misses it by accident
+WAIT = 10
+
+WORDS = ["cab", "cabs", "scab", "bad", "dab", "dabs", "abs", "sad", "ads", "cad"]
+
+
+class BoardSolverTestCase(SupyTestCase):
+    boards = [
+        [["c", "a", "b"], ["d", "s", "x"], ["x", "x", "x"]],
+        [["s", "c", "a"], ["x", "x", "b"], ["d", "a", "s"]],
+        [["q", "a", "d"], ["s", "b", "a"], ["c", "x", "x"]],
+    ]
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.wordtrie = trie.Dawg.build(WORDS)
+        self.wordtrie.save(os.path.join(self.directory, "dawg.bin"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def testWorkers(self):
+        expected = [solver.solve(self.wordtrie, rows, 3) for rows in self.boards]
+        self.assertIn("cabs", expected[0])
+        board_solver = solver.BoardSolver(2)
+        try:
+            self.assertEqual(
+                board_solver.solve_boards(self.wordtrie, self.boards, 3), expected
+            )
+        finally:
+            board_solver.shutdown()
+
+
+class DawgTestCase(SupyTestCase):
+    words = WORDS + ["a", "abba", "abbas", "bass", "bassist", "zebra"]
+    others = ["", "ab", "abb", "abbass", "ca", "cabss", "dabsx", "zeb", "zz", "q"]
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def assertAgrees(self, wordtrie):
+        reference = trie.Trie()
+        for word in self.words:
+            reference.add(word)
+        for value in self.words + self.others:
+            self.assertEqual(wordtrie.find(value), bool(reference.find(value)), value)
+            self.assertEqual(
+                wordtrie.find_prefix(value) is not None,
+                reference.find_prefix(value) is not None,
+                value,
+            )
+
+    def testTrie(self):
+        self.assertAgrees(trie.Dawg.build(self.words))
+
+    def testSaveLoad(self):
+        dawg = trie.Dawg.build(self.words)
+        filename = os.path.join(self.directory, "dawg.bin")
+        dawg.save(filename)
+        self.assertEqual(dawg.filename, filename)
+        loaded = trie.Dawg.load(filename)
+        self.assertEqual(loaded.filename, filename)
+        self.assertEqual(loaded.labels, dawg.labels)
+        self.assertEqual(list(loaded.first), list(dawg.first))
+        self.assertEqual(list(loaded.targets), list(dawg.targets))
+        self.assertEqual(bytes(loaded.finals), bytes(dawg.finals))
+        self.assertAgrees(loaded)
+
+    def testLoadInvalid(self):
+        filename = os.path.join(self.directory, "dawg.bin")
+        with open(filename, "wb") as f:
+            f.write(b"DAWG not really")
+        self.assertRaises(ValueError, trie.Dawg.load, filename)
+
+    def testStaleFiles(self):
+        path = os.path.join(self.directory, "words")
+        cache = os.path.join(self.directory, "cache")
+        with open(path, "w") as f:
+            f.write("\n".join(self.words))
+        trie.load_dawg(path, "^[a-z]+$", lambda: self.words, cache)
+        trie.load_dawg(path, "^[a-y]+$", lambda: self.words[:-1], cache)
+        self.assertEqual(len(os.listdir(cache)), 2)
+        with open(path, "a") as f:
+            f.write("\nzebras")
+        dawg = trie.load_dawg(path, "^[a-z]+$", lambda: self.words + ["zebras"], cache)
+        self.assertTrue(dawg.find("zebras"))
+        # The other pattern's graph is kept, the older one of this pattern not
+        names = sorted(os.listdir(cache))
+        self.assertEqual(len(names), 2)
+        self.assertIn(os.path.basename(dawg.filename), names)
+        loaded = trie.Dawg.load(dawg.filename)
+        self.assertTrue(loaded.find("zebras"))
+
+
+class WordChainTestCase(SupyTestCase):
+    twist = "cat cot cog dog dot cut hut hot hat bat bag big bog dig dug"
+    shrink = (
+        "smarts smart mart tram arms rams mast mats star tars rats arts tsar "
+        "art rat tar arm ram mat tam sat"
+    )
+    # Game class, word file, solution, number of solutions and whether one of
+    # them is trivial
+    puzzles = [
+        ("WordTwist", twist, ["cat", "cot", "cog", "dog"], 2, False),
+        ("WordTwist", twist, ["hat", "hot", "cot", "cog"], 2, False),
+        ("WordTwist", twist, ["bat", "bag", "bog", "dog", "dig"], 3, True),
+        ("WordShrink", shrink, ["smart", "mast", "sat"], 7, False),
+        ("WordShrink", shrink, ["smart", "star", "art"], 7, True),
+        ("WordShrink", shrink, ["smarts", "smart", "mart", "art"], 7, True),
+    ]
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def game(self, name, words, solution):
+        path = os.path.join(self.directory, "words")
+        with open(path, "w") as f:
+            f.write("\n".join(words.split()))
+        game = getattr(plugin, name)(
+            dictionary.Dictionary(path, "^[a-z]+$"), None, "#test", "easy"
+        )
+        game.solution = solution
+        game.solution_length = len(solution)
+        return game
+
+    def brute_force(self, game):
+        "All the solutions, searched the way puzzles were checked before."
+        solutions = []
+
+        def walk(seed):
+            for word in game.word_map.get(seed[-1], []):
+                if word in seed:
+                    continue
+                if word == game.solution[-1]:
+                    solutions.append(seed + [word])
+                elif len(seed) < len(game.solution) - 1:
+                    walk(seed + [word])
+
+        walk([game.solution[0]])
+        return solutions
+
+    def testCount(self):
+        for (name, words, solution, count, trivial) in self.puzzles:
+            game = self.game(name, words, solution)
+            solutions = self.brute_force(game)
+            self.assertEqual(len(solutions), count, solution)
+            self.assertEqual(
+                any(map(game.is_trivial_solution, solutions)), trivial, solution
+            )
+            self.assertEqual(game.has_trivial_solution(), trivial, solution)
+            self.assertEqual(
+                sorted(game._iter_solutions()), sorted(solutions), solution
+            )
+            self.assertEqual(game._count_solutions(), count, solution)
+            # Counting stops at the limit, whether it's reached or not
+            for limit in range(1, count + 2):
+                self.assertEqual(
+                    game._count_solutions(limit), min(limit, count), (solution, limit)
+                )
+
+
+class Generator:
+    """
+    Stands in for a game's make_puzzle: numbers the puzzles it makes, raises
+    when failing is set and holds until hold is set, if it is given. started
+    is set once it's called.
+    """
+
+    def __init__(self, name="puzzle", failing=False, hold=None):
+        self.name = name
+        self.failing = failing
+        self.hold = hold
+        self.started = threading.Event()
+        self.made = 0
+
+    def __call__(self):
+        self.started.set()
+        if self.hold is not None:
+            self.hold.wait(WAIT)
+        if self.failing:
+            raise ValueError("no puzzle")
+        self.made += 1
+        return "%s %d" % (self.name, self.made)
+
+
+class PuzzlePoolTestCase(SupyTestCase):
+    kind = ("WordTwist", "easy")
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.pools = []
+
+    def tearDown(self):
+        for puzzles in self.pools:
+            puzzles.stop()
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def pool(self, *args, **kwargs):
+        puzzles = pool.PuzzlePool(*args, **kwargs)
+        self.pools.append(puzzles)
+        return puzzles
+
+    def waitFor(self, condition):
+        deadline = time.time() + WAIT
+        while not condition():
+            self.assertLess(time.time(), deadline, "timed out")
+            time.sleep(0.01)
+
+    def testRefill(self):
+        puzzles = self.pool(size=3, low_water=1)
+        generate = Generator()
+        self.assertIsNone(puzzles.take(self.kind, "v1", generate))
+        self.waitFor(lambda: puzzles.count(self.kind) == 3)
+        self.assertEqual(puzzles.take(self.kind, "v1", generate), "puzzle 1")
+        # Above low water: no refill
+        time.sleep(0.05)
+        self.assertEqual(generate.made, 3)
+        self.assertEqual(puzzles.take(self.kind, "v1", generate), "puzzle 2")
+        self.waitFor(lambda: puzzles.count(self.kind) == 3)
+        self.assertEqual(generate.made, 5)
+
+    def testStaleVersion(self):
+        puzzles = self.pool(size=1, low_water=0)
+        puzzles.take(self.kind, "v1", Generator("old"))
+        self.waitFor(lambda: puzzles.count(self.kind) == 1)
+        # Puzzles of another version are not handed out
+        new = Generator("new")
+        self.assertIsNone(puzzles.take(self.kind, "v2", new))
+        self.waitFor(lambda: puzzles.count(self.kind) == 1)
+        self.assertEqual(puzzles.take(self.kind, "v2", new), "new 1")
+        # Nor kept when they were being made as the version changed
+        puzzles = self.pool(size=1, low_water=0)
+        old = Generator("old", hold=threading.Event())
+        puzzles.take(self.kind, "v1", old)
+        self.assertTrue(old.started.wait(WAIT))
+        newer = Generator("newer")
+        puzzles.take(self.kind, "v2", newer)
+        old.hold.set()
+        self.waitFor(lambda: puzzles.count(self.kind) == 1)
+        self.assertEqual(old.made, 1)
+        self.assertEqual(puzzles._puzzles["\t".join(self.kind)], [("v2", "newer 1")])
+
+    def testFlushLoad(self):
+        filename = os.path.join(self.directory, "WordGames", "puzzles.json")
+        puzzles = self.pool(filename, size=2, low_water=0)
+        puzzles.take(self.kind, "v1", Generator())
+        self.waitFor(lambda: puzzles.count(self.kind) == 2)
+        puzzles.stop()
+        puzzles.flush()
+        loaded = self.pool(filename, size=2, low_water=0)
+        loaded.stop()
+        self.assertEqual(loaded._puzzles, puzzles._puzzles)
+        self.assertEqual(loaded.take(self.kind, "v1", Generator()), "puzzle 1")
+        # A broken file is ignored
+        with open(filename, "w") as f:
+            f.write("{")
+        self.assertEqual(self.pool(filename)._puzzles, {})
+
+    def testFailingGenerator(self):
+        puzzles = self.pool(size=2, low_water=0)
+        self.assertIsNone(puzzles.take(self.kind, "v1", Generator(failing=True)))
+        self.waitFor(lambda: puzzles._pending == [])
+        self.assertEqual(puzzles.count(self.kind), 0)
+        # The next take tries again
+        puzzles.take(self.kind, "v1", Generator())
+        self.waitFor(lambda: puzzles.count(self.kind) == 2)
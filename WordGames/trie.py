@@ -29,9 +29,18 @@
 ###
 
 """
-Quick & dirty prefix tree (aka trie).
+Quick & dirty prefix tree (aka trie), and a compact, read-only word graph
+(DAWG) built once per word file.
 """
 
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+
 # This got a little uglier because using a nice object-oriented approach took
 # too much time and memory on big trees.  Now every node is simply a dict,
 # with the special '*' field meaning that the word is complete at that node.
@@ -87,6 +96,218 @@ class Trie(object):
             self.dump(indent + 2, child_contents)
 
 
+class Dawg(object):
+    """
+    Directed acyclic word graph: a trie in which identical subtrees are
+    shared, stored in flat arrays. Nodes are numbered from 0 (the root). The
+    edges of node n are first[n] to first[n + 1], with labels[e] the letter
+    and targets[e] the node it leads to; finals[n] is 1 if a word ends at n.
+
+    The arrays are either in memory or a memory-mapped file (see save/load).
+    filename is the file the graph was loaded from or saved to, if any.
+    """
+
+    MAGIC = b"DAWG"
+    VERSION = 1
+    # Magic, version, number of nodes and of edges
+    HEADER = struct.Struct("<4sIII")
+
+    def __init__(self, labels, first, targets, finals, mapping=None):
+        self.labels = labels
+        self.first = first
+        self.targets = targets
+        self.finals = finals
+        self.mapping = mapping
+        self.filename = None
+
+    @classmethod
+    def build(cls, words):
+        "Build the minimal graph of an iterable of words."
+        # Nodes are [children, final], minimized while the sorted words are
+        # added: once a word diverges from the previous one, the previous
+        # word's remaining nodes can't change anymore and are replaced by an
+        # equivalent registered node if there is one.
+        nodes = [[{}, False]]
+        register = {}
+        unchecked = []
+        previous = ""
+
+        def minimize(down_to):
+            while len(unchecked) > down_to:
+                (parent, letter, child) = unchecked.pop()
+                (children, final) = nodes[child]
+                key = (final, tuple(sorted(children.items())))
+                if key in register:
+                    nodes[parent][0][letter] = register[key]
+                else:
+                    register[key] = child
+
+        for word in sorted(set(words)):
+            common = 0
+            for a, b in zip(word, previous):
+                if a != b:
+                    break
+                common += 1
+            minimize(common)
+            node = unchecked[-1][2] if unchecked else 0
+            for letter in word[common:]:
+                nodes.append([{}, False])
+                child = len(nodes) - 1
+                nodes[node][0][letter] = child
+                unchecked.append((node, letter, child))
+                node = child
+            nodes[node][1] = True
+            previous = word
+        minimize(0)
+        # Number the reachable nodes breadth first and flatten them
+        index = {0: 0}
+        order = [0]
+        labels = []
+        first = array.array("i", [0])
+        targets = array.array("i")
+        finals = bytearray()
+        for node in order:
+            (children, final) = nodes[node]
+            for letter in sorted(children):
+                child = children[letter]
+                if child not in index:
+                    index[child] = len(order)
+                    order.append(child)
+                labels.append(letter)
+                targets.append(index[child])
+            first.append(len(targets))
+            finals.append(1 if final else 0)
+        return cls("".join(labels), first, targets, bytes(finals))
+
+    @classmethod
+    def load(cls, filename):
+        "Map a graph saved with save(). Raises ValueError if it is invalid."
+        with open(filename, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, nodes, edges) = cls.HEADER.unpack_from(mapping)
+            size = cls.HEADER.size + 8 * edges + 4 * (nodes + 1) + nodes
+            if magic != cls.MAGIC or version != cls.VERSION or len(mapping) != size:
+                raise ValueError
+            start = cls.HEADER.size
+            labels = mapping[start : start + 4 * edges].decode("utf-32-le")
+        except (struct.error, ValueError):
+            mapping.close()
+            raise ValueError("%s is not a word graph" % filename)
+        view = memoryview(mapping)[cls.HEADER.size + 4 * edges :]
+        first = view[: 4 * (nodes + 1)].cast("i")
+        view = view[4 * (nodes + 1) :]
+        targets = view[: 4 * edges].cast("i")
+        finals = view[4 * edges :]
+        dawg = cls(labels, first, targets, finals, mapping)
+        dawg.filename = filename
+        return dawg
+
+    def save(self, filename):
+        "Write the graph to filename (atomically), in native int byte order."
+        if sys.byteorder != "little":
+            raise ValueError("Word graphs can only be saved on little endian hosts")
+        temp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temp, "wb") as f:
+            f.write(
+                self.HEADER.pack(
+                    self.MAGIC, self.VERSION, len(self.finals), len(self.targets)
+                )
+            )
+            f.write(self.labels.encode("utf-32-le"))
+            f.write(bytes(self.first))
+            f.write(bytes(self.targets))
+            f.write(bytes(self.finals))
+        os.replace(temp, filename)
+        self.filename = filename
+
+    def child(self, node, letter):
+        "Return the node reached from node by letter, or -1."
+        edge = self.labels.find(letter, self.first[node], self.first[node + 1])
+        return self.targets[edge] if edge >= 0 else -1
+
+    def is_final(self, node):
+        "Return true if a word ends at node."
+        return self.finals[node] == 1
+
+    def find_prefix(self, value):
+        "Return the node of the given prefix, or None if no word starts with it."
+        node = 0
+        for letter in value:
+            node = self.child(node, letter)
+            if node < 0:
+                return None
+        return node
+
+    def find(self, value):
+        "Return true if the value appears, false otherwise."
+        node = self.find_prefix(value)
+        return node is not None and self.is_final(node)
+
+    __contains__ = find
+
+
+_dawgs = {}
+_dawgs_lock = threading.Lock()
+
+
+def load_dawg(path, pattern, get_words, directory=None):
+    """
+    Return the Dawg of the words in the word file at path that match
+    pattern. get_words() is only called to build it. The graph is shared
+    until the file changes and, with a directory, kept there as a file named
+    after the word file's path and the pattern, then its mtime and size.
+    Files of older versions of the word file are removed once it's saved.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size, pattern)
+    with _dawgs_lock:
+        dawg = _dawgs.get(key)
+        if dawg is not None:
+            return dawg
+        filename = None
+        if directory:
+            source = hashlib.sha1(repr((path, pattern)).encode("utf-8")).hexdigest()
+            digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+            prefix = "dawg-%s-" % source
+            filename = os.path.join(directory, "%s%s.bin" % (prefix, digest))
+            try:
+                dawg = Dawg.load(filename)
+            except (OSError, ValueError):
+                dawg = None
+        if dawg is None:
+            dawg = Dawg.build(get_words())
+            if filename:
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                    dawg.save(filename)
+                except (OSError, ValueError):
+                    pass
+                else:
+                    _remove_stale(directory, prefix, filename)
+        # Graphs of older versions of the file are not used anymore
+        for old in [k for k in _dawgs if k[0] == path and k[3] == pattern]:
+            del _dawgs[old]
+        _dawgs[key] = dawg
+        return dawg
+
+
+def _remove_stale(directory, prefix, filename):
+    "Remove the graphs of directory named with prefix, except filename."
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        other = os.path.join(directory, name)
+        if name.startswith(prefix) and name.endswith(".bin") and other != filename:
+            try:
+                os.remove(other)
+            except OSError:
+                # Still in use, where that prevents removing it
+                pass
+
+
 if __name__ == "__main__":
     import resource
     import sys